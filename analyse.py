@@ -1,104 +1,224 @@
-#/usr/bin/env python
+#!/usr/bin/env python3
 
+import argparse
+import random
 import sys
 import os
-from itertools import izip
-import itertools
-from collections import defaultdict
-from csv_loader import csv_rows
-from word_parsing import (make_word, make_letter, WordParseError)
+import sqlite3
+import re
+from collections import Counter, defaultdict
+from analyses import (
+    Analysis,
+    all_tables,
+    analysis_classes,
+    cell_key,
+    default_tables,
+    register_analysis,
+    register_feature,
+    render_analyses,
+    render_parallel,
+    run_analyses,
+    scale_counts,
+    subtract_count,
+    UnknownTable,
+    update_analyses,
+)
+from corpus_diff import (
+    compare_entries,
+    count_entries,
+    delta_tables,
+    LINE,
+    ROWS,
+)
+from corpus_db import (
+    CorpusStore,
+    DB_FILE as CORPUS_DB_FILE,
+    parse_sequence,
+    parse_syllable,
+    read_syllables,
+)
+from csv_loader import csv_rows, is_plain_file, STDIN
+from export_check import check_export
+from drilldown import (
+    DrilldownIndex,
+    NoIndex,
+    pair_key,
+    query,
+    sequence_key,
+    UnknownCell,
+    WordSources,
+)
+from heavy_hitters import HeavyHitters
+from memory_report import MemoryReport, stage
+from morpheme_index import INDEX_FILE as MORPHEME_INDEX_FILE, MorphemeIndex
+from ngrams import Alphabet, iter_ngrams, NgramCounts
+from parse_errors import ParseErrorLog, TooManyParseErrors
+from progress import Progress
+from sampling import annotate_tables, COUNT, FRACTION, RATIO, reservoir_sample
+from spill import SpillingCounter
+from tones import (
+    contour,
+    CONTOURS,
+    melody,
+    melody_text,
+    parse_melody,
+    tone_code,
+)
+from table_writer import (
+    check_formats,
+    FORMATS,
+    iter_tabular_lines,
+    table_filename,
+    UnknownFormat,
+    write_delimited,
+    write_table,
+)
+from word_parsing import (
+    collation_key,
+    iter_clusters,
+    make_letter,
+    make_letters,
+    make_word,
+    set_syllable_rules,
+    SYLLABLE_RULES,
+)
 from syllable_counter import SyllableCounter
+from watch import watch
 
-def load_word_counts(filename):
+class UnknownColumn(KeyError):
+  pass
+
+
+def group_of(raw_row, group_by):
+  """
+  The group of the words on `raw_row` when grouping by the CSV column
+  `group_by`. Categories are normalized, as for the melody tables.
+
+  :raises UnknownColumn: If the CSV has no column `group_by`.
+  """
+  value = raw_row.get(group_by)
+  if value is None:
+    raise UnknownColumn('The CSV has no column %r' % group_by)
+  if group_by == 'Category':
+    return normalize_category(value)
+  return value
+
+
+# The memory a word type takes in the word counts, with its morphemes and
+# syllables, as measured on a real export.
+WORD_ENTRY_SIZE = 1024
+
+
+def encode_word(word):
+  return word.text(), word.gloss, word.category
+
+
+def decode_word(key):
+  return make_word(*key)
+
+
+def load_word_counts(filename, errors=None, sources=None, word_groups=None,
+                     group_by=None, memory_budget=None, progress=None):
   """
   Reads in a file and returns a dictionary of words mapped to counts.
+
+  :param ParseErrorLog errors: Where rows that fail to parse are recorded.
+  :param WordSources sources: Where the lines of every word are recorded.
+  :param word_groups: Where the counts of every word by group are recorded,
+    see `update_word_counts`.
+  :param int memory_budget: If not None, the words are counted in a
+    `SpillingCounter` keeping to this many bytes, instead of a dictionary.
+  :param progress.Progress progress: If not None, where the progress through
+    the file is reported.
   """
-  raw_rows = csv_rows(filename)
-  word_counts = defaultdict(lambda: 0)
+  if memory_budget is None:
+    word_counts = defaultdict(lambda: 0)
+  else:
+    word_counts = SpillingCounter(
+        memory_budget, encode_word, decode_word, WORD_ENTRY_SIZE)
+  update_word_counts(
+      word_counts, csv_rows(filename, progress, errors), errors=errors,
+      sources=sources,
+      word_groups=word_groups, group_by=group_by)
+  return word_counts
 
-  for line_number, raw_row in enumerate(raw_rows, 2):
-    count = int(raw_row["count"])
+
+def iter_row_words(raw_rows, first_line=2, errors=None):
+  """
+  Parses the words in `raw_rows`.
+
+  :param raw_rows: An iterable of row dicts, as produced by `csv_rows`.
+  :param int first_line: The CSV line number of the first row.
+  :param ParseErrorLog errors: Where rows that fail to parse are recorded.
+
+  :yields: (line number, word, count, ipa, gloss, row) tuples, the ipa and
+    gloss being the part of the row the word was parsed from.
+  """
+  if errors is None:
+    errors = ParseErrorLog()
+  for line_number, raw_row in enumerate(raw_rows, first_line):
     ipa = raw_row["IPA"]
     if '*' in ipa:
       continue
 
-    # Fixes random badness.. hopefully doesn't hide anything?
-    mod_ipa = ipa.replace('(', '').replace(')', '')
-
     # Work around a passage with an error in it:
     gloss = raw_row["Gloss"] or raw_row["Text"]
 
-    category = raw_row["Category"]
-
-    skipword_characters = {'?'}
     try:
-      for i, g in izip(mod_ipa.split('/'), gloss.split('/')):
-        word = make_word(i, g, category)
-        word_counts[word] += count
-    except WordParseError as e:
-      print (u"Error on line %d: %s [%s || %s]" %
-          (line_number, repr(e), ipa, gloss)).encode('utf-8')
-    except IndexError as e:
-      unknown_index = e.args[0]
-      if unknown_index in skipword_characters:
-        print (u"Bad char on line %d: %s [%s || %s]" %
-            (line_number, repr(e), ipa, gloss)).encode('utf-8')
-      else:
-        print "FATAL ERROR ON LINE %d" % line_number
-        raise
-    except:
-      print "FATAL ERROR ON LINE %d" % line_number
-      raise
-  return word_counts
+      count = int(raw_row["count"])
+
+      # Fixes random badness.. hopefully doesn't hide anything?
+      mod_ipa = ipa.replace('(', '').replace(')', '')
+
+      category = raw_row["Category"]
+
+      for i, g in zip(mod_ipa.split('/'), gloss.split('/')):
+        yield line_number, make_word(i, g, category), count, i, g, raw_row
+    except Exception as e:
+      errors.record(line_number, e, ipa, gloss)
 
 
-def iter_clusters(letter_iter):
+def update_word_counts(word_counts, raw_rows, first_line=2, errors=None,
+                       sources=None, word_groups=None, group_by=None,
+                       added=None):
   """
-  Turns an iterator of letters into an iterator of "clusters" where a cluster
-  is defined as a list of consecutive consonants or a single vowell.
+  Adds the words in `raw_rows` to `word_counts`.
+
+  :param word_counts: A dictionary of words mapped to counts (or a
+    `SpillingCounter`), updated in place.
+  :param raw_rows: An iterable of row dicts, as produced by `csv_rows`.
+  :param int first_line: The CSV line number of the first row.
+  :param ParseErrorLog errors: Where rows that fail to parse are recorded.
+  :param WordSources sources: If not None, where the lines of every word are
+    recorded.
+  :param word_groups: If not None, a dictionary of words mapped to
+    dictionaries of counts by group (see `group_of`), updated in place.
+  :param str group_by: The column the words are grouped by.
+  :param list added: If not None, where the word types that were not already
+    in `word_counts` are appended.
+
+  :returns: The number of word types that were not already in `word_counts`.
   """
-  consonants = []
-  for letter in letter_iter:
-    if letter.is_vowell():
-      if consonants:
-        yield tuple(consonants)
-        consonants = []
-      yield tuple([letter])
-    else:
-      consonants.append(letter)
-  if consonants:
-    yield tuple(consonants)
+  new_words = 0
+  for line_number, word, count, ipa, gloss, raw_row in iter_row_words(
+      raw_rows, first_line, errors):
+    if word not in word_counts:
+      new_words += 1
+      if added is not None:
+        added.append(word)
+    word_counts[word] += count
+    if sources is not None:
+      sources.add(word, line_number, ipa, gloss)
+    if word_groups is not None:
+      word_groups[word][group_of(raw_row, group_by)] += count
+  return new_words
 
 
 def print_table(rows):
-  for r in rows:
-    print u'\t'.join(r).encode('utf-8')
+  write_delimited(sys.stdout, rows, u'\t')
 
 def make_tabular(rows, has_summary_row=True):
-  output_rows = []
-  rows_iter = iter(rows)
-  rows_iter, leading_rows_iter = itertools.tee(rows_iter)
-  next(leading_rows_iter)
-  double_iter = itertools.izip(rows_iter, leading_rows_iter)
-  first_row, _ = next(double_iter)
-
-  output_rows.append(u'\\begin{tabular}{%s}' % u'|'.join(
-    (u'l|',) + tuple(u'l' for _ in xrange(len(first_row)-2)) + (u'|l',))
-  )
-  output_rows.append(u'%s \\\\' % u' & '.join(first_row))
-  output_rows.extend(u'\\hline' for _ in xrange(2))
-  output_rows.extend(u'%s \\\\' % u' & '.join(r) for r, _ in double_iter)
-
-  last_row = rows[-1]
-
-  if has_summary_row:
-    output_rows.extend(u'\\hline' for _ in xrange(2))
-  output_rows.append(u'%s \\\\' % u' & '.join(last_row))
-
-  output_rows.append(u'\end{tabular}')
-
-
-  return u'\n'.join(output_rows)
+  return u'\n'.join(iter_tabular_lines(rows, has_summary_row))
 
 def render_syllable(tl):
   return u'\\textipa{%s}' %  u''.join(l.to_tipa() for l in tl)
@@ -115,15 +235,15 @@ def syllable_counts_to_table(syllable_counter):
     for v in syllable_counter.iter_vowells():
       syllable = c + v
       counts = syllable_counter.syllable_count(syllable)
-      row.append(unicode(counts))
-    row.append(unicode(syllable_counter.syllable_with_consonant_count(c)))
+      row.append(str(counts))
+    row.append(str(syllable_counter.syllable_with_consonant_count(c)))
     rows.append(row)
   rows.append(['Total'] + 
     list(
-      unicode(syllable_counter.syllable_with_vowell_count(v))
+      str(syllable_counter.syllable_with_vowell_count(v))
       for v in syllable_counter.iter_vowells()
     ) + [
-      unicode(syllable_counter.total_count())
+      str(syllable_counter.total_count())
     ]
   )
   return rows
@@ -161,12 +281,7 @@ def syllable_observed_expected_to_table(syllable_counter):
   return rows
 
 
-def dump_to_file(filename, data):
-  with open(filename, "w") as f:
-    f.write(data)
-
-
-def process_data(vowells, consonant_clusters, syllable_counts, outdir):
+def syllable_tables(vowells, consonant_clusters, syllable_counts):
   consonant_clusters = list(
       c for c in consonant_clusters
       if not (len(c)==2 and c[1]==make_letter("l"))
@@ -188,59 +303,121 @@ def process_data(vowells, consonant_clusters, syllable_counts, outdir):
       common_consonants,
   )
 
-  dump_to_file(
-      os.path.join(outdir, 'syllable_counts.tex'),
-      make_tabular(syllable_counts_to_table(common_data)).encode('utf-8')
-  )
-  dump_to_file(
-      os.path.join(outdir, 'syllable_ratios.tex'),
-      make_tabular(syllable_observed_expected_to_table(common_data)).encode('utf-8')
+  return [
+    ('syllable_counts.tex', syllable_counts_to_table(common_data), True),
+    ('syllable_ratios.tex',
+     syllable_observed_expected_to_table(common_data), True),
+  ]
+
+
+@register_feature('syllable_clusters')
+def syllable_clusters(word):
+  """
+  The letters of every syllable of `word`, with the syllable's clusters.
+  """
+  return tuple(
+      (s.letters(), tuple(iter_clusters(s.iter_letters())))
+      for s in word.iter_syllables()
   )
-  return 
 
 
-def compute_counts(word_counts, outdir):
-  syllable_counts = defaultdict(lambda: 0)
-  cluster_counts = defaultdict(lambda: 0)
-  for word in word_counts.keys():
-    for s in word.iter_syllables():
-      syllable_counts[s.letters()] += 1
-      for cl in iter_clusters(s.iter_letters()):
+@register_analysis
+class SyllableCounts(Analysis):
+  """
+  Counts consonant cluster + vowell syllables.
+  """
+
+  name = 'syllables'
+  features = ('syllable_clusters',)
+  tables = ('syllable_counts.tex', 'syllable_ratios.tex')
+  estimates = {
+    'syllable_counts.tex': (COUNT, None),
+    'syllable_ratios.tex': (RATIO, 'syllable_counts.tex'),
+  }
+
+  def __init__(self):
+    self.syllable_counts = defaultdict(lambda: 0)
+    self.cluster_counts = defaultdict(lambda: 0)
+
+  def add(self, word, count, features):
+    syllable_counts = self.syllable_counts
+    cluster_counts = self.cluster_counts
+    for letters, clusters in features['syllable_clusters']:
+      syllable_counts[letters] += 1
+      for cl in clusters:
         cluster_counts[cl] += 1
 
-  vowell_set = set()
-  consonant_cluster_set = set([tuple()])
-  for k in cluster_counts.keys():
-    if len(k) == 1 and k[0].is_vowell():
-      vowell_set.add(k)
-    else:
-      consonant_cluster_set.add(k)
+  def remove(self, word, count, features):
+    for letters, clusters in features['syllable_clusters']:
+      subtract_count(self.syllable_counts, letters)
+      for cl in clusters:
+        subtract_count(self.cluster_counts, cl)
+
+  def render(self):
+    vowell_set = set()
+    consonant_cluster_set = set([tuple()])
+    for k in self.cluster_counts.keys():
+      if len(k) == 1 and k[0].is_vowell():
+        vowell_set.add(k)
+      else:
+        consonant_cluster_set.add(k)
 
-  process_data(vowell_set, consonant_cluster_set, syllable_counts, outdir)
+    return syllable_tables(
+        vowell_set, consonant_cluster_set, self.syllable_counts)
+
+  def scale(self, factor):
+    scale_counts(self.syllable_counts, factor)
+    scale_counts(self.cluster_counts, factor)
+
+  def load_sql(self, connection):
+    for letters, count in connection.execute(
+        'SELECT s.letters, COUNT(*) FROM word_syllables ws '
+        'JOIN syllables s ON s.id = ws.syllable_id GROUP BY s.letters'):
+      self.syllable_counts[parse_sequence(letters)] += count
+    for cluster, count in connection.execute(
+        'SELECT sc.cluster, COUNT(*) FROM word_syllables ws '
+        'JOIN syllable_clusters sc ON sc.syllable_id = ws.syllable_id '
+        'GROUP BY sc.cluster'):
+      self.cluster_counts[parse_sequence(cluster)] += count
+
+  def drilldown_keys(self, word, features):
+    for letters, clusters in features['syllable_clusters']:
+      yield 'syllable', sequence_key(letters)
+      for cl in clusters:
+        yield 'cluster', sequence_key(cl)
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    return 'syllable', sequence_key(make_letters(row) + make_letters(column))
+
+
+def compute_counts(word_counts, outdir):
+  return write_analyses(word_counts, outdir, [SyllableCounts()])
 
 
 def tones_to_melody(tones):
-  last_t = None
-  retval = []
-  for t in tones:
-    if t != last_t:
-      retval.append(t)
-      last_t = t
-  return ''.join(retval)
+  """
+  The melody label of a string of tone levels, e.g. '112233' is '123'.
+  """
+  return melody_text(melody(tone_code(t) for t in tones))
 
 
-def catogory_melody_to_table(counts, melodies, categories):
-  melodies = sorted(list(melodies), key=lambda x: (len(x), x))
+def _ordered_categories(categories):
   categories = sorted(list(categories))
 
   _O = u'Other'
 
   # PutOther at the end of the list.
-  categories = (
+  return (
       list(c for c in categories if c != _O) +
       list(c for c in categories if c == _O)
   )
 
+
+def catogory_melody_to_table(counts, melodies, categories):
+  melodies = sorted(list(melodies), key=lambda x: (len(x), x))
+  categories = _ordered_categories(categories)
+
   def total_for_melody(m):
     return sum(counts[(m, c)] for c in categories)
 
@@ -264,61 +441,226 @@ def catogory_melody_to_table(counts, melodies, categories):
     row = [c]
     percent_row = [c]
     for m in melodies:
-      row.append(unicode(counts[(m, c)]))
+      row.append(str(counts[(m, c)]))
       percent_row.append(u'%.3f' % (float(counts[(m, c)])/total_for_category(c)))
-    row.append(unicode(total_for_category(c)))
-    percent_row.append(unicode('1.0'))
+    row.append(str(total_for_category(c)))
+    percent_row.append(u'1.0')
     rows.append(row)
     percent_rows.append(percent_row)
 
   rows.append(
       [u'Total'] +
-      list(unicode(total_for_melody(m)) for m in melodies) +
-      [unicode(sum(total_for_melody(m) for m in melodies))]
+      list(str(total_for_melody(m)) for m in melodies) +
+      [str(sum(total_for_melody(m) for m in melodies))]
   )
 
   return rows, percent_rows
 
 
+def normalize_category(category):
+  category = category.upper()
+  if category == u'V' or category == u'AUX':
+    return u'V'
+  elif category == u'N':
+    return u'N'
+  elif category == u'I':
+    return u'I'
+  elif category == u'A':
+    return u'A'
+  return u'Other'
+
+
+@register_feature('melody')
+def word_melody(word):
+  """
+  The melody of `word` and its normalized category, or None for words
+  without a category.
+  """
+  if not word.category:
+    return None
+  return (melody(s.tone_code for s in word.iter_syllables()),
+          normalize_category(word.category))
+
+
+def _sql_melodies(connection):
+  """
+  Yields the (melody, normalized category, word types) of a corpus database.
+  """
+  connection.create_function(
+      'melody', 1,
+      lambda tones: melody_text(melody(tone_code(t) for t in tones.split('.'))))
+  connection.create_function('normalize_category', 1, normalize_category)
+  for text, category, count in connection.execute(
+      'SELECT melody(tones), normalize_category(category), COUNT(*) '
+      'FROM words WHERE category != \'\' GROUP BY 1, 2'):
+    yield parse_melody(text), category, count
+
+
+@register_analysis
+class Melodies(Analysis):
+  """
+  Counts the melodies of words by category.
+  """
+
+  name = 'melodies'
+  features = ('melody',)
+  tables = ('melody_by_category.tex', 'melody_percent_by_category.tex')
+  estimates = {
+    'melody_by_category.tex': (COUNT, None),
+    'melody_percent_by_category.tex': (FRACTION, 'melody_by_category.tex'),
+  }
+
+  # Longer melodies aren't counted; None counts melodies of any length.
+  max_length = 2
+
+  def __init__(self):
+    self.counts_of_category_melody = defaultdict(lambda: 0)
+    self.valid_melodies = set()
+    self.valid_categories = set()
+
+  @classmethod
+  def _counted_melody(cls, features):
+    melody_category = features['melody']
+    if melody_category is None:
+      return None
+    melody, category = melody_category
+    if len(melody) > 0 and (
+        cls.max_length is None or len(melody) <= cls.max_length):
+      return melody_category
+    return None
+
+  def add(self, word, count, features):
+    melody_category = self._counted_melody(features)
+    if melody_category is not None:
+      melody, category = melody_category
+      self.valid_melodies.add(melody)
+      self.valid_categories.add(category)
+      self.counts_of_category_melody[(melody, category)] += 1
+
+  def remove(self, word, count, features):
+    melody_category = self._counted_melody(features)
+    if melody_category is not None:
+      counts = self.counts_of_category_melody
+      subtract_count(counts, melody_category)
+      self.valid_melodies = set(m for m, _ in counts)
+      self.valid_categories = set(c for _, c in counts)
+
+  def render(self):
+    # Melodies are only turned into their labels here, once each.
+    counts = defaultdict(lambda: 0)
+    for (m, c), count in self.counts_of_category_melody.items():
+      counts[(melody_text(m), c)] = count
+    melody_table, melody_percent_table = catogory_melody_to_table(
+        counts, [melody_text(m) for m in self.valid_melodies],
+        self.valid_categories)
+    return [
+      ('melody_by_category.tex', melody_table, True),
+      ('melody_percent_by_category.tex', melody_percent_table, False),
+    ]
+
+  def scale(self, factor):
+    scale_counts(self.counts_of_category_melody, factor)
+
+  def load_sql(self, connection):
+    for m, category, count in _sql_melodies(connection):
+      if self._counted_melody({'melody': (m, category)}) is not None:
+        self.valid_melodies.add(m)
+        self.valid_categories.add(category)
+        self.counts_of_category_melody[(m, category)] += count
+
+  def drilldown_keys(self, word, features):
+    melody_category = self._counted_melody(features)
+    if melody_category is not None:
+      m, category = melody_category
+      yield 'melody', u'%s|%s' % (melody_text(m), category)
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    return 'melody', u'%s|%s' % (column, row)
+
+
 def compute_melodies(word_counts, outdir):
-  counts_of_category_melody = defaultdict(lambda: 0)
-  valid_melodies = set()
-  valid_categories = set()
-
-  for word in word_counts.keys():
-    if word.category:
-      tones = ''.join(s.tone for s in word.iter_syllables())
-      melody = unicode(tones_to_melody(tones))
-      category = unicode(word.category).upper()
-      
-      if category == u'V' or category == u'AUX':
-        category = u'V'
-      elif category == u'N':
-        category = u'N'
-      elif category == u'I':
-        category = u'I'
-      elif category == u'A':
-        category = u'A'
-      else:
-        category = u'Other'
+  return write_analyses(word_counts, outdir, [Melodies()])
 
-      if len(melody) > 0 and len(melody) < 3:
-        valid_melodies.add(melody)
-        valid_categories.add(category)
-        counts_of_category_melody[(melody, category)] += 1
-  
-  melody_table, melody_percent_table = catogory_melody_to_table(
-      counts_of_category_melody, valid_melodies, valid_categories)
 
-  dump_to_file(
-      os.path.join(outdir, 'melody_by_category.tex'),
-      make_tabular(melody_table).encode('utf-8')
-  )
+def category_contour_to_table(counts, categories):
+  contours = [
+      t for t in CONTOURS if any(counts[(t, c)] for c in categories)]
+  categories = _ordered_categories(categories)
+
+  def total_for_contour(t):
+    return sum(counts[(t, c)] for c in categories)
+
+  def total_for_category(c):
+    return sum(counts[(t, c)] for t in contours)
+
+  rows = [[u'Contour'] + contours + [u'Total']]
+  for c in categories:
+    rows.append(
+        [c] + [str(counts[(t, c)]) for t in contours] +
+        [str(total_for_category(c))])
+  rows.append(
+      [u'Total'] + [str(total_for_contour(t)) for t in contours] +
+      [str(sum(total_for_contour(t) for t in contours))])
+  return rows
+
+
+@register_analysis
+class MelodyContours(Analysis):
+  """
+  Counts the contour classes (level, rising, falling, ...) of the melodies of
+  words, of any length, by category.
+  """
+
+  name = 'contours'
+  features = ('melody',)
+  tables = ('melody_contour_by_category.tex',)
+  estimates = {'melody_contour_by_category.tex': (COUNT, None)}
+  opt_in = True
+
+  def __init__(self):
+    self.counts_of_category_contour = defaultdict(lambda: 0)
+    self.valid_categories = set()
+
+  def _add(self, m, category, count):
+    if m:
+      self.valid_categories.add(category)
+      self.counts_of_category_contour[(contour(m), category)] += count
+
+  def add(self, word, count, features):
+    if features['melody'] is not None:
+      self._add(*features['melody'], count=1)
+
+  def remove(self, word, count, features):
+    if features['melody'] is not None and features['melody'][0]:
+      m, category = features['melody']
+      counts = self.counts_of_category_contour
+      subtract_count(counts, (contour(m), category))
+      self.valid_categories = set(c for _, c in counts)
+
+  def render(self):
+    return [
+      ('melody_contour_by_category.tex',
+       category_contour_to_table(
+           self.counts_of_category_contour, self.valid_categories), True),
+    ]
+
+  def scale(self, factor):
+    scale_counts(self.counts_of_category_contour, factor)
+
+  def load_sql(self, connection):
+    for m, category, count in _sql_melodies(connection):
+      self._add(m, category, count)
+
+  def drilldown_keys(self, word, features):
+    if features['melody'] is not None and features['melody'][0]:
+      m, category = features['melody']
+      yield 'contour', u'%s|%s' % (contour(m), category)
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    return 'contour', u'%s|%s' % (column, row)
 
-  dump_to_file(
-      os.path.join(outdir, 'melody_percent_by_category.tex'),
-      make_tabular(melody_percent_table, has_summary_row=False).encode('utf-8')
-  )
 
 def sparse_to_dense(name, matrix):
 
@@ -329,8 +671,8 @@ def sparse_to_dense(name, matrix):
     row_names.add(r)
     column_names.add(c)
 
-  column_names = sorted(list(column_names))
-  row_names = sorted(list(row_names))
+  column_names = sorted(column_names, key=collation_key)
+  row_names = sorted(row_names, key=collation_key)
 
   def total_for_row(r):
     return sum(matrix[(r, c)] for c in column_names)
@@ -352,14 +694,14 @@ def sparse_to_dense(name, matrix):
   for r in row_names:
     row = [render_syllable(r)]
     for c in column_names:
-      row.append(unicode(matrix[(r, c)]))
-    row.append(unicode(total_for_row(r)))
+      row.append(str(matrix[(r, c)]))
+    row.append(str(total_for_row(r)))
     rows.append(row)
 
   rows.append(
       [u'Total'] +
-      list(unicode(total_for_column(c)) for c in column_names) +
-      [unicode(sum(total_for_column(c) for c in column_names))]
+      list(str(total_for_column(c)) for c in column_names) +
+      [str(sum(total_for_column(c) for c in column_names))]
   )
 
   return rows
@@ -382,65 +724,1313 @@ def syllable_to_cv(syllable):
   
 
 
-def compute_disyllables(word_counts, outdir):
-  second_syllable_counts = defaultdict(lambda: 0)
-  consonant_relations = defaultdict(lambda: 0)
-  vowel_relations = defaultdict(lambda: 0)
-  complete_morphemes = set()
-  for w in word_counts:
-    for c in w.iter_complete_morphemes():
-      complete_morphemes.add(c)
-
-  for m, ss in complete_morphemes:
-    if len(ss) == 2:
-      first_syllable = syllable_to_cv(ss[0])
-      second_syllable = syllable_to_cv(ss[1])
-      if second_syllable:
-        second_syllable_counts[second_syllable] += 1
-        if first_syllable:
-          consonant_relations[(first_syllable[0], second_syllable[0])] += 1
-          vowel_relations[(first_syllable[1], second_syllable[1])] += 1
-  dump_to_file(
-      os.path.join(outdir, 'second_syllable_consonants_vowels.tex'),
-      make_tabular(sparse_to_dense(
-        'Second Syllable', second_syllable_counts)).encode('utf-8')
+@register_feature('complete_disyllables')
+def complete_disyllables(word):
+  """
+  The complete morphemes of `word` that have exactly two syllables, as
+  (morpheme, first syllable, second syllable) tuples.
+  """
+  syllables = word.syllables
+  return tuple(
+      (word.morphemes[m], syllables[first], syllables[first + 1])
+      for m, first, end in word.complete_morpheme_spans()
+      if end - first == 2
   )
-  dump_to_file(
-      os.path.join(outdir, 'disyllable_consonant_first_to_second.tex'),
-      make_tabular(sparse_to_dense(
-        'Disyllable Consonants', consonant_relations)).encode('utf-8')
+
+
+def _encode_syllable(syllable):
+  return sequence_key(syllable.iter_letters()), syllable.tone
+
+
+def encode_disyllable(disyllable):
+  m, s1, s2 = disyllable
+  return (sequence_key(m.iter_letters()), m.gloss or u'',
+          u'1' if m.is_particle else u'0', u'1' if m.is_suffix else u'0') + (
+              _encode_syllable(s1) + _encode_syllable(s2))
+
+
+def decode_disyllable(key):
+  # Only the syllables are needed once the disyllables are told apart.
+  return (None, parse_syllable(*key[4:6]), parse_syllable(*key[6:8]))
+
+
+@register_analysis
+class Disyllables(Analysis):
+  """
+  Relates the first and second syllables of complete disyllabic morphemes.
+  """
+
+  name = 'disyllables'
+  features = ('complete_disyllables',)
+  tables = (
+    'second_syllable_consonants_vowels.tex',
+    'disyllable_consonant_first_to_second.tex',
+    'disyllable_vowel_first_to_second.tex',
   )
-  dump_to_file(
-      os.path.join(outdir, 'disyllable_vowel_first_to_second.tex'),
-      make_tabular(sparse_to_dense(
-        'Disyllalbe Vowels', vowel_relations)).encode('utf-8')
+
+  # If not None, the distinct disyllables are kept in a `SpillingCounter`
+  # with this budget in bytes (set by --memory-budget).
+  memory_budget = None
+
+  def __init__(self):
+    # Only the distinct complete disyllabic morphemes matter, but the number
+    # of word types they are in is kept for `remove`.
+    if self.memory_budget is None:
+      self.complete_disyllables = Counter()
+    else:
+      self.complete_disyllables = SpillingCounter(
+          self.memory_budget, encode_disyllable, decode_disyllable, 256)
+
+  def add(self, word, count, features):
+    self.complete_disyllables.update(features['complete_disyllables'])
+
+  def remove(self, word, count, features):
+    for disyllable in features['complete_disyllables']:
+      subtract_count(self.complete_disyllables, disyllable)
+
+  def load_sql(self, connection):
+    syllables = read_syllables(connection)
+    # Morphemes are stored once, so their ids tell them apart.
+    self.complete_disyllables.update(
+        (morpheme_id, syllables[s1], syllables[s2])
+        for morpheme_id, s1, s2 in connection.execute(
+            'SELECT DISTINCT wm.morpheme_id, ws1.syllable_id, '
+            'ws2.syllable_id FROM word_morphemes wm '
+            'JOIN word_syllables ws1 ON ws1.word_id = wm.word_id '
+            'AND ws1.position = wm.first_syllable '
+            'JOIN word_syllables ws2 ON ws2.word_id = wm.word_id '
+            'AND ws2.position = wm.first_syllable + 1 '
+            'WHERE wm.end_syllable - wm.first_syllable = 2'))
+
+  @staticmethod
+  def _relations(complete_disyllables):
+    """
+    Yields the (table, row, column) cells each disyllable is counted in.
+    """
+    for m, s1, s2 in complete_disyllables:
+      first_syllable = syllable_to_cv(s1)
+      second_syllable = syllable_to_cv(s2)
+      if second_syllable:
+        yield 'second_syllable', second_syllable[0], second_syllable[1]
+        if first_syllable:
+          yield ('disyllable_consonants',
+                 first_syllable[0], second_syllable[0])
+          yield 'disyllable_vowels', first_syllable[1], second_syllable[1]
+
+  def render(self):
+    relations = {
+      'second_syllable': defaultdict(lambda: 0),
+      'disyllable_consonants': defaultdict(lambda: 0),
+      'disyllable_vowels': defaultdict(lambda: 0),
+    }
+    for kind, row, column in self._relations(self.complete_disyllables):
+      relations[kind][(row, column)] += 1
+    second_syllable_counts = relations['second_syllable']
+    consonant_relations = relations['disyllable_consonants']
+    vowel_relations = relations['disyllable_vowels']
+    return [
+      ('second_syllable_consonants_vowels.tex',
+       sparse_to_dense('Second Syllable', second_syllable_counts), True),
+      ('disyllable_consonant_first_to_second.tex',
+       sparse_to_dense('Disyllable Consonants', consonant_relations), True),
+      ('disyllable_vowel_first_to_second.tex',
+       sparse_to_dense('Disyllalbe Vowels', vowel_relations), True),
+    ]
+
+  _KINDS = {
+    'second_syllable_consonants_vowels.tex': 'second_syllable',
+    'disyllable_consonant_first_to_second.tex': 'disyllable_consonants',
+    'disyllable_vowel_first_to_second.tex': 'disyllable_vowels',
+  }
+
+  def drilldown_keys(self, word, features):
+    for kind, row, column in self._relations(
+        features['complete_disyllables']):
+      yield kind, pair_key(row, column)
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    return cls._KINDS[table], pair_key(
+        make_letters(row), make_letters(column))
+
+
+def compute_disyllables(word_counts, outdir):
+  return write_analyses(word_counts, outdir, [Disyllables()])
+
+
+_MIN_NGRAM_COUNT = 10
+
+
+def ngram_tables(matrix, label, sort_key):
+  """
+  Builds the O/E and the conditional probability tables of the transitions
+  in `matrix` (see `NgramCounts.transitions`): how often every symbol follows
+  a context, relative to how often it would if they were independent, and
+  the probability of every symbol given the context. Contexts and symbols
+  counted fewer than `_MIN_NGRAM_COUNT` times are left out.
+
+  :param label: Gives the label of a symbol.
+  :param sort_key: Gives the sort key of a symbol.
+  """
+  context_totals = {c: sum(row.values()) for c, row in matrix.items()}
+  symbol_totals = defaultdict(lambda: 0)
+  for row in matrix.values():
+    for symbol, count in row.items():
+      symbol_totals[symbol] += count
+  total = float(sum(context_totals.values()))
+  contexts = sorted(
+      (c for c, count in context_totals.items()
+       if count >= _MIN_NGRAM_COUNT),
+      key=lambda c: [sort_key(symbol) for symbol in c])
+  symbols = sorted(
+      (symbol for symbol, count in symbol_totals.items()
+       if count >= _MIN_NGRAM_COUNT),
+      key=sort_key)
+
+  f = u'%.3f'
+  header = [label(symbol) for symbol in symbols] + [u'Total']
+  oe_rows = [[u'O/E'] + header]
+  probability_rows = [[u'P(next | previous)'] + header]
+  for c in contexts:
+    row = matrix[c]
+    context_total = float(context_totals[c])
+    context_label = u' '.join(label(symbol) for symbol in c)
+    oe_rows.append(
+        [context_label] +
+        [f % (row[symbol] * total / (context_total * symbol_totals[symbol]))
+         for symbol in symbols] +
+        [f % (context_total / total)])
+    probability_rows.append(
+        [context_label] +
+        [f % (row[symbol] / context_total) for symbol in symbols] +
+        [f % (sum(row[symbol] for symbol in symbols) / context_total)])
+  shares = [f % (symbol_totals[symbol] / total) for symbol in symbols]
+  oe_rows.append([u'Total'] + shares + [f % 1])
+  probability_rows.append(
+      [u'Total'] + shares +
+      [f % (sum(symbol_totals[symbol] for symbol in symbols) / total
+            if total else 1)])
+  return oe_rows, probability_rows
+
+
+def _letter_label(letter):
+  return render_syllable((letter,))
+
+
+def _letter_sort_key(letter):
+  return letter.collation_key
+
+
+def _tone_sort_key(tone):
+  return len(tone), tone
+
+
+@register_analysis
+class Ngrams(Analysis):
+  """
+  Counts the transitions between the letters and between the clusters of
+  words, within syllables and across syllable boundaries, and between the
+  tones of adjacent syllables, as n-grams of `order` symbols.
+  """
+
+  name = 'ngrams'
+  tables = (
+    'letter_transitions_within_syllables.tex',
+    'letter_transition_probabilities_within_syllables.tex',
+    'letter_transitions_across_syllables.tex',
+    'letter_transition_probabilities_across_syllables.tex',
+    'cluster_transitions_within_syllables.tex',
+    'cluster_transition_probabilities_within_syllables.tex',
+    'cluster_transitions_across_syllables.tex',
+    'cluster_transition_probabilities_across_syllables.tex',
+    'tone_transitions.tex',
+    'tone_transition_probabilities.tex',
   )
+  opt_in = True
+
+  # The number of symbols in an n-gram (set by --ngram-order).
+  order = 2
+
+  def __init__(self):
+    self.letters = Alphabet()
+    self.clusters = Alphabet()
+    self.tones = Alphabet()
+    self.counts = {
+      (kind, across): NgramCounts(self.order)
+      for kind in ('letter', 'cluster') for across in (False, True)
+    }
+    self.counts['tone', True] = NgramCounts(self.order)
+    # The codes of the letters, clusters and tone of every syllable seen.
+    self._syllable_codes = {}
+
+  def _codes(self, syllable):
+    codes = self._syllable_codes.get(syllable)
+    if codes is None:
+      codes = self._syllable_codes[syllable] = (
+          self.letters.codes(syllable.iter_letters()),
+          self.clusters.codes(iter_clusters(syllable.iter_letters())),
+          self.tones.code(syllable.tone))
+    return codes
+
+  def _add_syllables(self, syllables, count=1):
+    letters, letter_syllables = [], []
+    clusters, cluster_syllables = [], []
+    tones = []
+    for i, s in enumerate(syllables):
+      letter_codes, cluster_codes, tone = self._codes(s)
+      letters.extend(letter_codes)
+      letter_syllables.extend([i] * len(letter_codes))
+      clusters.extend(cluster_codes)
+      cluster_syllables.extend([i] * len(cluster_codes))
+      tones.append(tone)
+    for kind, codes, groups in [('letter', letters, letter_syllables),
+                                ('cluster', clusters, cluster_syllables)]:
+      for ngram, across in iter_ngrams(codes, self.order, groups):
+        self.counts[kind, across].add(ngram, count)
+    tone_counts = self.counts['tone', True]
+    for ngram in iter_ngrams(tones, self.order):
+      tone_counts.add(ngram, count)
+
+  def add(self, word, count, features):
+    self._add_syllables(word.syllables)
+
+  def remove(self, word, count, features):
+    self._add_syllables(word.syllables, -1)
+
+  def load_sql(self, connection):
+    syllables = read_syllables(connection)
+    word_syllables = []
+    current = None
+    for word_id, syllable_id in connection.execute(
+        'SELECT word_id, syllable_id FROM word_syllables '
+        'ORDER BY word_id, position'):
+      if word_id != current:
+        self._add_syllables(word_syllables)
+        word_syllables = []
+        current = word_id
+      word_syllables.append(syllables[syllable_id])
+    self._add_syllables(word_syllables)
+
+  def _tables(self, kind, across, alphabet, label, sort_key):
+    matrix = self.counts[kind, across].transitions()
+    symbols = alphabet.symbols
+    return ngram_tables(
+        matrix, lambda code: label(symbols[code]),
+        lambda code: sort_key(symbols[code]))
+
+  def render(self):
+    rendered = []
+    for kind, alphabet, label, sort_key in [
+        ('letter', self.letters, _letter_label, _letter_sort_key),
+        ('cluster', self.clusters, render_syllable, collation_key)]:
+      for across, where in [(False, 'within'), (True, 'across')]:
+        oe_rows, probability_rows = self._tables(
+            kind, across, alphabet, label, sort_key)
+        rendered.append(
+            ('%s_transitions_%s_syllables.tex' % (kind, where), oe_rows,
+             True))
+        rendered.append(
+            ('%s_transition_probabilities_%s_syllables.tex' % (kind, where),
+             probability_rows, True))
+    oe_rows, probability_rows = self._tables(
+        'tone', True, self.tones, lambda tone: tone, _tone_sort_key)
+    rendered.append(('tone_transitions.tex', oe_rows, True))
+    rendered.append(
+        ('tone_transition_probabilities.tex', probability_rows, True))
+    return rendered
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    raise UnknownCell('The transition tables are not in the drill-down index')
+
+
+def write_analyses(word_counts, outdir, analyses, tables=None, sources=None,
+                   jobs=1, formats=None, progress=None):
+  """
+  Runs `analyses` over `word_counts` in a single pass, writing their tables
+  into `outdir`.
+
+  :param tables: If not None, only the tables with these names are written.
+  :param WordSources sources: If not None, a drill-down index of the tables
+    is written next to them.
+  :param int jobs: If more than 1, the analyses run in that many worker
+    processes (see `render_parallel`). The drill-down index is always built
+    in this process.
+  :param formats: The formats to write the tables in, see `dump_rendered`.
+  :param progress.Progress progress: If not None, where the progress through
+    the words is reported (only when running in this process), and the
+    steps after it are recorded.
+
+  :returns: The list of table paths whose contents changed.
+  """
+  if not os.path.isdir(outdir):
+    os.mkdir(outdir)
+  if sources is None and jobs > 1:
+    if progress is not None:
+      progress.stage(u'Running the analyses in %d processes' % jobs)
+    rendered = render_parallel(word_counts, analyses, jobs, tables)
+  else:
+    index = None if sources is None else DrilldownIndex(sources)
+    run_analyses(word_counts, analyses, index, progress=progress)
+    if index is not None:
+      if progress is not None:
+        progress.stage(u'Writing the drill-down index')
+      index.write(outdir, word_counts)
+    if progress is not None:
+      progress.stage(u'Rendering the tables')
+    rendered = render_analyses(analyses, tables)
+  return dump_rendered(outdir, rendered, formats, progress)
+
+
+def dump_rendered(outdir, rendered, formats=None, progress=None):
+  """
+  Writes the tables returned by `render_analyses` into `outdir`, one row at a
+  time.
+
+  :param formats: The formats to write every table in (see `table_writer`),
+    or None for just LaTeX tabulars.
+  :param progress.Progress progress: If not None, where writing every table
+    is recorded.
+
+  :returns: The list of table paths whose contents changed.
+  """
+  written = []
+  for name, rows, has_summary_row in rendered:
+    if progress is not None:
+      progress.stage(u'Writing %s' % os.path.join(outdir, name))
+    for format in formats or ['tex']:
+      path = os.path.join(outdir, table_filename(name, format))
+      if write_table(path, rows, has_summary_row, format):
+        written.append(path)
+  if progress is not None:
+    progress.stage(u'Writing the tables', finished=True)
+  return written
+
+
+def write_tables(word_counts, outdir, tables=None, sources=None, jobs=1,
+                 formats=None, progress=None):
+  """
+  Runs the analyses producing `tables` (all of them if None) over
+  `word_counts`, writing the tables into `outdir`.
 
+  :param WordSources sources: If not None, a drill-down index of the tables
+    is written next to them.
+  :param int jobs: The number of worker processes to run the analyses in.
+  :param formats: The formats to write the tables in, see `dump_rendered`.
+  :param progress.Progress progress: See `write_analyses`.
 
+  :returns: The list of table paths whose contents changed.
+  """
+  analyses = [cls() for cls in analysis_classes(tables)]
+  return write_analyses(
+      word_counts, outdir, analyses, tables, sources, jobs, formats, progress)
+
+
+def group_directory(outdir, group_by, group):
+  """
+  The directory the tables of `group` are written to, when grouping by the
+  column `group_by`.
+  """
+  def name(text):
+    return re.sub(r'[^\w.-]+', '_', text).strip('.') or '_'
+  return os.path.join(outdir, 'by_' + name(group_by), name(group))
+
+
+def write_grouped_tables(word_counts, word_groups, group_by, outdir,
+                         tables=None, sources=None, formats=None,
+                         progress=None):
+  """
+  Like `write_tables`, but also writes every table for each group of words
+  (see `update_word_counts`) into its `group_directory`, in the same pass over
+  the words.
 
-def analyze(filename, outdir):
+  :returns: The list of table paths whose contents changed.
+  """
   if not os.path.isdir(outdir):
     os.mkdir(outdir)
-  word_counts = load_word_counts(filename)
-  print "Loaded %d words" % len(word_counts)
+  classes = analysis_classes(tables)
+  analyses = [cls() for cls in classes]
+  groups = sorted(set(g for counts in word_groups.values() for g in counts))
+  group_analyses = {g: [cls() for cls in classes] for g in groups}
+  index = None if sources is None else DrilldownIndex(sources)
+  run_analyses(word_counts, analyses, index, word_groups, group_analyses,
+               progress)
+  if index is not None:
+    if progress is not None:
+      progress.stage(u'Writing the drill-down index')
+    index.write(outdir, word_counts)
+
+  if progress is not None:
+    progress.stage(u'Rendering the tables')
+  written = dump_rendered(
+      outdir, render_analyses(analyses, tables), formats, progress)
+  for g in groups:
+    directory = group_directory(outdir, group_by, g)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    if progress is not None:
+      progress.stage(u'Rendering the tables of %s' % g)
+    written.extend(dump_rendered(
+        directory, render_analyses(group_analyses[g], tables), formats,
+        progress))
+  return written
+
+
+def write_sample_tables(filename, outdir, size, errors=None, tables=None,
+                        formats=None, rng=None, progress=None):
+  """
+  Estimates the tables from `size` rows of the CSV `filename` picked at
+  random, writing them into `outdir` with the standard error of every cell
+  (see `sampling`).
 
-  compute_counts(word_counts, outdir)
-  compute_melodies(word_counts, outdir)
-  compute_disyllables(word_counts, outdir)
+  :param random.Random rng: The random numbers to pick the rows with.
+  :param progress.Progress progress: If not None, where the progress through
+    the file is reported.
 
+  :returns: The number of rows sampled and the number of rows in the CSV.
+  """
+  sample, total = reservoir_sample(
+      enumerate(csv_rows(filename, progress), 2), size, rng)
+  word_counts = defaultdict(lambda: 0)
+  for line_number, raw_row in sample:
+    update_word_counts(
+        word_counts, [raw_row], first_line=line_number, errors=errors)
+  analyses = [cls() for cls in analysis_classes(tables)]
+  run_analyses(word_counts, analyses)
+  fraction = float(len(sample)) / total if total else 1.0
+  for a in analyses:
+    a.scale(1 / fraction)
+  estimates = {}
+  for a in analyses:
+    estimates.update(a.estimates)
+  rendered = annotate_tables(render_analyses(analyses), fraction, estimates)
+  if tables is not None:
+    rendered = [table for table in rendered if table[0] in tables]
+  if not os.path.isdir(outdir):
+    os.mkdir(outdir)
+  dump_rendered(outdir, rendered, formats, progress)
+  return len(sample), total
 
-if __name__ == "__main__":
-  def raiseUsage(arg):
-    raise SystemExit(
-        'Invalid invocation(%s)!\n\n'
-        'Usage: python %s <csv-file-to-analyze> <output-directory>' %
-        (arg, sys.argv[0]))
 
-  if len(sys.argv) != 3:
-    raiseUsage('requires two arguments')
+def write_sql_tables(database, outdir, tables=None, formats=None,
+                     progress=None):
+  """
+  Like `write_tables`, but computes the tables with aggregate queries over a
+  corpus database written by `store_corpus`.
+
+  :param progress.Progress progress: If not None, where every step is
+    recorded.
+  """
+  if not os.path.isdir(outdir):
+    os.mkdir(outdir)
+  analyses = [cls() for cls in analysis_classes(tables)]
+  connection = sqlite3.connect(database)
+  try:
+    for a in analyses:
+      if progress is not None:
+        progress.stage(u'Querying %s' % a.name)
+      a.load_sql(connection)
+  finally:
+    connection.close()
+  return dump_rendered(
+      outdir, render_analyses(analyses, tables), formats, progress)
+
+
+def _entry_words(key, line_number, errors):
+  """
+  Parses the words of an entry (see `corpus_diff.entry_key`).
+  """
+  ipa, gloss, category = key
+  raw_row = {
+    'IPA': ipa, 'Gloss': gloss, 'Text': u'', 'Category': category,
+    'count': u'0',
+  }
+  for _, word, _, _, _, _ in iter_row_words([raw_row], line_number, errors):
+    yield word
+
+
+def diff_exports(old_filename, new_filename, tables=None, errors=None,
+                 progress=None):
+  """
+  Computes how the tables change from the export `old_filename` to
+  `new_filename` (see `corpus_diff`). The older export is analysed in full,
+  then only the entries that changed in the newer one are parsed, and the
+  analyses are updated for the word types those add and remove, instead of
+  analysing the newer export again.
+
+  :param ParseErrorLog errors: Where the rows of the newer export that fail
+    to parse are recorded (only its changed entries are parsed).
+  :param progress.Progress progress: If not None, where the progress through
+    the files and the words of the older export is reported.
+
+  :returns: The delta tables, like `render_analyses` returns tables, and a
+    dictionary of the numbers of entries and word types added, removed and
+    changed.
+  """
+  if errors is None:
+    errors = ParseErrorLog()
+  old_entries = count_entries(csv_rows(old_filename, progress))
+  new_entries = count_entries(
+      csv_rows(new_filename, progress), errors=errors)
+
+  # The parse errors of the older export have been seen before.
+  old_errors = ParseErrorLog()
+  # The number of rows of the older export every word type is on.
+  word_rows = defaultdict(lambda: 0)
+  for key, entry in old_entries.items():
+    for word in _entry_words(key, entry[LINE], old_errors):
+      word_rows[word] += entry[ROWS]
+  analyses = [cls() for cls in analysis_classes(tables)]
+  run_analyses(word_rows, analyses, progress=progress)
+  old_rendered = render_analyses(analyses, tables)
+
+  added, removed, changed = compare_entries(old_entries, new_entries)
+  row_changes = defaultdict(lambda: 0)
+  for key in added + removed + changed:
+    old_entry, new_entry = old_entries.get(key), new_entries.get(key)
+    old_rows = old_entry[ROWS] if old_entry else 0
+    new_rows = new_entry[ROWS] if new_entry else 0
+    if old_rows == new_rows:
+      # Only the count changed, which the tables don't depend on.
+      continue
+    if new_entry:
+      words = _entry_words(key, new_entry[LINE], errors)
+    else:
+      words = _entry_words(key, old_entry[LINE], old_errors)
+    for word in words:
+      row_changes[word] += new_rows - old_rows
+  added_words = [
+      word for word, change in row_changes.items()
+      if change > 0 and not word_rows.get(word)]
+  removed_words = [
+      word for word, change in row_changes.items()
+      if change < 0 and word_rows.get(word, 0) + change <= 0]
+  update_analyses(added_words, removed_words, analyses)
+  summary = {
+    'entries_added': len(added),
+    'entries_removed': len(removed),
+    'entries_changed': len(changed),
+    'words_added': len(added_words),
+    'words_removed': len(removed_words),
+  }
+  new_rendered = render_analyses(analyses, tables)
+  return delta_tables(old_rendered, new_rendered), summary
+
+
+TOP_TABLES = (
+  'top_words.tex', 'top_morphemes.tex', 'top_syllables.tex',
+  'top_clusters.tex',
+)
+
+
+def _render_morphemes(morphemes):
+  return u'\\textipa{%s}' % u'-'.join(
+      u''.join(l.to_tipa() for l in m.iter_letters()) for m in morphemes)
+
+
+def _morpheme_gloss(morpheme):
+  return u'PART' if morpheme.is_particle else morpheme.gloss
+
+
+def iter_csv_words(filenames, errors=None, progress=None):
+  """
+  Parses the words of every row of the CSV files `filenames`, one after the
+  other, without keeping them.
+
+  :yields: (word, count) pairs; a word type comes once for every row it is
+    on.
+  """
+  for filename in filenames:
+    for _, word, count, _, _, _ in iter_row_words(
+        csv_rows(filename, progress, errors), errors=errors):
+      yield word, count
+
+
+def count_top(words, k, capacity=None, exact=False):
+  """
+  Finds the `k` word types, morphemes (with their glosses), syllables and
+  consonant clusters with the most tokens among `words`, keeping no more
+  than `capacity` of each in memory (see `heavy_hitters`).
+
+  :param words: An iterable of (word, count) pairs, like `iter_csv_words`
+    yields.
+  :param bool exact: If True, count every one of them exactly instead.
+
+  :returns: A dictionary of the names of the ranked tables (`TOP_TABLES`)
+    mapped to the `HeavyHitters` counting them.
+  """
+  counters = {name: HeavyHitters(k, capacity, exact) for name in TOP_TABLES}
+  word_types = counters['top_words.tex']
+  morphemes = counters['top_morphemes.tex']
+  syllables = counters['top_syllables.tex']
+  clusters = counters['top_clusters.tex']
+  for word, count in words:
+    word_types.add(word, count)
+    for m in word.morphemes:
+      morphemes.add(m, count)
+    for letters, letter_clusters in syllable_clusters(word):
+      syllables.add(letters, count)
+      for cl in letter_clusters:
+        if not cl[0].is_vowell():
+          clusters.add(cl, count)
+  return counters
+
+
+def top_tables(counters):
+  """
+  Renders the ranked tables of the counters returned by `count_top`: the
+  tokens of every word type, morpheme, syllable or cluster, and by how many
+  they may be overcounted (0 where they were counted exactly).
+  """
+  columns = {
+    'top_words.tex': [u'Word', u'Tones', u'Gloss', u'Category'],
+    'top_morphemes.tex': [u'Morpheme', u'Gloss'],
+    'top_syllables.tex': [u'Syllable'],
+    'top_clusters.tex': [u'Cluster'],
+  }
+  labels = {
+    'top_words.tex': lambda w: [
+        _render_morphemes(w.morphemes),
+        u'.'.join(s.tone for s in w.syllables), w.gloss, w.category],
+    'top_morphemes.tex': lambda m: [
+        _render_morphemes([m]), _morpheme_gloss(m)],
+    'top_syllables.tex': lambda letters: [render_syllable(letters)],
+    'top_clusters.tex': lambda cluster: [render_syllable(cluster)],
+  }
+  rendered = []
+  for name in TOP_TABLES:
+    rows = [[u'Rank'] + columns[name] + [u'Tokens', u'Error']]
+    for rank, (key, count, error) in enumerate(counters[name].top(), 1):
+      rows.append(
+          [str(rank)] + labels[name](key) + [str(count), str(error)])
+    rendered.append((name, rows, False))
+  return rendered
+
+
+def _new_store(database):
+  if os.path.exists(database):
+    os.remove(database)
+  return CorpusStore(database)
+
+
+def store_corpus(filename, database, errors=None, progress=None):
+  """
+  Parses the CSV `filename` into a new corpus database at `database`, without
+  keeping the words in memory.
+
+  :returns: The number of word types stored.
+  """
+  store = _new_store(database)
+  try:
+    for line_number, word, count, ipa, gloss, raw_row in iter_row_words(
+        csv_rows(filename, progress, errors), errors=errors):
+      store.add_word(word, count, line_number)
+    return store.word_types()
+  finally:
+    store.close()
 
-  filename = sys.argv[1]
-  output_directory = sys.argv[2]
+
+def export_word_counts(word_counts, database, sources=None):
+  """
+  Writes `word_counts` into a new corpus database at `database`.
+
+  :param WordSources sources: If not None, where the first CSV line of every
+    word is looked up.
+  """
+  store = _new_store(database)
+  try:
+    for word, count in word_counts.items():
+      line = None
+      if sources is not None:
+        line = sources.lines(sources.word_id(word))[0]
+      store.add_word(word, count, line)
+  finally:
+    store.close()
+
+
+def report_errors(errors, error_report=None):
+  print(errors.summary())
+  if error_report:
+    errors.write_report(error_report)
+
+
+def analyze(filename, outdir, errors=None, error_report=None, tables=None,
+            drilldown=False, morpheme_index=False, backend='memory',
+            database=None, jobs=1, group_by=None, formats=None,
+            memory_budget=None, sample=None, seed=None, progress=None,
+            memory_report=None):
+  """
+  :param str backend: 'memory' to count the words in a dictionary, or
+    'sqlite' to store them in the corpus database `database` and compute the
+    tables with SQL (which doesn't support `drilldown` or `morpheme_index`).
+  :param str database: With the memory backend, if not None, where the words
+    are also exported to as a corpus database.
+  :param str group_by: If not None, a CSV column to also write the tables of
+    every group of words by (see `write_grouped_tables`).
+  :param int memory_budget: If not None, the bytes the word counts may take
+    in memory before they spill to disk (see `load_word_counts`).
+  :param int sample: If not None, only estimate the tables from this many
+    rows picked at random (see `write_sample_tables`), with the random seed
+    `seed`.
+  :param progress.Progress progress: If not None, where the progress of
+    reading the CSV and running the analyses is reported.
+  :param MemoryReport memory_report: If not None, where the memory taken by
+    every stage of the run, and by the words once loaded, is measured.
+  """
+  if errors is None:
+    errors = ParseErrorLog()
+  if sample is not None:
+    with stage(memory_report, 'Sampling'):
+      sampled, total = write_sample_tables(
+          filename, outdir, sample, errors, tables, formats,
+          random.Random(seed), progress)
+    report_errors(errors, error_report)
+    print("Estimated the tables from %d of %d rows" % (sampled, total))
+    return
+  if backend == 'sqlite':
+    with stage(memory_report, 'Storing the corpus'):
+      word_types = store_corpus(
+          filename, database, errors=errors, progress=progress)
+    report_errors(errors, error_report)
+    print("Loaded %d words" % word_types)
+    with stage(memory_report, 'Computing the tables'):
+      write_sql_tables(database, outdir, tables, formats, progress)
+    return
+
+  sources = WordSources() if drilldown or database else None
+  word_groups = None
+  if group_by is not None:
+    word_groups = defaultdict(lambda: defaultdict(lambda: 0))
+  with stage(memory_report, 'Reading the CSV'):
+    word_counts = load_word_counts(
+        filename, errors=errors, sources=sources, word_groups=word_groups,
+        group_by=group_by, memory_budget=memory_budget, progress=progress)
+  report_errors(errors, error_report)
+  print("Loaded %d words" % len(word_counts))
+  if memory_report is not None:
+    memory_report.take_census(len(word_counts))
+
+  with stage(memory_report, 'Computing the tables'):
+    if group_by is None:
+      write_tables(
+          word_counts, outdir, tables, sources if drilldown else None, jobs,
+          formats, progress)
+    else:
+      write_grouped_tables(
+          word_counts, word_groups, group_by, outdir, tables,
+          sources if drilldown else None, formats, progress)
+  if database:
+    with stage(memory_report, 'Exporting the database'):
+      export_word_counts(word_counts, database, sources)
+  if morpheme_index:
+    with stage(memory_report, 'Indexing the morphemes'):
+      MorphemeIndex.build(word_counts).save(
+          os.path.join(outdir, MORPHEME_INDEX_FILE))
+
+
+def add_analysis_arguments(parser):
+  """
+  Adds the arguments selecting and configuring the tables to `parser`.
+  """
+  parser.add_argument(
+      '--tables', action='append', metavar='TABLE[,TABLE...]',
+      help='The tables to compute and write, of %s (default: %s).' % (
+           ', '.join(all_tables()), ', '.join(default_tables())))
+  parser.add_argument(
+      '--format', action='append', metavar='FORMAT[,FORMAT...]',
+      help='The formats to write the tables in: %s (default: tex). '
+           'longtable is a LaTeX table that breaks across pages.' %
+           ', '.join(FORMATS))
+  parser.add_argument(
+      '--syllable-rules', choices=sorted(SYLLABLE_RULES), default='default',
+      help='How words are split into syllables: default (consonants start '
+           'the next syllable), single-onset (only the last consonant '
+           'between two vowells does) or diphthongs (adjacent vowells share '
+           'a syllable).')
+  parser.add_argument(
+      '--max-melody-length', type=int, default=2, metavar='N',
+      help='Only count melodies of up to N tones in the melody tables, or 0 '
+           'for any length (default: 2).')
+  parser.add_argument(
+      '--ngram-order', type=int, default=2, metavar='N',
+      help='The number of letters, clusters or tones in the n-grams of the '
+           'transition tables (default: 2, for the transitions from one to '
+           'the next).')
+
+
+def configure_analyses(parser, args):
+  """
+  Applies the arguments added by `add_analysis_arguments`.
+
+  :returns: The selected tables and formats, see `parse_tables` and
+    `parse_formats`.
+  """
+  tables = parse_tables(parser, args)
+  formats = parse_formats(parser, args)
+  set_syllable_rules(args.syllable_rules)
+  if args.max_melody_length < 0:
+    parser.error('--max-melody-length can not be negative')
+  Melodies.max_length = args.max_melody_length or None
+  if args.ngram_order < 2:
+    parser.error('--ngram-order must be at least 2')
+  Ngrams.order = args.ngram_order
+  return tables, formats
+
+
+def make_argument_parser():
+  parser = argparse.ArgumentParser(
+      description='Builds LaTeX tables out of a word dictionary CSV export.')
+  parser.add_argument(
+      'filename',
+      help='The CSV file to analyze, optionally compressed with gzip, bz2 or '
+           'xz, or - for standard input.')
+  parser.add_argument('outdir', help='The directory to write tables to.')
+  parser.add_argument(
+      '--watch', action='store_true',
+      help='Keep running, and re-analyze the CSV whenever it changes.')
+  parser.add_argument(
+      '--poll-interval', type=float, default=2.0, metavar='SECONDS',
+      help='With --watch, the longest time between checks of the CSV.')
+  parser.add_argument(
+      '--debounce', type=float, default=1.0, metavar='SECONDS',
+      help='With --watch, how long the CSV must stay unchanged before it is '
+           're-analyzed.')
+  parser.add_argument(
+      '--no-inotify', dest='use_inotify', action='store_false',
+      help='With --watch, always poll instead of using inotify.')
+  parser.add_argument(
+      '--max-errors', type=int, default=None, metavar='N',
+      help='Give up after more than N rows fail to parse.')
+  parser.add_argument(
+      '--strict', action='store_true',
+      help='Stop on the first row that fails to parse.')
+  parser.add_argument(
+      '--error-report', metavar='FILE',
+      help='Write every row that failed to parse to FILE, as JSON lines if '
+           'FILE ends in .jsonl and as CSV otherwise.')
+  add_analysis_arguments(parser)
+  parser.add_argument(
+      '--drilldown', action='store_true',
+      help='Also write an index from the cells of the tables to the words '
+           'and CSV lines feeding them (see the query command).')
+  parser.add_argument(
+      '--morpheme-index', action='store_true',
+      help='Also write a search index of the morphemes and their glosses '
+           '(see the morphemes command).')
+  parser.add_argument(
+      '--jobs', type=int, default=1, metavar='N',
+      help='Run the analyses in up to N worker processes once the CSV is '
+           'loaded, or 0 for one per CPU. The tables are the same as with a '
+           'single process.')
+  parser.add_argument(
+      '--group-by', metavar='COLUMN',
+      help='Also write every table for each value of this CSV column, into '
+           'by_COLUMN/VALUE in the output directory. Categories are '
+           'normalized to V, N, I, A and Other.')
+  parser.add_argument(
+      '--memory-budget', type=int, metavar='MB',
+      help='Keep the word counts (and the distinct disyllables) to about MB '
+           'megabytes of memory each, spilling the rest to temporary files '
+           'that are merged back when the tables are computed. The tables '
+           'are the same as without a budget.')
+  parser.add_argument(
+      '--sample', type=int, metavar='N',
+      help='Quickly estimate the tables from N rows of the CSV picked at '
+           'random, with the standard error of every count and ratio.')
+  parser.add_argument(
+      '--seed', type=int,
+      help='With --sample, the random seed, to pick the same rows again.')
+  parser.add_argument(
+      '--progress', action='store_true', default=None,
+      help='Report the progress of reading the CSV and running the analyses '
+           'on standard error (the default when it is a terminal).')
+  parser.add_argument(
+      '--no-progress', dest='progress', action='store_false',
+      help='Do not report progress on standard error.')
+  parser.add_argument(
+      '--progress-interval', type=float, default=2.0, metavar='SECONDS',
+      help='The time between two progress reports.')
+  parser.add_argument(
+      '--heartbeat', metavar='FILE',
+      help='Keep a JSON status of the run (phase, rows, percent done, ETA, '
+           'time of the last update) in FILE, updated with every progress '
+           'report.')
+  parser.add_argument(
+      '--memory-report', action='store_true',
+      help='Trace the memory taken by every stage of the run, and report it '
+           'with the objects in memory once the words are loaded and the '
+           'source lines allocating the most. Slows the run down a few '
+           'times.')
+  parser.add_argument(
+      '--backend', choices=['memory', 'sqlite'], default='memory',
+      help='Count the words in memory, or store them in a SQLite database '
+           'and compute the tables with SQL (default: memory).')
+  parser.add_argument(
+      '--database', metavar='FILE',
+      help='Write the parsed corpus to this SQLite database (default with '
+           '--backend sqlite: %s in the output directory).' % CORPUS_DB_FILE)
+  return parser
+
+
+def parse_formats(parser, args):
+  """
+  Returns the list of formats selected with --format, or None for the
+  default.
+  """
+  if not args.format:
+    return None
+  formats = [f for arg in args.format for f in arg.split(',') if f]
+  try:
+    check_formats(formats)
+  except UnknownFormat as e:
+    parser.error(str(e))
+  return formats
+
+
+def parse_tables(parser, args):
+  """
+  Returns the list of tables selected with --tables, or None for the default
+  ones.
+  """
+  if not args.tables:
+    return None
+  tables = [t for arg in args.tables for t in arg.split(',') if t]
+  try:
+    analysis_classes(tables)
+  except UnknownTable as e:
+    parser.error(str(e))
+  return tables
+
+
+def main(argv):
+  parser = make_argument_parser()
+  args = parser.parse_args(argv)
+  if args.filename != STDIN and (
+      not os.path.exists(args.filename) or os.path.isdir(args.filename)):
+    parser.error('%s not a file' % repr(args.filename))
+  if args.watch and not is_plain_file(args.filename):
+    parser.error('--watch needs an uncompressed file')
+  if args.watch and args.drilldown:
+    parser.error('--drilldown can not be used with --watch')
+  if args.backend == 'sqlite':
+    for flag, is_set in [('--watch', args.watch),
+                         ('--group-by', args.group_by),
+                         ('--drilldown', args.drilldown),
+                         ('--morpheme-index', args.morpheme_index)]:
+      if is_set:
+        parser.error('%s can not be used with --backend sqlite' % flag)
+    if args.database is None:
+      if not os.path.isdir(args.outdir):
+        os.mkdir(args.outdir)
+      args.database = os.path.join(args.outdir, CORPUS_DB_FILE)
+  elif args.watch and args.database:
+    parser.error('--database can not be used with --watch')
+  if args.watch and args.group_by:
+    parser.error('--group-by can not be used with --watch')
+  if args.watch and args.memory_report:
+    parser.error('--memory-report can not be used with --watch')
+  if args.watch and args.jobs != 1:
+    # The analyses are kept between runs, so they run in this process.
+    parser.error('--jobs can not be used with --watch')
+  if args.sample is not None:
+    if args.sample <= 0:
+      parser.error('--sample must be positive')
+    for flag, is_set in [('--watch', args.watch),
+                         ('--group-by', args.group_by),
+                         ('--drilldown', args.drilldown),
+                         ('--morpheme-index', args.morpheme_index),
+                         ('--database', args.database),
+                         ('--memory-budget', args.memory_budget),
+                         ('--backend sqlite', args.backend == 'sqlite')]:
+      if is_set:
+        parser.error('%s can not be used with --sample' % flag)
+  memory_budget = None
+  if args.memory_budget is not None:
+    if args.memory_budget <= 0:
+      parser.error('--memory-budget must be positive')
+    for flag, is_set in [('--watch', args.watch),
+                         ('--group-by', args.group_by),
+                         ('--drilldown', args.drilldown),
+                         ('--database', args.database),
+                         ('--backend sqlite', args.backend == 'sqlite')]:
+      if is_set:
+        parser.error('%s can not be used with --memory-budget' % flag)
+    memory_budget = args.memory_budget * 1024 * 1024
+    Disyllables.memory_budget = memory_budget
+  tables, formats = configure_analyses(parser, args)
+  if args.jobs < 0:
+    parser.error('--jobs can not be negative')
+  if args.jobs == 0:
+    args.jobs = os.cpu_count() or 1
+
+  if args.progress is None:
+    args.progress = sys.stderr.isatty()
+  progress = None
+  if args.progress or args.heartbeat:
+    progress = Progress(
+        sys.stderr if args.progress else None, args.progress_interval,
+        args.heartbeat)
+
+  def make_error_log():
+    return ParseErrorLog(max_errors=args.max_errors, strict=args.strict)
+
+  def give_up(errors, e):
+    report_errors(errors, args.error_report)
+    raise SystemExit(str(e))
+
+  def update_and_report(word_counts, raw_rows, first_line=2, added=None):
+    errors = make_error_log()
+    try:
+      new_words = update_word_counts(
+          word_counts, raw_rows, first_line=first_line, errors=errors,
+          added=added)
+    except TooManyParseErrors as e:
+      give_up(errors, e)
+    report_errors(errors, args.error_report)
+    return new_words
+
+  def write_watched(analyses, outdir):
+    if not os.path.isdir(outdir):
+      os.mkdir(outdir)
+    return dump_rendered(
+        outdir, render_analyses(analyses, tables), formats, progress)
+
+  if args.watch:
+    try:
+      watch(args.filename, args.outdir, update_and_report,
+            lambda: [cls() for cls in analysis_classes(tables)],
+            write_watched, poll_interval=args.poll_interval,
+            debounce=args.debounce, use_inotify=args.use_inotify,
+            progress=progress)
+    except KeyboardInterrupt:
+      pass
+  else:
+    memory_report = None
+    if args.memory_report:
+      memory_report = MemoryReport()
+      memory_report.start()
+    errors = make_error_log()
+    try:
+      analyze(args.filename, args.outdir, errors=errors,
+              error_report=args.error_report, tables=tables,
+              drilldown=args.drilldown, morpheme_index=args.morpheme_index,
+              backend=args.backend, database=args.database, jobs=args.jobs,
+              group_by=args.group_by, formats=formats,
+              memory_budget=memory_budget, sample=args.sample,
+              seed=args.seed, progress=progress,
+              memory_report=memory_report)
+    except UnknownColumn as e:
+      raise SystemExit(e.args[0])
+    except TooManyParseErrors as e:
+      give_up(errors, e)
+    finally:
+      if memory_report is not None:
+        memory_report.stop()
+    if memory_report is not None:
+      print(u'\n'.join(memory_report.format()))
+
+
+def query_main(argv):
+  parser = argparse.ArgumentParser(
+      prog='analyse.py query',
+      description='Lists the words, and CSV lines, that feed a cell of a '
+                  'table written with --drilldown.')
+  parser.add_argument('outdir', help='The directory the tables are in.')
+  parser.add_argument('table', help='The file name of the table.')
+  parser.add_argument('row', help='The row label, in IPA.')
+  parser.add_argument('column', help='The column label, in IPA.')
+  args = parser.parse_args(argv)
+  try:
+    kind, key = cell_key(args.table, args.row, args.column)
+    results = query(args.outdir, kind, key)
+  except (NoIndex, UnknownTable, UnknownCell) as e:
+    raise SystemExit(str(e))
+  for ipa, gloss, category, count, lines in results:
+    print(u'%s\t%s\t%s\t%d\tlines %s' % (
+        ipa, gloss, category, count, u','.join(str(l) for l in lines)))
+
+
+def check_main(argv):
+  parser = argparse.ArgumentParser(
+      prog='analyse.py check',
+      description='Checks that every row of a CSV export parses, without '
+                  'computing any tables. Exits with status 1 if any row '
+                  'fails.')
+  parser.add_argument(
+      'filename',
+      help='The CSV file to check, optionally compressed with gzip, bz2 or '
+           'xz, or - for standard input.')
+  parser.add_argument(
+      '--report', metavar='FILE',
+      help='Write every row that failed to FILE, with its line, error, '
+           'message, IPA and gloss, as JSON lines if FILE ends in .jsonl '
+           'and as CSV otherwise.')
+  parser.add_argument(
+      '--jobs', type=int, default=0, metavar='N',
+      help='Check the rows in N worker processes (default: 0, for one per '
+           'CPU).')
+  parser.add_argument(
+      '--syllable-rules', choices=sorted(SYLLABLE_RULES), default='default',
+      help='The syllabification rules to check the tones against, as for '
+           'the tables.')
+  args = parser.parse_args(argv)
+  if args.filename != STDIN and not os.path.isfile(args.filename):
+    parser.error('%s not a file' % repr(args.filename))
+  if args.jobs < 0:
+    parser.error('--jobs can not be negative')
+  set_syllable_rules(args.syllable_rules)
+  errors = ParseErrorLog()
+  checked = check_export(
+      args.filename, errors, jobs=args.jobs or os.cpu_count() or 1)
+  report_errors(errors, args.report)
+  print('Checked %d rows, %d failed' % (checked, len(errors)))
+  if len(errors):
+    raise SystemExit(1)
+
+
+def top_main(argv):
+  parser = argparse.ArgumentParser(
+      prog='analyse.py top',
+      description='Ranks the most frequent word types, morphemes, syllables '
+                  'and consonant clusters, by tokens, of one or more CSV '
+                  'exports, in bounded memory.')
+  parser.add_argument(
+      'outdir', help='The directory to write the ranked tables to.')
+  parser.add_argument(
+      'filenames', nargs='+', metavar='filename',
+      help='The CSV files to count, optionally compressed with gzip, bz2 or '
+           'xz.')
+  parser.add_argument(
+      '-k', type=int, default=100,
+      help='The number of entries of every table (default: 100).')
+  parser.add_argument(
+      '--capacity', type=int, metavar='N',
+      help='Count no more than N of each at once (default: 10 k, and at '
+           'least 1000); past that the counts are approximate, with a bound '
+           'on their error.')
+  parser.add_argument(
+      '--exact', action='store_true',
+      help='Count every word type, morpheme, syllable and cluster exactly, '
+           'however many there are.')
+  parser.add_argument(
+      '--format', action='append', metavar='FORMAT[,FORMAT...]',
+      help='The formats to write the tables in: %s (default: tex).' %
+           ', '.join(FORMATS))
+  parser.add_argument(
+      '--syllable-rules', choices=sorted(SYLLABLE_RULES), default='default',
+      help='How words are split into syllables, as for the other tables.')
+  args = parser.parse_args(argv)
+  for filename in args.filenames:
+    if not os.path.isfile(filename):
+      parser.error('%s not a file' % repr(filename))
+  if args.k < 1:
+    parser.error('-k must be at least 1')
+  if args.capacity is not None and args.capacity < args.k:
+    parser.error('--capacity can not be less than -k')
+  formats = parse_formats(parser, args)
+  set_syllable_rules(args.syllable_rules)
+  errors = ParseErrorLog()
+  counters = count_top(
+      iter_csv_words(args.filenames, errors), args.k, args.capacity,
+      args.exact)
+  report_errors(errors)
+  for name in TOP_TABLES:
+    counter = counters[name]
+    if counter.exact:
+      print('%s: exact' % name)
+    else:
+      print('%s: approximate, the first %d are certain to be in the top %d' %
+            (name, counter.guaranteed(), counter.k))
+  if not os.path.isdir(args.outdir):
+    os.mkdir(args.outdir)
+  dump_rendered(args.outdir, top_tables(counters), formats)
+
+
+def diff_main(argv):
+  parser = argparse.ArgumentParser(
+      prog='analyse.py diff',
+      description='Writes how the tables change from one export of the '
+                  'corpus to a newer one, parsing only the rows that '
+                  'changed in the newer one.')
+  parser.add_argument('old', help='The older CSV export.')
+  parser.add_argument('new', help='The newer CSV export.')
+  parser.add_argument(
+      'outdir', help='The directory to write the delta tables to.')
+  add_analysis_arguments(parser)
+  parser.add_argument(
+      '--error-report', metavar='FILE',
+      help='Write every changed row of the newer export that failed to '
+           'parse to FILE, as JSON lines if FILE ends in .jsonl and as CSV '
+           'otherwise.')
+  args = parser.parse_args(argv)
+  for filename in [args.old, args.new]:
+    if filename == STDIN or not os.path.isfile(filename):
+      parser.error('%s not a file' % repr(filename))
+  tables, formats = configure_analyses(parser, args)
+  errors = ParseErrorLog()
+  rendered, summary = diff_exports(args.old, args.new, tables, errors)
+  report_errors(errors, args.error_report)
+  print('%(entries_added)d entries added, %(entries_removed)d removed and '
+        '%(entries_changed)d changed; %(words_added)d word types added and '
+        '%(words_removed)d removed' % summary)
+  if not os.path.isdir(args.outdir):
+    os.mkdir(args.outdir)
+  dump_rendered(args.outdir, rendered, formats)
+
+
+def morphemes_main(argv):
+  parser = argparse.ArgumentParser(
+      prog='analyse.py morphemes',
+      description='Searches the morphemes indexed with --morpheme-index. '
+                  'Letters are given in IPA.')
+  parser.add_argument('outdir', help='The directory the index is in.')
+  parser.add_argument('--text', help='The exact letters of the morpheme.')
+  parser.add_argument('--prefix', help='Letters the morpheme starts with.')
+  parser.add_argument('--suffix', help='Letters the morpheme ends with.')
+  parser.add_argument('--contains', help='Letters anywhere in the morpheme.')
+  parser.add_argument('--gloss', help='The gloss of the morpheme.')
+  parser.add_argument(
+      '--words', action='store_true',
+      help='Also list the words every morpheme appears in.')
+  parser.add_argument(
+      '--limit', type=int, default=50,
+      help='The number of morphemes to list, most frequent first.')
+  args = parser.parse_args(argv)
+
+  def letters(text):
+    return None if text is None else make_letters(text)
+
+  filename = os.path.join(args.outdir, MORPHEME_INDEX_FILE)
   if not os.path.isfile(filename):
-    raiseUsage('%s not a file' % repr(filename))
-  analyze(filename, output_directory)
+    parser.error('No morpheme index in %s, re-run the analysis with '
+                 '--morpheme-index' % args.outdir)
+  index = MorphemeIndex.load(filename)
+  found = index.find(
+      text=letters(args.text), prefix=letters(args.prefix),
+      suffix=letters(args.suffix), contains=letters(args.contains),
+      gloss=args.gloss)
+  print('%d morphemes' % len(found))
+  for m in found[:args.limit]:
+    flags = [flag for flag, is_set in [('particle', m.is_particle),
+                                       ('suffix', m.is_suffix)] if is_set]
+    print(u'%s\t%s\t%s\t%d words\t%d tokens' % (
+        u''.join(m.text), m.gloss, u','.join(flags), m.word_types, m.tokens))
+    if args.words:
+      for w in index.words(m):
+        print(u'  %s\t%s\t%s\t%d' % w)
+
+
+_COMMANDS = {
+  'check': check_main,
+  'diff': diff_main,
+  'morphemes': morphemes_main,
+  'query': query_main,
+  'top': top_main,
+}
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and sys.argv[1] in _COMMANDS:
+    _COMMANDS[sys.argv[1]](sys.argv[2:])
+  else:
+    main(sys.argv[1:])
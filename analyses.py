@@ -0,0 +1,307 @@
+"""
+A registry of the analyses that can be run over a corpus, and a driver that
+runs any selection of them in a single pass over the words.
+
+Every analysis declares the per-word features it needs and the tables it
+produces. The driver computes each feature a selected analysis needs once per
+word, and hands it to every analysis that asked for it; features that no
+selected analysis needs are never computed.
+
+The analyses only read the words, so `render_parallel` can also run each of
+them in its own forked worker process.
+"""
+
+import gc
+import multiprocessing
+
+_FEATURES = {}
+_ANALYSES = []
+
+
+class UnknownTable(ValueError):
+  pass
+
+
+class Analysis(object):
+  """
+  Base class for analyses.
+
+  Subclasses set `name`, `features` (the names of the features `add` is given)
+  and `tables` (the file names of the tables `render` produces), and are added
+  to the registry with `register_analysis`. Tables that can be estimated from
+  a sample of the corpus are listed in `estimates`, see
+  `sampling.annotate_tables`. Analyses with `opt_in` set are only run when
+  their tables are asked for.
+  """
+
+  name = None
+  features = ()
+  tables = ()
+  estimates = {}
+  opt_in = False
+
+  def add(self, word, count, features):
+    """
+    Accumulates one word type.
+
+    :param Word word: The word.
+    :param int count: The number of times the word occurs in the corpus.
+    :param dict features: The features named in `self.features`, by name.
+    """
+    raise NotImplementedError()
+
+  def remove(self, word, count, features):
+    """
+    Takes back a word type accumulated with `add`, as if it had never been
+    added.
+    """
+    raise NotImplementedError()
+
+  def render(self):
+    """
+    Builds the tables from everything accumulated so far.
+
+    :returns: A list of (table name, rows, has summary row) tuples, in the
+      order of `self.tables`.
+    """
+    raise NotImplementedError()
+
+  def load_sql(self, connection):
+    """
+    Accumulates every word of a corpus database (see `corpus_db`), with the
+    same results as `add`ing each of them.
+    """
+    raise NotImplementedError()
+
+  def scale(self, factor):
+    """
+    Multiplies the counts accumulated so far by `factor`, to estimate the
+    tables of a whole corpus from a sample of it. Counts that don't grow in
+    proportion to the corpus (like those of distinct morphemes) are kept.
+    """
+
+  def drilldown_keys(self, word, features):
+    """
+    The (kind, key) pairs of the drill-down index that `word` feeds.
+    """
+    return ()
+
+  @classmethod
+  def cell_key(cls, table, row, column):
+    """
+    The (kind, key) pair of the drill-down index for a cell of `table`.
+
+    :param row: The row label, in IPA.
+    :param column: The column label, in IPA.
+    """
+    raise KeyError(table)
+
+
+def scale_counts(counts, factor):
+  """
+  Multiplies every count in the dictionary `counts` by `factor`, rounding to
+  whole counts.
+  """
+  for key, count in counts.items():
+    counts[key] = int(round(count * factor))
+
+
+def subtract_count(counts, key, count=1):
+  """
+  Subtracts `count` from `key` in the dictionary `counts`, dropping the key
+  once nothing is left, as if it had never been counted.
+  """
+  left = counts[key] - count
+  if left > 0:
+    counts[key] = left
+  else:
+    del counts[key]
+
+
+def register_feature(name):
+  """
+  Decorator registering a function of a word as the feature `name`.
+  """
+  def register(function):
+    _FEATURES[name] = function
+    return function
+  return register
+
+
+def register_analysis(cls):
+  """
+  Class decorator adding an `Analysis` subclass to the registry.
+  """
+  _ANALYSES.append(cls)
+  return cls
+
+
+def all_tables():
+  """
+  The names of every table any registered analysis produces.
+  """
+  return [t for cls in _ANALYSES for t in cls.tables]
+
+
+def default_tables():
+  """
+  The names of the tables produced when none are asked for.
+  """
+  return [t for cls in analysis_classes() for t in cls.tables]
+
+
+def analysis_classes(tables=None):
+  """
+  Returns the registered analyses that produce any of `tables`, in
+  registration order.
+
+  :param tables: Table names, or None for every analysis that isn't
+    `opt_in`.
+  :raises UnknownTable: If no analysis produces one of `tables`.
+  """
+  if tables is None:
+    return [cls for cls in _ANALYSES if not cls.opt_in]
+  known = set(all_tables())
+  unknown = [t for t in tables if t not in known]
+  if unknown:
+    raise UnknownTable('Unknown tables: %s' % ', '.join(unknown))
+  return [cls for cls in _ANALYSES if set(cls.tables).intersection(tables)]
+
+
+def required_features(analyses):
+  """
+  The names of the features needed by any of `analyses`, in a stable order.
+  """
+  names = []
+  for a in analyses:
+    for name in a.features:
+      if name not in names:
+        names.append(name)
+  return names
+
+
+def run_analyses(word_counts, analyses, index=None, word_groups=None,
+                 group_analyses=None, progress=None):
+  """
+  Feeds every word in `word_counts` to each of `analyses`, computing the
+  features they need once per word.
+
+  :param DrilldownIndex index: If not None, the drill-down keys of every word
+    are posted to it.
+  :param word_groups: If not None, a dictionary of words mapped to
+    dictionaries of their counts by group. Every word is also fed, with the
+    same features, to the analyses of each of its groups.
+  :param group_analyses: A dictionary of groups mapped to lists of analyses
+    needing no other features than `analyses`.
+  :param progress.Progress progress: If not None, where the progress through
+    the words is reported.
+  """
+  names = required_features(analyses)
+  features = _FEATURES
+  items = word_counts.items()
+  if progress is not None:
+    items = progress.track(
+        items, u'Analysing', total=len(word_counts), unit=u'words')
+  for word, count in items:
+    word_features = {name: features[name](word) for name in names}
+    for a in analyses:
+      a.add(word, count, word_features)
+    if word_groups is not None:
+      for group, group_count in word_groups[word].items():
+        for a in group_analyses[group]:
+          a.add(word, group_count, word_features)
+    if index is not None:
+      word_id = index.sources.word_id(word)
+      for a in analyses:
+        for kind, key in a.drilldown_keys(word, word_features):
+          index.post(kind, key, word_id)
+
+
+def update_analyses(added, removed, analyses):
+  """
+  Updates `analyses` for a change of the corpus they were run over, adding
+  the word types in `added` and taking back those in `removed`, computing
+  the features they need once per word.
+  """
+  names = required_features(analyses)
+  features = _FEATURES
+  for words, update in [(added, 'add'), (removed, 'remove')]:
+    for word in words:
+      word_features = {name: features[name](word) for name in names}
+      for a in analyses:
+        getattr(a, update)(word, 1, word_features)
+
+
+def cell_key(table, row, column):
+  """
+  The (kind, key) pair of the drill-down index for a cell of `table`.
+
+  :raises UnknownTable: If no analysis produces `table`.
+  """
+  for cls in analysis_classes([table]):
+    return cls.cell_key(table, row, column)
+
+
+def render_analyses(analyses, tables=None):
+  """
+  Renders `analyses`.
+
+  :param tables: If not None, only tables with one of these names are kept.
+
+  :returns: A list of (table name, rows, has summary row) tuples.
+  """
+  return [
+      table
+      for a in analyses
+      for table in a.render()
+      if tables is None or table[0] in tables
+  ]
+
+
+# The words and analyses of `render_parallel`, inherited by the forked
+# workers instead of being pickled.
+_PARALLEL_WORK = None
+
+
+def _run_and_render(i):
+  word_counts, analyses = _PARALLEL_WORK
+  run_analyses(word_counts, [analyses[i]])
+  return analyses[i].render()
+
+
+def render_parallel(word_counts, analyses, jobs, tables=None):
+  """
+  Like `run_analyses` followed by `render_analyses`, but runs each analysis in
+  one of `jobs` forked worker processes, which share `word_counts` with this
+  one copy-on-write. The tables come back in the same order as
+  `render_analyses` returns them, whichever worker finishes first.
+
+  Where processes can't be forked, or with a single job or analysis, the
+  analyses are run in this process.
+  """
+  global _PARALLEL_WORK
+  if (jobs <= 1 or len(analyses) <= 1 or
+      'fork' not in multiprocessing.get_all_start_methods()):
+    run_analyses(word_counts, analyses)
+    return render_analyses(analyses, tables)
+
+  _PARALLEL_WORK = (word_counts, analyses)
+  # Keeps the collector in the workers from touching (and so copying) every
+  # page of the words, on Python 3.7 and later.
+  freeze = hasattr(gc, 'freeze')
+  if freeze:
+    gc.freeze()
+  try:
+    with multiprocessing.get_context('fork').Pool(
+        min(jobs, len(analyses))) as pool:
+      rendered = pool.map(_run_and_render, range(len(analyses)), chunksize=1)
+  finally:
+    if freeze:
+      gc.unfreeze()
+    _PARALLEL_WORK = None
+  return [
+      table
+      for tables_of_analysis in rendered
+      for table in tables_of_analysis
+      if tables is None or table[0] in tables
+  ]
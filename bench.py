@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the analysis.
+
+`generate` writes a synthetic word dictionary export, so that benchmarks can be
+run on a corpus of any size without sharing real data:
+
+  python3 bench.py generate --rows 100000 corpus.csv
+
+`syllabify` reports how fast words are split into syllables by each of the
+syllabification rule sets:
+
+  python3 bench.py syllabify corpus.csv
+
+`compare` runs the same corpus through an older revision of this repository
+(like the last one that ran on Python 2) and through the working tree, each
+with its own interpreter, then diffs the `.tex` outputs and reports the
+timings:
+
+  python3 bench.py compare --old-python python2 --old-revision REV corpus.csv
+"""
+
+import argparse
+import difflib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+_ONSETS = [
+  u'', u'p', u't', u'k', u'b', u'd', u'g', u'm', u'n', u'l', u's', u'f',
+  u'c', u'ɟ', u'ɲ', u'j', u'w', u'kp', u'gb', u'k^{w}', u'bl', u'kl',
+]
+_NUCLEI = [
+  u'a', u'e', u'i', u'o', u'u', u'ɔ', u'ɛ', u'ə', u'ɪ', u'a:', u'\\~a',
+  u'ɔ~',
+]
+_CODAS = [u'n', u'm', u'k', u'l']
+_TONES = [u'1', u'2', u'3', u'4', u'12', u'32', u'43', u'23']
+_ROOT_GLOSSES = [u'eat', u'house', u'walk', u'egg', u'water', u'PART']
+_SUFFIX_GLOSSES = [u'SG', u'PL', u'NMLZ', u'AGT', u'tree', u'PART']
+_CATEGORIES = [u'V', u'N', u'I', u'A', u'AUX', u'ADV', u'n', u'']
+
+
+def _make_row(rng, error_rate):
+  morphemes = []
+  glosses = []
+  tones = []
+  for i in range(rng.choice([1, 1, 1, 2, 2, 3])):
+    syllable_count = rng.choice([1, 1, 2, 2, 3])
+    morpheme = u''.join(
+        rng.choice(_ONSETS) + rng.choice(_NUCLEI)
+        for _ in range(syllable_count))
+    if rng.random() < 0.2:
+      morpheme += rng.choice(_CODAS)
+    morphemes.append(morpheme)
+    glosses.append(rng.choice(_SUFFIX_GLOSSES if i else _ROOT_GLOSSES))
+    tones.extend(rng.choice(_TONES) for _ in range(syllable_count))
+  ipa = u'%s^{%s}' % (u'-'.join(morphemes), u'.'.join(tones))
+  gloss = u'-'.join(glosses)
+  if rng.random() < error_rate:
+    # An extra tone, an extra gloss or a stray character.
+    ipa, gloss = rng.choice([
+        (ipa.replace(u'^{', u'^{1.'), gloss),
+        (ipa, gloss + u'-SG'),
+        (u'?' + ipa, gloss),
+    ])
+  return ipa, gloss, rng.choice(_CATEGORIES), rng.randint(1, 50)
+
+
+def generate_corpus(filename, rows, seed=0, error_rate=0.05):
+  """
+  Writes a synthetic word dictionary CSV export with `rows` rows.
+  """
+  rng = random.Random(seed)
+  with open(filename, 'w', encoding='utf-8', newline='') as f:
+    f.write(u'\ufeff"IPA","Gloss","Category","Text","count"\n')
+    for _ in range(rows):
+      f.write(u'"%s","%s","%s","","%d"\n' % _make_row(rng, error_rate))
+
+
+def _export_revision(revision, directory):
+  archive = subprocess.check_output(
+      ['git', 'archive', '--format=tar', revision], cwd=_HERE)
+  subprocess.run(
+      ['tar', '-x', '-C', directory], input=archive, check=True)
+
+
+def _time_run(python, source_dir, corpus, outdir, repeat):
+  """
+  Runs analyse.py from `source_dir` `repeat` times, returning the fastest
+  wall clock time.
+  """
+  best = None
+  for _ in range(repeat):
+    if os.path.isdir(outdir):
+      shutil.rmtree(outdir)
+    start = time.time()
+    subprocess.run(
+        [python, 'analyse.py', os.path.abspath(corpus), outdir],
+        cwd=source_dir, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def diff_outputs(old_dir, new_dir):
+  """
+  Returns unified diffs between the tables in two output directories, one
+  string per table that differs.
+  """
+  diffs = []
+  names = sorted(set(os.listdir(old_dir)) | set(os.listdir(new_dir)))
+  for name in names:
+    if not name.endswith('.tex'):
+      continue
+    contents = []
+    for d in [old_dir, new_dir]:
+      path = os.path.join(d, name)
+      if os.path.isfile(path):
+        with open(path, encoding='utf-8') as f:
+          contents.append(f.read().splitlines(True))
+      else:
+        contents.append([])
+    if contents[0] != contents[1]:
+      diffs.append(u''.join(difflib.unified_diff(
+          contents[0], contents[1],
+          os.path.join('old', name), os.path.join('new', name))))
+  return diffs
+
+
+def compare(corpus, old_python, new_python, old_revision, repeat=3,
+            out=sys.stdout):
+  """
+  Runs `corpus` through `old_revision` with `old_python` and through the
+  working tree with `new_python`.
+
+  :returns: True if both produced identical tables.
+  """
+  workdir = tempfile.mkdtemp(prefix='bench-')
+  try:
+    old_source = os.path.join(workdir, 'source')
+    os.mkdir(old_source)
+    _export_revision(old_revision, old_source)
+    old_out = os.path.join(workdir, 'old')
+    new_out = os.path.join(workdir, 'new')
+    old_time = _time_run(old_python, old_source, corpus, old_out, repeat)
+    new_time = _time_run(new_python, _HERE, corpus, new_out, repeat)
+    diffs = diff_outputs(old_out, new_out)
+
+    print(u'%-40s %8.3fs' % (
+        u'%s @ %s' % (old_python, old_revision), old_time), file=out)
+    print(u'%-40s %8.3fs' % (
+        u'%s @ working tree' % new_python, new_time), file=out)
+    print(u'Speedup: %.2fx' % (old_time / new_time), file=out)
+    if diffs:
+      print(u'%d tables differ:' % len(diffs), file=out)
+      for d in diffs:
+        out.write(d)
+    else:
+      print(u'All tables are identical.', file=out)
+    return not diffs
+  finally:
+    shutil.rmtree(workdir)
+
+
+def syllabify_throughput(corpus, rule_names, repeat=3, out=sys.stdout):
+  """
+  Times `syllabify` over the letters of every word of `corpus`, with each of
+  the rule sets `rule_names`, and reports words and syllables per second.
+  """
+  sys.path.insert(0, _HERE)
+  from csv_loader import csv_rows
+  from word_parsing import (
+      make_letters, SYLLABLE_RULES, syllabify, WordParseError)
+
+  words = []
+  for row in csv_rows(corpus):
+    ipa = row['IPA'].replace('(', '').replace(')', '')
+    for i in ipa.split('/'):
+      try:
+        words.append(make_letters(i[:i.rfind('^')].replace('-', '')))
+      except WordParseError:
+        pass
+  print(u'%d words' % len(words), file=out)
+  for name in rule_names:
+    rules = SYLLABLE_RULES[name]
+    best = None
+    for _ in range(repeat):
+      syllables = 0
+      start = time.time()
+      for letters in words:
+        try:
+          syllables += len(syllabify(letters, rules))
+        except WordParseError:
+          pass
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+    print(u'%-14s %10.0f words/s %10.0f syllables/s' % (
+        name, len(words) / best, syllables / best), file=out)
+
+
+def make_argument_parser():
+  parser = argparse.ArgumentParser(description='Benchmarks for analyse.py.')
+  commands = parser.add_subparsers(dest='command')
+  commands.required = True
+
+  generate_parser = commands.add_parser(
+      'generate', help='Write a synthetic benchmark corpus.')
+  generate_parser.add_argument('filename')
+  generate_parser.add_argument('--rows', type=int, default=100000)
+  generate_parser.add_argument('--seed', type=int, default=0)
+  generate_parser.add_argument(
+      '--error-rate', type=float, default=0.05,
+      help='The fraction of rows that fail to parse.')
+
+  syllabify_parser = commands.add_parser(
+      'syllabify', help='Report the syllabification throughput.')
+  syllabify_parser.add_argument('corpus')
+  syllabify_parser.add_argument(
+      '--rules', action='append',
+      help='The rule sets to time (default: all of them).')
+  syllabify_parser.add_argument(
+      '--repeat', type=int, default=3,
+      help='Report the fastest of this many runs.')
+
+  compare_parser = commands.add_parser(
+      'compare',
+      help='Compare the outputs and timings of two revisions and runtimes.')
+  compare_parser.add_argument('corpus')
+  compare_parser.add_argument('--old-python', default='python2')
+  compare_parser.add_argument('--new-python', default=sys.executable)
+  compare_parser.add_argument(
+      '--old-revision', required=True,
+      help='The git revision to run with --old-python, e.g. a tag.')
+  compare_parser.add_argument(
+      '--repeat', type=int, default=3,
+      help='Report the fastest of this many runs.')
+  return parser
+
+
+if __name__ == "__main__":
+  args = make_argument_parser().parse_args()
+  if args.command == 'generate':
+    generate_corpus(args.filename, args.rows, seed=args.seed,
+                    error_rate=args.error_rate)
+  elif args.command == 'syllabify':
+    sys.path.insert(0, _HERE)
+    from word_parsing import SYLLABLE_RULES
+    syllabify_throughput(
+        args.corpus, args.rules or sorted(SYLLABLE_RULES), repeat=args.repeat)
+  elif args.command == 'compare':
+    if not compare(args.corpus, args.old_python, args.new_python,
+                   args.old_revision, repeat=args.repeat):
+      sys.exit(1)
@@ -0,0 +1,248 @@
+"""
+Stores a parsed corpus in a normalized SQLite database.
+
+The database holds every word type with its count, category and the CSV line
+it was first read from, and breaks words down into morphemes and syllables
+(with their positions), syllables into letters and clusters. Syllables,
+morphemes and letters are stored once and referenced by id.
+
+It can be used for ad-hoc questions, e.g. the syllable inventory of every
+category:
+
+  SELECT w.category, s.letters, COUNT(*)
+  FROM word_syllables ws
+  JOIN words w ON w.id = ws.word_id
+  JOIN syllables s ON s.id = ws.syllable_id
+  GROUP BY w.category, s.letters;
+
+or the tones by morpheme position:
+
+  SELECT wm.position, s.tone, COUNT(*)
+  FROM word_morphemes wm
+  JOIN word_syllables ws ON ws.word_id = wm.word_id
+    AND ws.position >= wm.first_syllable AND ws.position < wm.end_syllable
+  JOIN syllables s ON s.id = ws.syllable_id
+  GROUP BY wm.position, s.tone;
+
+Letter sequences (the letters of a syllable or a cluster) are stored as the
+texts of the letters separated by spaces, see `drilldown.sequence_key`.
+"""
+
+import sqlite3
+
+from drilldown import sequence_key
+from word_parsing import (
+    iter_clusters,
+    make_letter,
+    make_syllable_from_letters,
+)
+
+DB_FILE = 'corpus.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS letters (
+  id INTEGER PRIMARY KEY,
+  text TEXT NOT NULL UNIQUE,
+  is_vowell INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS syllables (
+  id INTEGER PRIMARY KEY,
+  letters TEXT NOT NULL,
+  tone TEXT NOT NULL,
+  UNIQUE (letters, tone)
+);
+CREATE TABLE IF NOT EXISTS syllable_letters (
+  syllable_id INTEGER NOT NULL REFERENCES syllables (id),
+  position INTEGER NOT NULL,
+  letter_id INTEGER NOT NULL REFERENCES letters (id),
+  PRIMARY KEY (syllable_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS syllable_clusters (
+  syllable_id INTEGER NOT NULL REFERENCES syllables (id),
+  position INTEGER NOT NULL,
+  cluster TEXT NOT NULL,
+  is_vowell INTEGER NOT NULL,
+  PRIMARY KEY (syllable_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS morphemes (
+  id INTEGER PRIMARY KEY,
+  letters TEXT NOT NULL,
+  gloss TEXT,
+  is_particle INTEGER NOT NULL,
+  is_suffix INTEGER NOT NULL,
+  UNIQUE (letters, gloss, is_particle, is_suffix)
+);
+CREATE TABLE IF NOT EXISTS words (
+  id INTEGER PRIMARY KEY,
+  ipa TEXT NOT NULL,
+  gloss TEXT NOT NULL,
+  category TEXT NOT NULL,
+  tones TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  line INTEGER,
+  UNIQUE (ipa, gloss, category)
+);
+CREATE TABLE IF NOT EXISTS word_morphemes (
+  word_id INTEGER NOT NULL REFERENCES words (id),
+  position INTEGER NOT NULL,
+  morpheme_id INTEGER NOT NULL REFERENCES morphemes (id),
+  -- The syllables of complete morphemes (first inclusive, end exclusive);
+  -- NULL for morphemes that don't consist of whole syllables.
+  first_syllable INTEGER,
+  end_syllable INTEGER,
+  PRIMARY KEY (word_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS word_syllables (
+  word_id INTEGER NOT NULL REFERENCES words (id),
+  position INTEGER NOT NULL,
+  syllable_id INTEGER NOT NULL REFERENCES syllables (id),
+  PRIMARY KEY (word_id, position)
+) WITHOUT ROWID;
+'''
+
+# Created after the bulk insert, which is much faster than maintaining them
+# row by row.
+_INDEXES = '''
+CREATE INDEX IF NOT EXISTS words_category ON words (category);
+CREATE INDEX IF NOT EXISTS word_syllables_syllable
+  ON word_syllables (syllable_id);
+CREATE INDEX IF NOT EXISTS word_morphemes_morpheme
+  ON word_morphemes (morpheme_id);
+CREATE INDEX IF NOT EXISTS word_morphemes_span
+  ON word_morphemes (end_syllable - first_syllable);
+CREATE INDEX IF NOT EXISTS syllable_clusters_cluster
+  ON syllable_clusters (cluster);
+CREATE INDEX IF NOT EXISTS syllables_letters ON syllables (letters);
+CREATE INDEX IF NOT EXISTS morphemes_gloss ON morphemes (gloss);
+'''
+
+
+def parse_sequence(key):
+  """
+  The letters of a letter sequence stored by `sequence_key`.
+  """
+  return tuple(make_letter(text) for text in key.split(u' ') if text)
+
+
+def parse_syllable(letters, tone):
+  """
+  The syllable stored as the letter sequence `letters` and `tone`.
+  """
+  return make_syllable_from_letters(parse_sequence(letters), tone)
+
+
+def read_syllables(connection):
+  """
+  The syllables of the database, by id.
+  """
+  return {
+    syllable_id: parse_syllable(letters, tone)
+    for syllable_id, letters, tone in connection.execute(
+        'SELECT id, letters, tone FROM syllables')
+  }
+
+
+class CorpusStore(object):
+  """
+  Writes words into the database. Inserts are grouped into transactions of
+  `batch_size` words; call `close` to commit the last one and build the
+  indexes.
+  """
+
+  def __init__(self, path, batch_size=20000):
+    self.connection = sqlite3.connect(path)
+    self.connection.executescript(_SCHEMA)
+    self._batch_size = batch_size
+    self._pending = 0
+    self._letters = self._load_ids('SELECT text, id FROM letters')
+    self._syllables = self._load_ids(
+        'SELECT letters, tone, id FROM syllables')
+    self._morphemes = self._load_ids(
+        'SELECT letters, gloss, is_particle, is_suffix, id FROM morphemes')
+
+  def _load_ids(self, sql):
+    return {row[:-1] if len(row) > 2 else row[0]: row[-1]
+            for row in self.connection.execute(sql)}
+
+  def _letter_id(self, letter):
+    text = letter.text()
+    letter_id = self._letters.get(text)
+    if letter_id is None:
+      letter_id = self._letters[text] = self.connection.execute(
+          'INSERT INTO letters (text, is_vowell) VALUES (?, ?)',
+          (text, letter.is_vowell())).lastrowid
+    return letter_id
+
+  def _syllable_id(self, syllable):
+    key = (sequence_key(syllable.letters()), syllable.tone)
+    syllable_id = self._syllables.get(key)
+    if syllable_id is None:
+      execute = self.connection.execute
+      syllable_id = self._syllables[key] = execute(
+          'INSERT INTO syllables (letters, tone) VALUES (?, ?)',
+          key).lastrowid
+      for position, letter in enumerate(syllable.iter_letters()):
+        execute('INSERT INTO syllable_letters VALUES (?, ?, ?)',
+                (syllable_id, position, self._letter_id(letter)))
+      for position, cluster in enumerate(
+          iter_clusters(syllable.iter_letters())):
+        execute('INSERT INTO syllable_clusters VALUES (?, ?, ?, ?)',
+                (syllable_id, position, sequence_key(cluster),
+                 len(cluster) == 1 and cluster[0].is_vowell()))
+    return syllable_id
+
+  def _morpheme_id(self, morpheme):
+    key = (sequence_key(morpheme.iter_letters()), morpheme.gloss,
+           morpheme.is_particle, morpheme.is_suffix)
+    morpheme_id = self._morphemes.get(key)
+    if morpheme_id is None:
+      morpheme_id = self._morphemes[key] = self.connection.execute(
+          'INSERT INTO morphemes (letters, gloss, is_particle, is_suffix) '
+          'VALUES (?, ?, ?, ?)', key).lastrowid
+    return morpheme_id
+
+  def add_word(self, word, count, line=None):
+    """
+    Adds `count` occurrences of `word`, read from CSV line `line`.
+    """
+    execute = self.connection.execute
+    key = (word.text(), word.gloss, word.category)
+    row = execute(
+        'SELECT id FROM words WHERE ipa = ? AND gloss = ? AND category = ?',
+        key).fetchone()
+    if row is not None:
+      execute('UPDATE words SET count = count + ? WHERE id = ?',
+              (count, row[0]))
+    else:
+      word_id = execute(
+          'INSERT INTO words (ipa, gloss, category, tones, count, line) '
+          'VALUES (?, ?, ?, ?, ?, ?)',
+          key + (u'.'.join(s.tone for s in word.iter_syllables()), count,
+                 line)).lastrowid
+      spans = {m: (first, end)
+               for m, first, end in word.complete_morpheme_spans()}
+      execute_many = self.connection.executemany
+      execute_many(
+          'INSERT INTO word_morphemes VALUES (?, ?, ?, ?, ?)',
+          ((word_id, position, self._morpheme_id(m)) +
+           spans.get(position, (None, None))
+           for position, m in enumerate(word.iter_morphemes())))
+      execute_many(
+          'INSERT INTO word_syllables VALUES (?, ?, ?)',
+          ((word_id, position, self._syllable_id(s))
+           for position, s in enumerate(word.iter_syllables())))
+    self._pending += 1
+    if self._pending >= self._batch_size:
+      self.connection.commit()
+      self._pending = 0
+
+  def word_types(self):
+    """
+    The number of distinct words stored so far.
+    """
+    return self.connection.execute('SELECT COUNT(*) FROM words').fetchone()[0]
+
+  def close(self):
+    self.connection.commit()
+    self.connection.executescript(_INDEXES)
+    self.connection.close()
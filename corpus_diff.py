@@ -0,0 +1,156 @@
+"""
+Compares two exports of the same corpus, like last month's and this month's.
+
+Rows are aligned by their entry, the (IPA, gloss, category) they are parsed
+from, in a dictionary of every entry of an export mapped to the number of
+rows it is on and their total count, without parsing them. Only the entries
+added to, removed from or changed in the newer export need to be parsed to
+tell how its word types differ from those of the older one.
+
+The tables of the two exports are then compared cell by cell, aligning their
+rows and columns by label, into delta tables: the change in every count and
+ratio.
+"""
+
+# The rows and total count of an entry, and the CSV line it is first on.
+ROWS = 0
+COUNT = 1
+LINE = 2
+
+_MISSING = u'--'
+
+
+def entry_key(raw_row):
+  """
+  The entry of a CSV row: the IPA, gloss and category its words are parsed
+  from, or None for rows that are skipped.
+  """
+  ipa = raw_row['IPA']
+  if '*' in ipa:
+    return None
+  return ipa, raw_row['Gloss'] or raw_row['Text'], raw_row['Category']
+
+
+def count_entries(raw_rows, first_line=2, errors=None):
+  """
+  Counts the entries of the rows of an export.
+
+  :param ParseErrorLog errors: Where rows whose count isn't a number are
+    recorded.
+
+  :returns: A dictionary of entries mapped to lists of the number of rows
+    they are on, their total count and the first of their CSV lines.
+  """
+  entries = {}
+  for line_number, raw_row in enumerate(raw_rows, first_line):
+    key = entry_key(raw_row)
+    if key is None:
+      continue
+    try:
+      count = int(raw_row['count'])
+    except ValueError as e:
+      if errors is not None:
+        errors.record(line_number, e, key[0], key[1])
+      continue
+    entry = entries.get(key)
+    if entry is None:
+      entries[key] = [1, count, line_number]
+    else:
+      entry[ROWS] += 1
+      entry[COUNT] += count
+  return entries
+
+
+def compare_entries(old_entries, new_entries):
+  """
+  Aligns the entries of two exports.
+
+  :returns: The lists of the added, removed and changed entries. Only the
+    added, removed and those changed entries whose number of rows changed
+    (rather than just their count) change the word types.
+  """
+  added = [key for key in new_entries if key not in old_entries]
+  removed = [key for key in old_entries if key not in new_entries]
+  changed = [
+      key for key, entry in new_entries.items()
+      if key in old_entries and old_entries[key][:LINE] != entry[:LINE]]
+  return added, removed, changed
+
+
+def _number(text):
+  """
+  The value of a numeric cell and its decimal places, or None.
+  """
+  try:
+    return int(text), 0
+  except ValueError:
+    pass
+  try:
+    value = float(text)
+  except ValueError:
+    return None
+  return value, len(text.partition(u'.')[2])
+
+
+def _delta(old, new):
+  old_number, new_number = _number(old), _number(new)
+  if old_number is None or new_number is None:
+    return _MISSING
+  places = max(old_number[1], new_number[1])
+  delta = round(new_number[0] - old_number[0], places)
+  if not delta:
+    return u'%.*f' % (places, 0)
+  return u'%+.*f' % (places, delta)
+
+
+def _merge_labels(old, new):
+  """
+  The labels of `new`, with those only in `old` before the last label if
+  both end with the same one (like 'Total'), or at the end otherwise.
+  """
+  only_old = [label for label in old if label not in set(new)]
+  if old and new and old[-1] == new[-1]:
+    return new[:-1] + only_old + new[-1:]
+  return new + only_old
+
+
+def delta_table(old_rows, new_rows):
+  """
+  The change from `old_rows` to `new_rows`, two versions of a table, in
+  every cell, e.g. '+3' or '-0.125'. Rows and columns are aligned by label;
+  cells missing from either table, or not numbers, are '--'.
+  """
+  def cells(rows):
+    columns = rows[0][1:]
+    return {
+        (row[0], column): value
+        for row in rows[1:]
+        for column, value in zip(columns, row[1:])}
+
+  old_cells, new_cells = cells(old_rows), cells(new_rows)
+  columns = _merge_labels(old_rows[0][1:], new_rows[0][1:])
+  labels = _merge_labels(
+      [row[0] for row in old_rows[1:]], [row[0] for row in new_rows[1:]])
+  rows = [[u'%s change' % new_rows[0][0]] + columns]
+  for label in labels:
+    row = [label]
+    for column in columns:
+      key = label, column
+      if key in old_cells and key in new_cells:
+        row.append(_delta(old_cells[key], new_cells[key]))
+      else:
+        row.append(_MISSING)
+    rows.append(row)
+  return rows
+
+
+def delta_tables(old_rendered, new_rendered):
+  """
+  The delta tables of two renderings of the same tables, as returned by
+  `render_analyses`.
+  """
+  old_tables = {name: rows for name, rows, _ in old_rendered}
+  return [
+      (name, delta_table(old_tables[name], rows), has_summary_row)
+      for name, rows, has_summary_row in new_rendered
+      if name in old_tables]
@@ -1,31 +1,236 @@
 """
 Loads CSV data into dicts (1 dict per row) assuming the first row is the name
 of the keys.
+
+Inputs compressed with gzip, bz2 or xz are decompressed transparently, and `-`
+reads from standard input. Those are read by a separate thread into a bounded
+queue of chunks, so reading and decompressing overlap with parsing.
 """
 
 
+import bz2
 import csv
+import gzip
+import io
+import lzma
+import os
+import queue
+import sys
+import threading
+
+# The website puts a byte order mark at the beginning of its exports, which
+# the utf-8-sig codec strips (and tolerates not being there).
+_ENCODING = 'utf-8-sig'
+
+STDIN = '-'
+
+# The magic numbers of the compressed formats, and how to open them.
+_DECOMPRESSORS = [
+  (b'\x1f\x8b', lambda f: gzip.GzipFile(fileobj=f)),
+  (b'BZh', bz2.BZ2File),
+  (b'\xfd7zXZ\x00', lzma.LZMAFile),
+]
 
-def csv_rows(filename):
+_CHUNK_SIZE = 1 << 16
+_QUEUE_CHUNKS = 16
+
+
+def _decompressor(stream):
+  """
+  The class that decompresses the buffered binary `stream`, or None if it
+  isn't compressed.
   """
-  Generator that produces one dict for every row of a CSV file. Handles loading
-  the file and 
-  Loads filename `filename` and 
+  head = stream.peek(6)
+  for magic, decompressor in _DECOMPRESSORS:
+    if head.startswith(magic):
+      return decompressor
+  return None
 
-  :param unicode filename: The name of the file to 
 
+def is_plain_file(filename):
+  """
+  Whether `filename` is an uncompressed file, which can be read in place (as
+  opposed to standard input or a compressed file).
+  """
+  if filename == STDIN:
+    return False
+  with open(filename, 'rb') as f:
+    return _decompressor(f) is None
+
+
+class _ChunkReader(io.RawIOBase):
+  """
+  A binary stream of the chunks a thread reads from `source` into a bounded
+  queue. Errors raised while reading are raised again by `readinto`. The
+  thread closes `source` and every stream in `closing` once it is done.
+
+  `bytes_read` is how far the thread has got into the first stream of
+  `closing` (the compressed file), or into `source` if there is none.
   """
-  with open(filename) as csvfile:
-    reader = csv.DictReader(csvfile)
-    line = 0
+
+  def __init__(self, source, closing=(), queue_chunks=_QUEUE_CHUNKS):
+    self.bytes_read = 0
+    self._chunks = queue.Queue(maxsize=queue_chunks)
+    self._stopped = threading.Event()
+    self._buffer = b''
+    self._done = False
+    self._thread = threading.Thread(
+        target=self._read, args=(source, closing))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stopped.is_set():
+      try:
+        self._chunks.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _read(self, source, closing):
     try:
-      for line, row in enumerate(reader, 2):
-        # I should fix the website to not have these 3 random bytes at the
-        # beginning. For now, just work around it.
-        bv = row.pop('\xef\xbb\xbf"IPA"')
-        row['IPA'] = bv
-        yield {key: unicode(value, 'utf-8')
-               for key, value in row.iteritems()}
-    except Exception:
-      print "Failure on line: ", line
-      raise
+      while True:
+        chunk = source.read(_CHUNK_SIZE)
+        if closing:
+          self.bytes_read = closing[0].tell()
+        else:
+          self.bytes_read += len(chunk)
+        if not chunk or not self._put(chunk):
+          break
+    except Exception as e:
+      self._put(e)
+      return
+    finally:
+      for stream in (source,) + tuple(closing):
+        stream.close()
+    self._put(b'')
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    while not self._buffer and not self._done:
+      item = self._chunks.get()
+      if isinstance(item, Exception):
+        self._done = True
+        raise item
+      self._done = not item
+      self._buffer = item
+    n = min(len(b), len(self._buffer))
+    b[:n] = self._buffer[:n]
+    self._buffer = self._buffer[n:]
+    return n
+
+  def close(self):
+    self._stopped.set()
+    super(_ChunkReader, self).close()
+
+
+class _Uncloseable(object):
+
+  def __init__(self, stream):
+    self.read = stream.read
+
+  def close(self):
+    pass
+
+
+def open_csv(filename):
+  """
+  Opens `filename` as text for `iter_csv_rows`. `-` is standard input, and
+  compressed files are decompressed.
+  """
+  closing = ()
+  if filename == STDIN:
+    stream = sys.stdin.buffer
+    if not isinstance(stream, io.BufferedReader):
+      stream = io.BufferedReader(stream)
+  else:
+    stream = open(filename, 'rb')
+    closing = (stream,)
+  decompressor = _decompressor(stream)
+  if filename != STDIN and decompressor is None:
+    # The OS already reads plain files ahead of the parser.
+    stream.close()
+    return open(filename, newline='', encoding=_ENCODING)
+  if decompressor is not None:
+    # The decompressors leave the file they are given open.
+    stream = decompressor(stream)
+  elif filename == STDIN:
+    # Closing the reader must not close standard input.
+    stream = _Uncloseable(stream)
+  return io.TextIOWrapper(
+      io.BufferedReader(_ChunkReader(stream, closing), _CHUNK_SIZE),
+      newline='', encoding=_ENCODING)
+
+
+def input_size(filename):
+  """
+  The size in bytes of `filename` as stored (compressed or not), or None for
+  standard input.
+  """
+  if filename == STDIN:
+    return None
+  return os.path.getsize(filename)
+
+
+def bytes_read(csvfile):
+  """
+  How many bytes of the file (as stored) behind `csvfile`, opened by
+  `open_csv`, have been read.
+  """
+  stream = csvfile.buffer
+  if isinstance(getattr(stream, 'raw', None), _ChunkReader):
+    return stream.raw.bytes_read
+  return stream.tell()
+
+
+def csv_rows(filename, progress=None, errors=None):
+  """
+  Generator that produces one dict for every row of a CSV file.
+
+  :param str filename: The name of the file, which may be compressed with
+    gzip, bz2 or xz, or `-` for standard input.
+  :param progress.Progress progress: If not None, where the progress through
+    the file is reported.
+  :param ParseErrorLog errors: The log of the rows that failed to parse, for
+    the error rate reported to `progress`.
+  """
+  with open_csv(filename) as csvfile:
+    rows = iter_csv_rows(csvfile)
+    if progress is not None:
+      rows = progress.track(
+          rows, u'Reading %s' % filename, total=input_size(filename),
+          position=lambda: bytes_read(csvfile), errors=errors)
+    for row in rows:
+      yield row
+
+
+def read_fieldnames(filename):
+  """
+  Returns the header of a CSV file, suitable for passing back into
+  `iter_csv_rows` when parsing a chunk of the file that has no header line.
+  """
+  with open(filename, newline='', encoding=_ENCODING) as csvfile:
+    return csv.DictReader(csvfile).fieldnames
+
+
+def iter_csv_rows(lines, fieldnames=None, first_line=2):
+  """
+  Generator that produces one dict for every row in `lines`.
+
+  :param lines: An iterable of CSV lines.
+  :param fieldnames: The header of the file. If None, the first line of
+    `lines` is used as the header.
+  :param int first_line: The line number of the first row produced, used when
+    reporting failures.
+  """
+  reader = csv.DictReader(lines, fieldnames=fieldnames)
+  line = 0
+  try:
+    for line, row in enumerate(reader, first_line):
+      yield row
+  except Exception:
+    print("Failure on line: ", line)
+    raise
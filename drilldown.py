@@ -0,0 +1,169 @@
+"""
+An inverted index from the cells of the tables back to the words, and CSV
+lines, that feed them.
+
+While the analyses run, every analysis posts the keys a word contributes to
+(a syllable, a consonant cluster, a melody and category, ...). The postings
+are stored as sorted arrays of word ids in a SQLite file next to the tables,
+together with the CSV lines every word was read from, so looking up a cell is
+a primary key lookup.
+"""
+
+import os
+import sqlite3
+import urllib.parse
+from array import array
+
+INDEX_FILE = 'drilldown.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE words (
+  id INTEGER PRIMARY KEY,
+  ipa TEXT NOT NULL,
+  gloss TEXT NOT NULL,
+  category TEXT,
+  count INTEGER NOT NULL,
+  lines BLOB NOT NULL
+);
+CREATE TABLE postings (
+  kind TEXT NOT NULL,
+  key TEXT NOT NULL,
+  word_ids BLOB NOT NULL,
+  PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+'''
+
+
+class UnknownCell(KeyError):
+  pass
+
+
+class NoIndex(Exception):
+  pass
+
+
+def sequence_key(letters):
+  """
+  The index key of a sequence of letters (a syllable, a cluster, ...).
+  """
+  return u' '.join(l.text() for l in letters)
+
+
+def pair_key(*parts):
+  """
+  The index key of a pair of letter sequences, like a consonant cluster and a
+  vowell.
+  """
+  return u'|'.join(sequence_key(p) for p in parts)
+
+
+class WordSources(object):
+  """
+  Remembers where the words of a corpus came from: an id for every word type,
+  the IPA and gloss it was first read as, and every CSV line it appears on.
+  """
+
+  def __init__(self):
+    self._ids = {}
+    self._texts = []
+    self._lines = []
+
+  def add(self, word, line_number, ipa, gloss):
+    word_id = self._ids.get(word)
+    if word_id is None:
+      word_id = self._ids[word] = len(self._texts)
+      self._texts.append((ipa, gloss))
+      self._lines.append(array('l'))
+    self._lines[word_id].append(line_number)
+
+  def word_id(self, word):
+    return self._ids[word]
+
+  def text(self, word_id):
+    return self._texts[word_id]
+
+  def lines(self, word_id):
+    return self._lines[word_id]
+
+
+class DrilldownIndex(object):
+  """
+  Collects postings while the analyses run.
+  """
+
+  def __init__(self, sources):
+    self.sources = sources
+    self._postings = {}
+
+  def post(self, kind, key, word_id):
+    ids = self._postings.get((kind, key))
+    if ids is None:
+      ids = self._postings[(kind, key)] = array('l')
+    # Words are visited one at a time, so a word posting the same key twice
+    # (say, a word with two identical syllables) is always the last entry.
+    if not ids or ids[-1] != word_id:
+      ids.append(word_id)
+
+  def write(self, outdir, word_counts):
+    """
+    Writes the index into `outdir`, replacing any earlier index.
+    """
+    path = os.path.join(outdir, INDEX_FILE)
+    if os.path.exists(path):
+      os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+      connection.executescript(_SCHEMA)
+      sources = self.sources
+      with connection:
+        connection.executemany(
+            'INSERT INTO words VALUES (?, ?, ?, ?, ?, ?)',
+            ((sources.word_id(word),) + sources.text(sources.word_id(word)) +
+             (word.category, count,
+              sources.lines(sources.word_id(word)).tobytes())
+             for word, count in word_counts.items()))
+        connection.executemany(
+            'INSERT INTO postings VALUES (?, ?, ?)',
+            ((kind, key, ids.tobytes())
+             for (kind, key), ids in self._postings.items()))
+    finally:
+      connection.close()
+
+
+def query(outdir, kind, key):
+  """
+  Looks up the words that feed the cell `key` of kind `kind`.
+
+  :raises NoIndex: If `outdir` has no drill-down index.
+  :raises UnknownCell: If nothing was posted to the cell.
+
+  :returns: A list of (ipa, gloss, category, count, CSV line numbers) tuples.
+  """
+  path = os.path.join(outdir, INDEX_FILE)
+  if not os.path.isfile(path):
+    raise NoIndex(
+        'No drill-down index in %s, re-run the analysis with --drilldown' %
+        outdir)
+  # Read only, so that nothing is ever created in the output directory.
+  connection = sqlite3.connect(
+      'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path)), uri=True)
+  try:
+    row = connection.execute(
+        'SELECT word_ids FROM postings WHERE kind = ? AND key = ?',
+        (kind, key)).fetchone()
+    if row is None:
+      raise UnknownCell('No %s %r in the index' % (kind, key))
+    word_ids = array('l')
+    word_ids.frombytes(row[0])
+    results = []
+    cursor = connection.cursor()
+    for word_id in word_ids:
+      ipa, gloss, category, count, lines_blob = cursor.execute(
+          'SELECT ipa, gloss, category, count, lines FROM words '
+          'WHERE id = ?', (word_id,)).fetchone()
+      lines = array('l')
+      lines.frombytes(lines_blob)
+      results.append((ipa, gloss, category, count, list(lines)))
+    return results
+  finally:
+    connection.close()
@@ -0,0 +1,97 @@
+"""
+Validates a CSV export without analysing it, for the `check` command.
+
+Every row goes through the same steps as when it is parsed for the tables
+(the tone annotation, the morphemes against the glosses, the syllables
+against the tones and every letter against the letter table) and fails with
+the same errors, but no words are built or counted. The rows are read in
+this process and checked in chunks by a pool of forked worker processes,
+which send back only the errors.
+"""
+
+import itertools
+import multiprocessing
+
+from csv_loader import csv_rows
+from word_parsing import check_word
+
+# The number of rows checked by a worker at a time.
+CHUNK_ROWS = 2000
+
+
+def _error_message(e):
+  return str(e.args[0]) if e.args else u''
+
+
+def check_rows(rows):
+  """
+  Checks rows like `analyse.iter_row_words` parses them.
+
+  :param rows: (line number, ipa, gloss, category, count) tuples, the gloss
+    being that of the words (the Text column for rows without a gloss).
+
+  :returns: A list of the (line number, error type name, message, ipa,
+    gloss) of the rows that fail.
+  """
+  failed = []
+  for line_number, ipa, gloss, category, count in rows:
+    try:
+      int(count)
+      # The same clean up as iter_row_words.
+      mod_ipa = ipa.replace('(', '').replace(')', '')
+      for i, g in zip(mod_ipa.split('/'), gloss.split('/')):
+        check_word(i, g)
+    except Exception as e:
+      failed.append(
+          (line_number, type(e).__name__, _error_message(e), ipa, gloss))
+  return failed
+
+
+def _check_chunk(rows):
+  return len(rows), check_rows(rows)
+
+
+def _iter_chunks(raw_rows, first_line=2):
+  rows = (
+      (line_number, raw_row['IPA'], raw_row['Gloss'] or raw_row['Text'],
+       raw_row['Category'], raw_row['count'])
+      for line_number, raw_row in enumerate(raw_rows, first_line)
+      if '*' not in raw_row['IPA'])
+  while True:
+    chunk = list(itertools.islice(rows, CHUNK_ROWS))
+    if not chunk:
+      return
+    yield chunk
+
+
+def check_export(filename, errors, jobs=1, progress=None):
+  """
+  Checks every row of the CSV `filename`, recording those that fail in
+  `errors`, in the order of their lines.
+
+  :param int jobs: The number of worker processes to check the rows in.
+    Where processes can't be forked, or with a single job, the rows are
+    checked in this process.
+  :param progress.Progress progress: If not None, where the progress through
+    the file is reported.
+
+  :returns: The number of rows checked (rows with a '*' in their IPA are
+    skipped, as when parsing).
+  """
+  chunks = _iter_chunks(csv_rows(filename, progress, errors))
+  checked = 0
+  pool = None
+  if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+    pool = multiprocessing.get_context('fork').Pool(jobs)
+    results = pool.imap(_check_chunk, chunks)
+  else:
+    results = map(_check_chunk, chunks)
+  try:
+    for rows, failed in results:
+      checked += rows
+      for error in failed:
+        errors.add(*error)
+  finally:
+    if pool is not None:
+      pool.terminate()
+  return checked
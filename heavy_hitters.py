@@ -0,0 +1,138 @@
+"""
+Finds the most frequent keys of a stream in bounded memory.
+
+`HeavyHitters` counts keys exactly for as long as there are no more distinct
+keys than its capacity. Past that, it keeps counting only `capacity` of them
+with the Space-Saving algorithm (Metwally, Agrawal and El Abbadi, 2005): a
+key that isn't counted takes the place of the one with the smallest count,
+inheriting that count as its possible overestimate, its error. Every count
+is then at least the true count and at most `error` more than it, and every
+key counted more than `total / capacity` times is sure to be among those
+kept.
+
+Moving from exact to approximate counting keeps the `capacity` largest
+counts, with no error: the keys dropped were counted no more than the
+smallest of those kept, as the algorithm needs.
+"""
+
+import heapq
+
+
+class HeavyHitters(object):
+  """
+  Counts the `k` most frequent keys.
+
+  :param int capacity: The number of keys counted at most, by default ten
+    times `k`, and at least 1000.
+  :param bool exact: If True, every key is counted exactly, however many
+    there are.
+  """
+
+  def __init__(self, k, capacity=None, exact=False):
+    if k < 1:
+      raise ValueError('k must be at least 1')
+    if exact:
+      capacity = None
+    elif capacity is None:
+      capacity = max(10 * k, 1000)
+    elif capacity < k:
+      raise ValueError('The capacity must be at least k')
+    self.k = k
+    self.capacity = capacity
+    self.total = 0
+    # The [count, error] of every key counted.
+    self._counts = {}
+    # Once approximating, a heap of (count, order, key) of the keys counted,
+    # some of them with stale counts.
+    self._heap = None
+
+  @property
+  def exact(self):
+    """
+    Whether every count is exact so far.
+    """
+    return self._heap is None
+
+  def add(self, key, count=1):
+    """
+    Counts `key` `count` times.
+    """
+    self.total += count
+    entry = self._counts.get(key)
+    if entry is not None:
+      entry[0] += count
+      if self._heap is not None:
+        self._push(entry[0], key)
+      return
+    if self.capacity is None or len(self._counts) < self.capacity:
+      self._counts[key] = [count, 0]
+      if self._heap is not None:
+        self._push(count, key)
+      return
+    if self._heap is None:
+      self._start_approximating()
+    smallest, evicted = self._pop_smallest()
+    del self._counts[evicted]
+    self._counts[key] = [smallest + count, smallest]
+    self._push(smallest + count, key)
+
+  def _start_approximating(self):
+    kept = sorted(
+        self._counts.items(), key=lambda item: -item[1][0])[:self.capacity]
+    self._counts = dict(kept)
+    self._heap = []
+    self._rebuild_heap()
+
+  def _rebuild_heap(self):
+    # Keys don't have to be comparable: ties are broken by insertion order.
+    self._heap = [
+        (entry[0], i, key)
+        for i, (key, entry) in enumerate(self._counts.items())]
+    heapq.heapify(self._heap)
+    self._pushes = len(self._heap)
+
+  def _push(self, count, key):
+    if len(self._heap) > 4 * self.capacity:
+      # Most of the heap is stale counts by now.
+      self._rebuild_heap()
+    else:
+      heapq.heappush(self._heap, (count, self._pushes, key))
+      self._pushes += 1
+
+  def _pop_smallest(self):
+    heap = self._heap
+    while True:
+      count, _, key = heapq.heappop(heap)
+      entry = self._counts.get(key)
+      if entry is not None and entry[0] == count:
+        return count, key
+
+  def top(self):
+    """
+    The `k` most frequent keys, as (key, count, error) tuples, most frequent
+    first: the true count of each is between `count - error` and `count`.
+    """
+    ranked = sorted(
+        ((key, entry[0], entry[1]) for key, entry in self._counts.items()),
+        key=lambda item: -item[1])
+    return ranked[:self.k]
+
+  def guaranteed(self):
+    """
+    The number of the first keys of `top` that are sure to be among the
+    `k` most frequent: those whose smallest possible count is no less than
+    any count outside of `top`.
+    """
+    ranked = sorted((entry for entry in self._counts.values()),
+                    key=lambda entry: -entry[0])
+    if self.exact:
+      return min(self.k, len(ranked))
+    # Keys that aren't counted were seen no more often than the smallest
+    # count.
+    outside = ranked[self.k][0] if len(ranked) > self.k else ranked[-1][0]
+    guaranteed = 0
+    for count, error in ranked[:self.k]:
+      if count - error < outside:
+        break
+      guaranteed += 1
+    return guaranteed
@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 from string import ascii_lowercase
 import string
 
+_LETTERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'letters.json')
+
 _get_letters_cache = None
 def _get_letters():
   global _get_letters_cache
   if _get_letters_cache is None:
-    _get_letters_cache = json.load(open('letters.json'))
+    with open(_LETTERS_FILE, encoding='utf-8') as f:
+      _get_letters_cache = json.load(f)
     VOWELLS = set(x for x in 'aeiouy')
     CONSONANTES = set(ascii_lowercase).difference(VOWELLS).union(
         set(['kp', 'gb'])
@@ -21,20 +26,28 @@ def _get_letters():
     )
   return _get_letters_cache
 
+_by_letter_cache = None
+def _by_letter():
+  """
+  The first entry of the letter table for every letter.
+  """
+  global _by_letter_cache
+  if _by_letter_cache is None:
+    _by_letter_cache = {}
+    for l in _get_letters():
+      _by_letter_cache.setdefault(l[0], l)
+  return _by_letter_cache
+
 def is_vowell(letter):
-  if type(letter) is not unicode:
-    letter = unicode(letter, "utf-8")
   try:
-    return next(l[-1] for l in _get_letters() if l[0] == letter)
-  except StopIteration:
+    return _by_letter()[letter][-1]
+  except KeyError:
     raise IndexError(letter)
 
 def to_tipa(letter):
-  if type(letter) is not unicode:
-    letter = unicode(letter, "utf-8")
   try:
-    l = next(l[1][0] for l in _get_letters() if l[0] == letter)
-  except StopIteration:
+    l = _by_letter()[letter][1][0]
+  except KeyError:
     raise IndexError(letter)
   if len(l) == 4 and l[0] == '\\' and l[-1] == ' ' and (
       l[1] not in string.ascii_lowercase and
@@ -43,19 +56,32 @@ def to_tipa(letter):
     l = l[:-1]
   return l
 
-def _safe_index(l, v):
-  try:
-    return l.index(v)
-  except ValueError:
-    return None
-
 def to_order_tuple(letter):
+  # Letters missing from an order get -1, sorting before any index like
+  # Python 2 used to sort None.
   return (
-      _safe_index(_VOWEL_ORDER, letter),
-      _safe_index(_CONSONANT_ORDER, letter),
-      unicode(letter)
+      _VOWEL_RANKS.get(letter, -1),
+      _CONSONANT_RANKS.get(letter, -1),
+      letter
   )
 
+_collation_ranks_cache = None
+def collation_rank(letter):
+  """
+  The position of `letter` among every letter of the letter table, sorted by
+  `to_order_tuple`, so letters can be sorted by a precomputed integer.
+  """
+  global _collation_ranks_cache
+  if _collation_ranks_cache is None:
+    _collation_ranks_cache = {
+      l: i for i, l in enumerate(
+          sorted(_by_letter(), key=to_order_tuple))
+    }
+  try:
+    return _collation_ranks_cache[letter]
+  except KeyError:
+    raise IndexError(letter)
+
 
 _CONSONANT_ORDER = (
   u'pbtdʈɖcɟkɡqɢʔmɱnɳɲŋɴʙrʀⱱɾɽɸβfvθðszʃʒʂʐçʝxɣχʁħʕhɦɬɮʋɹɻjwɥɰlɭʎʟʘǀǃǂǁɓɗʄɠʛʍʜʢ'
@@ -63,3 +89,6 @@ _CONSONANT_ORDER = (
 )
 
 _VOWEL_ORDER = u'iyɨʉɯuɪʏʊeøɘɵɤoɛœɜɞʌɔæɐaɶɑɒə'
+
+_CONSONANT_RANKS = {l: i for i, l in enumerate(_CONSONANT_ORDER)}
+_VOWEL_RANKS = {l: i for i, l in enumerate(_VOWEL_ORDER)}
@@ -0,0 +1,194 @@
+"""
+Accounts for the memory a run takes, by stage and by type of object.
+
+A `MemoryReport` traces every allocation made by Python with tracemalloc.
+Every stage of the run (reading the CSV, computing the tables, ...) is
+measured: the memory held at its end, how much of it the stage added, its
+peak, and the source lines that allocated most of what it added. Once the
+words are loaded, a census counts the objects the garbage collector tracks
+by type, with their shallow sizes, telling how much of the memory is held by
+words, morphemes, syllables and letters, and by the tuples, dictionaries and
+lists around them. Strings and numbers aren't tracked by the collector, so
+they are only seen in the allocation sites.
+
+Tracing slows the run down a few times. Only the memory Python allocates is
+seen, not that of the interpreter itself or of C libraries like SQLite, nor
+that of worker processes.
+"""
+
+import gc
+import sys
+import tracemalloc
+
+# The parsed objects the census reports on, whatever their share.
+PARSED_TYPES = ('Word', 'Morpheme', 'Syllable', 'Letter')
+
+_IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>',
+                  '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+def format_bytes(size):
+  """
+  `size` bytes in B, KiB, MiB or GiB.
+  """
+  for unit in [u'B', u'KiB', u'MiB']:
+    if abs(size) < 1024:
+      break
+    size /= 1024.0
+  else:
+    unit = u'GiB'
+  if unit == u'B':
+    return u'%d B' % size
+  return u'%.1f %s' % (size, unit)
+
+
+def census():
+  """
+  Counts the objects tracked by the garbage collector by type.
+
+  :returns: A dictionary of type names mapped to [objects, bytes] lists, the
+    bytes being the shallow sizes of the objects.
+  """
+  counts = {}
+  for o in gc.get_objects():
+    name = type(o).__name__
+    entry = counts.get(name)
+    if entry is None:
+      entry = counts[name] = [0, 0]
+    entry[0] += 1
+    entry[1] += sys.getsizeof(o)
+  return counts
+
+
+class _NoStage(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+def stage(report, name):
+  """
+  The `MemoryReport.stage` `name` of `report`, or a context measuring
+  nothing if `report` is None.
+  """
+  if report is None:
+    return _NoStage()
+  return report.stage(name)
+
+
+class _Stage(object):
+  """
+  Measures one stage of a `MemoryReport`.
+  """
+
+  def __init__(self, report, name):
+    self._report = report
+    self.name = name
+
+  def __enter__(self):
+    self._before = self._report._last_snapshot()
+    self._before_bytes = tracemalloc.get_traced_memory()[0]
+    if hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+    return self
+
+  def __exit__(self, *exc_info):
+    current, peak = tracemalloc.get_traced_memory()
+    after = self._report._snapshot()
+    differences = after.compare_to(self._before, 'lineno')
+    differences = [
+        d for d in differences
+        if d.traceback[0].filename not in _IGNORED_FILES]
+    self._report.stages.append({
+      'name': self.name,
+      'bytes': current,
+      'added_bytes': current - self._before_bytes,
+      'peak_bytes': peak,
+      'sites': [
+          (u'%s:%d' % (d.traceback[0].filename, d.traceback[0].lineno),
+           d.size_diff, d.count_diff)
+          for d in differences if d.size_diff > 0][:self._report.top],
+    })
+    self._before = None
+    return False
+
+
+class MemoryReport(object):
+  """
+  :param int top: The number of allocation sites and object types listed.
+  """
+
+  def __init__(self, top=10):
+    self.top = top
+    self.stages = []
+    self.word_types = None
+    self.word_bytes = None
+    self.objects = None
+    self._snapshot_taken = None
+
+  def start(self):
+    tracemalloc.start()
+
+  def stop(self):
+    tracemalloc.stop()
+    self._snapshot_taken = None
+
+  def _snapshot(self):
+    self._snapshot_taken = tracemalloc.take_snapshot()
+    return self._snapshot_taken
+
+  def _last_snapshot(self):
+    """
+    The snapshot taken at the end of the last stage, or a new one. Stages
+    follow each other, so what little is allocated in between is counted
+    in the next stage.
+    """
+    return self._snapshot_taken or self._snapshot()
+
+  def stage(self, name):
+    """
+    A context measuring the stage of the run `name`.
+    """
+    return _Stage(self, name)
+
+  def take_census(self, word_types):
+    """
+    Counts the objects in memory, once the `word_types` words are loaded.
+    """
+    self.word_types = word_types
+    self.word_bytes = tracemalloc.get_traced_memory()[0]
+    self.objects = census()
+
+  def format(self):
+    """
+    The report, as lines of text.
+    """
+    lines = [u'Memory by stage (held at the end, added, peak):']
+    for s in self.stages:
+      added = s['added_bytes']
+      lines.append(u'  %s: %s, %s%s, peak %s' % (
+          s['name'], format_bytes(s['bytes']), u'+' if added >= 0 else u'-',
+          format_bytes(abs(added)), format_bytes(s['peak_bytes'])))
+    if self.word_types:
+      lines.append(u'%d word types, %s per word type' % (
+          self.word_types, format_bytes(self.word_bytes / self.word_types)))
+    if self.objects is not None:
+      lines.append(u'Objects once the words are loaded (shallow sizes):')
+      largest = sorted(
+          self.objects.items(), key=lambda item: -item[1][1])[:self.top]
+      names = [n for n in PARSED_TYPES if n in self.objects]
+      names.extend(n for n, _ in largest if n not in names)
+      for name in names:
+        count, size = self.objects[name]
+        lines.append(u'  %s: %d objects, %s' % (
+            name, count, format_bytes(size)))
+    for s in self.stages:
+      if s['sites']:
+        lines.append(u'Top allocation sites of %s:' % s['name'])
+        for site, size, count in s['sites']:
+          lines.append(u'  %s: %s in %d blocks' % (
+              site, format_bytes(size), count))
+    return lines
@@ -0,0 +1,213 @@
+"""
+A search index over the morphemes of a corpus.
+
+Morphemes are indexed by their letters in three tries (keyed by letter, so a
+digraph like `kp` is a single step): one over the letters for prefix lookups,
+one over the reversed letters for suffix lookups, and one over every suffix of
+the letters for substring lookups. Every trie node holds the sorted ids of
+the morphemes below it, so a lookup walks the query letters and nothing else.
+An inverted index maps glosses to morphemes, and every morpheme lists the
+words it appears in.
+
+The index is written as JSON, so queries never need the CSV again.
+"""
+
+import json
+from collections import namedtuple
+
+INDEX_FILE = 'morpheme_index.json'
+
+_PARTICLE_GLOSS = u'PART'
+
+MorphemeEntry = namedtuple(
+    'MorphemeEntry',
+    ['id', 'text', 'gloss', 'is_particle', 'is_suffix', 'word_types',
+     'tokens'])
+
+WordEntry = namedtuple('WordEntry', ['ipa', 'gloss', 'category', 'count'])
+
+
+class LetterTrie(object):
+  """
+  A trie keyed by letter texts. Each node is a pair of the sorted ids inserted
+  through it and a dict of child node indexes, kept in one flat list so the
+  trie serializes compactly.
+  """
+
+  def __init__(self, nodes=None):
+    self._nodes = nodes if nodes is not None else [[[], {}]]
+
+  def insert(self, letters, item_id):
+    """
+    Adds `item_id` to every node along `letters`. Ids must be inserted in
+    non-decreasing order.
+    """
+    nodes = self._nodes
+    node = nodes[0]
+    for letter in letters:
+      child = node[1].get(letter)
+      if child is None:
+        child = node[1][letter] = len(nodes)
+        nodes.append([[], {}])
+      node = nodes[child]
+      ids = node[0]
+      if not ids or ids[-1] != item_id:
+        ids.append(item_id)
+
+  def lookup(self, letters):
+    """
+    The ids inserted through the path `letters`.
+    """
+    nodes = self._nodes
+    node = nodes[0]
+    for letter in letters:
+      child = node[1].get(letter)
+      if child is None:
+        return []
+      node = nodes[child]
+    return node[0]
+
+  def to_json(self):
+    return self._nodes
+
+  @classmethod
+  def from_json(cls, nodes):
+    return cls(nodes)
+
+
+def _letter_texts(letters):
+  return [l.text() for l in letters]
+
+
+class MorphemeIndex(object):
+  """
+  The index itself. Build it with `build` or `load` it from a file written by
+  `save`.
+  """
+
+  def __init__(self, morphemes, words, morpheme_words, glosses, prefixes,
+               suffixes, substrings):
+    self._morphemes = morphemes
+    self._words = words
+    self._morpheme_words = morpheme_words
+    self._glosses = glosses
+    self._prefixes = prefixes
+    self._suffixes = suffixes
+    self._substrings = substrings
+
+  @classmethod
+  def build(cls, word_counts):
+    """
+    Indexes the morphemes of every word in `word_counts`.
+    """
+    ids = {}
+    morphemes = []
+    words = []
+    morpheme_words = []
+    for word_id, (word, count) in enumerate(word_counts.items()):
+      words.append(WordEntry(word.text(), word.gloss, word.category, count))
+      for m in word.iter_morphemes():
+        morpheme_id = ids.get(m)
+        if morpheme_id is None:
+          morpheme_id = ids[m] = len(morphemes)
+          morphemes.append(MorphemeEntry(
+              morpheme_id, _letter_texts(m.iter_letters()),
+              _PARTICLE_GLOSS if m.is_particle else m.gloss,
+              m.is_particle, m.is_suffix, 0, 0))
+          morpheme_words.append([])
+        entry = morphemes[morpheme_id]
+        occurrences = morpheme_words[morpheme_id]
+        if not occurrences or occurrences[-1] != word_id:
+          occurrences.append(word_id)
+          morphemes[morpheme_id] = entry._replace(
+              word_types=entry.word_types + 1, tokens=entry.tokens + count)
+
+    glosses = {}
+    prefixes = LetterTrie()
+    suffixes = LetterTrie()
+    substrings = LetterTrie()
+    for entry in morphemes:
+      glosses.setdefault(entry.gloss, []).append(entry.id)
+      prefixes.insert(entry.text, entry.id)
+      suffixes.insert(reversed(entry.text), entry.id)
+      for start in range(len(entry.text)):
+        substrings.insert(entry.text[start:], entry.id)
+    return cls(morphemes, words, morpheme_words, glosses, prefixes, suffixes,
+               substrings)
+
+  def save(self, filename):
+    with open(filename, 'w', encoding='utf-8') as f:
+      json.dump({
+        'morphemes': [list(m) for m in self._morphemes],
+        'words': [list(w) for w in self._words],
+        'morpheme_words': self._morpheme_words,
+        'glosses': self._glosses,
+        'prefixes': self._prefixes.to_json(),
+        'suffixes': self._suffixes.to_json(),
+        'substrings': self._substrings.to_json(),
+      }, f, ensure_ascii=False, separators=(',', ':'))
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename, encoding='utf-8') as f:
+      data = json.load(f)
+    return cls(
+        [MorphemeEntry(*m) for m in data['morphemes']],
+        [WordEntry(*w) for w in data['words']],
+        data['morpheme_words'],
+        data['glosses'],
+        LetterTrie.from_json(data['prefixes']),
+        LetterTrie.from_json(data['suffixes']),
+        LetterTrie.from_json(data['substrings']),
+    )
+
+  def find(self, text=None, prefix=None, suffix=None, contains=None,
+           gloss=None):
+    """
+    Finds the morphemes matching every given criterion.
+
+    :param text: The letters of the morpheme, as parsed by `make_letters`.
+    :param prefix: Letters the morpheme starts with.
+    :param suffix: Letters the morpheme ends with.
+    :param contains: Letters appearing anywhere in the morpheme.
+    :param str gloss: The gloss of the morpheme (PART for particles).
+
+    :returns: A list of MorphemeEntry, most frequent (by tokens) first.
+    """
+    candidates = []
+    if text is not None:
+      text = _letter_texts(text)
+      candidates.append(
+          i for i in self._prefixes.lookup(text)
+          if self._morphemes[i].text == text)
+    if prefix is not None:
+      candidates.append(self._prefixes.lookup(_letter_texts(prefix)))
+    if suffix is not None:
+      candidates.append(
+          self._suffixes.lookup(reversed(_letter_texts(suffix))))
+    if contains is not None:
+      candidates.append(self._substrings.lookup(_letter_texts(contains)))
+    if gloss is not None:
+      candidates.append(self._glosses.get(gloss, []))
+
+    if candidates:
+      ids = set(candidates[0])
+      for c in candidates[1:]:
+        ids.intersection_update(c)
+    else:
+      ids = range(len(self._morphemes))
+    return sorted(
+        (self._morphemes[i] for i in ids),
+        key=lambda m: (-m.tokens, m.id))
+
+  def glosses(self, morpheme_text):
+    """
+    The glosses a morpheme with exactly these letters is used with.
+    """
+    return sorted(set(m.gloss for m in self.find(text=morpheme_text)))
+
+  def words(self, morpheme):
+    """
+    The words a morpheme appears in, as a list of WordEntry.
+    """
+    return [self._words[i] for i in self._morpheme_words[morpheme.id]]
@@ -0,0 +1,141 @@
+"""
+Counts the n-grams of sequences of symbols (letters, clusters, tones, ...).
+
+Symbols are interned as small integer codes by an `Alphabet`, and an n-gram
+of codes is packed into a single integer, a fixed number of bits per code.
+`NgramCounts` keeps the counts in a flat array indexed by the packed n-grams
+for as long as that array stays small (alphabets of a few dozen letters, or
+tones), widening it as the alphabet grows, and in a dictionary of packed
+n-grams past that (like trigrams of a few hundred clusters).
+"""
+
+from array import array
+from collections import defaultdict
+
+# The most cells a dense array of counts may have (8 MiB of counts).
+MAX_DENSE = 1 << 20
+
+
+class Alphabet(object):
+  """
+  Interns symbols as the codes 0, 1, 2, ...
+  """
+
+  def __init__(self):
+    self._codes = {}
+    self.symbols = []
+
+  def __len__(self):
+    return len(self.symbols)
+
+  def code(self, symbol):
+    code = self._codes.get(symbol)
+    if code is None:
+      code = self._codes[symbol] = len(self.symbols)
+      self.symbols.append(symbol)
+    return code
+
+  def codes(self, symbols):
+    return [self.code(s) for s in symbols]
+
+
+class NgramCounts(object):
+  """
+  Counts n-grams of `order` codes.
+  """
+
+  def __init__(self, order):
+    if order < 1:
+      raise ValueError('The order of n-grams must be at least 1')
+    self.order = order
+    self._bits = 1
+    self._dense = array('q', [0]) * (1 << order)
+    self._sparse = None
+
+  def _widen(self, code):
+    """
+    Makes room for codes up to `code`, re-packing the counts so far.
+    """
+    counts = list(self.items())
+    bits = self._bits
+    while code >> bits:
+      bits += 1
+    self._bits = bits
+    if self._sparse is None and (1 << (bits * self.order)) <= MAX_DENSE:
+      self._dense = array('q', [0]) * (1 << (bits * self.order))
+    else:
+      self._dense = None
+      self._sparse = defaultdict(lambda: 0)
+    for ngram, count in counts:
+      self._add_packed(self._pack(ngram), count)
+
+  def _pack(self, ngram):
+    bits = self._bits
+    packed = 0
+    for code in ngram:
+      packed = (packed << bits) | code
+    return packed
+
+  def _unpack(self, packed):
+    bits = self._bits
+    mask = (1 << bits) - 1
+    codes = []
+    for _ in range(self.order):
+      codes.append(packed & mask)
+      packed >>= bits
+    return tuple(reversed(codes))
+
+  def _add_packed(self, packed, count):
+    if self._dense is not None:
+      self._dense[packed] += count
+    else:
+      self._sparse[packed] += count
+
+  def add(self, ngram, count=1):
+    """
+    Counts `ngram`, a sequence of `order` codes, `count` times.
+    """
+    top = max(ngram)
+    if top >> self._bits:
+      self._widen(top)
+    self._add_packed(self._pack(ngram), count)
+
+  def items(self):
+    """
+    Yields the (n-gram, count) of every n-gram counted, n-grams as tuples of
+    codes.
+    """
+    if self._dense is not None:
+      for packed, count in enumerate(self._dense):
+        if count:
+          yield self._unpack(packed), count
+    else:
+      for packed, count in self._sparse.items():
+        if count:
+          yield self._unpack(packed), count
+
+  def transitions(self):
+    """
+    The counts as a dictionary of contexts (the first `order - 1` codes)
+    mapped to dictionaries of the codes following them.
+    """
+    matrix = defaultdict(lambda: defaultdict(lambda: 0))
+    for ngram, count in self.items():
+      matrix[ngram[:-1]][ngram[-1]] += count
+    return matrix
+
+
+def iter_ngrams(codes, order, groups=None):
+  """
+  Yields the n-grams of `order` consecutive `codes`, as tuples.
+
+  :param groups: If not None, the group (like the syllable) of every code;
+    (n-gram, crosses groups) pairs are yielded instead, telling the n-grams
+    lying within a group from those spanning several.
+  """
+  for i in range(len(codes) - order + 1):
+    ngram = tuple(codes[i:i + order])
+    if groups is None:
+      yield ngram
+    else:
+      yield ngram, groups[i] != groups[i + order - 1]
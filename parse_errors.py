@@ -0,0 +1,139 @@
+"""
+Collects the rows of a CSV that could not be parsed.
+
+Exports from the website can contain a lot of broken rows. Rather than
+printing every one of them while parsing, they are recorded here and reported
+once at the end, as a summary and optionally as a CSV or JSONL file.
+"""
+
+import csv
+import json
+import sys
+from array import array
+
+
+class TooManyParseErrors(Exception):
+  pass
+
+
+def _text(value):
+  if isinstance(value, bytes):
+    return value.decode('utf-8', 'replace')
+  return str(value)
+
+
+class ParseErrorLog(object):
+  """
+  A compact record of parse errors: the line number, exception type, message,
+  IPA and gloss of every failing row.
+
+  :param int max_errors: The number of errors after which parsing is aborted
+    by raising `TooManyParseErrors`. None for no limit.
+  :param bool strict: If True, the first error is re-raised instead of being
+    recorded.
+  """
+
+  def __init__(self, max_errors=None, strict=False):
+    self.max_errors = max_errors
+    self.strict = strict
+    self._lines = array('l')
+    self._type_indexes = array('H')
+    self._messages = []
+    self._ipas = []
+    self._glosses = []
+    self._type_names = []
+    self._type_index_by_name = {}
+
+  def __len__(self):
+    return len(self._lines)
+
+  def record(self, line_number, exception, ipa, gloss):
+    """
+    Records that the row on `line_number` failed with `exception`.
+
+    Must be called from within the `except` block handling `exception`, so
+    that strict mode can re-raise it with its traceback.
+    """
+    if self.strict:
+      print("Error on line %d" % line_number, file=sys.stderr)
+      raise
+    self.add(line_number, type(exception).__name__,
+             exception.args[0] if exception.args else u'', ipa, gloss)
+
+  def add(self, line_number, type_name, message, ipa, gloss):
+    """
+    Records that the row on `line_number` failed with an exception of the
+    type `type_name`, like `record`, for errors caught elsewhere (like in
+    another process).
+    """
+    type_index = self._type_index_by_name.get(type_name)
+    if type_index is None:
+      type_index = len(self._type_names)
+      self._type_names.append(type_name)
+      self._type_index_by_name[type_name] = type_index
+    self._lines.append(line_number)
+    self._type_indexes.append(type_index)
+    self._messages.append(message)
+    self._ipas.append(ipa)
+    self._glosses.append(gloss)
+    if self.max_errors is not None and len(self) > self.max_errors:
+      raise TooManyParseErrors(
+          'More than %d parse errors, giving up on line %d' % (
+            self.max_errors, line_number))
+
+  def __iter__(self):
+    """
+    Yields (line number, exception type name, message, ipa, gloss) tuples.
+    """
+    for i, line in enumerate(self._lines):
+      yield (line, self._type_names[self._type_indexes[i]],
+             self._messages[i], self._ipas[i], self._glosses[i])
+
+  def counts_by_type(self):
+    """
+    Returns a list of (exception type name, count, first line) tuples, most
+    common first.
+    """
+    counts = [0] * len(self._type_names)
+    first_lines = [None] * len(self._type_names)
+    for line, type_index in zip(self._lines, self._type_indexes):
+      counts[type_index] += 1
+      if first_lines[type_index] is None:
+        first_lines[type_index] = line
+    return sorted(
+        zip(self._type_names, counts, first_lines),
+        key=lambda x: (-x[1], x[0]))
+
+  def summary(self):
+    """
+    Returns a short, human readable summary of the errors.
+    """
+    if not len(self):
+      return u'No parse errors'
+    lines = [u'Skipped %d rows with parse errors:' % len(self)]
+    for type_name, count, first_line in self.counts_by_type():
+      lines.append(u'  %s: %d (first on line %d)' % (
+          type_name, count, first_line))
+    return u'\n'.join(lines)
+
+  def write_report(self, filename):
+    """
+    Writes every error to `filename`, as JSON lines if the name ends in
+    `.jsonl` or `.json`, and as CSV otherwise.
+    """
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+      if filename.endswith(('.jsonl', '.json')):
+        for line, type_name, message, ipa, gloss in self:
+          f.write(json.dumps({
+            'line': line,
+            'error': type_name,
+            'message': _text(message),
+            'ipa': ipa,
+            'gloss': gloss,
+          }, ensure_ascii=False))
+          f.write('\n')
+      else:
+        writer = csv.writer(f)
+        writer.writerow(['line', 'error', 'message', 'ipa', 'gloss'])
+        for row in self:
+          writer.writerow([_text(x) for x in row])
@@ -0,0 +1,151 @@
+"""
+Reports how far a long run has got.
+
+A `Progress` passes on the rows (or words) of a phase of the run, like
+parsing the CSV or running the analyses, and every `interval` seconds
+reports the percent done, the rows per second, the parse error rate and the
+estimated time left. While parsing, the percent done is the fraction of the
+bytes of the file read so far, so it is known without counting the rows
+first.
+
+Reports go to a stream (standard error), and to an optional heartbeat file: a
+small JSON object, replaced atomically on every report, which a job
+scheduler can poll to notice a run that stopped making progress. Its
+`updated` field is the Unix time of the last report, and `done` is true once
+the phase finished. Steps with nothing to count, like writing the tables,
+update the heartbeat as they start.
+"""
+
+import json
+import os
+import sys
+import time
+
+# The clock is only looked at every this many rows.
+_CHECK_EVERY = 64
+
+
+def format_duration(seconds):
+  """
+  `seconds` as h:mm:ss.
+  """
+  minutes, seconds = divmod(int(round(seconds)), 60)
+  hours, minutes = divmod(minutes, 60)
+  return u'%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class Progress(object):
+  """
+  :param stream: Where the reports are written, or None.
+  :param float interval: The seconds between two reports.
+  :param str heartbeat: If not None, the heartbeat file.
+  :param clock: The function giving the current time, in seconds.
+  """
+
+  def __init__(self, stream=sys.stderr, interval=2.0, heartbeat=None,
+               clock=time.monotonic):
+    self.stream = stream
+    self.interval = interval
+    self.heartbeat = heartbeat
+    self._clock = clock
+    self._in_place = stream is not None and stream.isatty()
+
+  def track(self, items, phase, total=None, position=None, errors=None,
+            unit=u'rows'):
+    """
+    Generator passing on `items`, the rows or words of `phase`, and reporting
+    the progress made through them.
+
+    :param total: The total of `position`, or of items if `position` is None,
+      or None if unknown.
+    :param position: If not None, a function giving how far into `total` (in
+      bytes) the items read so far are.
+    :param errors: If not None, the `ParseErrorLog` of the rows.
+    :param str unit: What the items are, in the reports.
+    """
+    start = self._clock()
+    next_report = start + self.interval
+    done = 0
+    for done, item in enumerate(items, 1):
+      yield item
+      if not done % _CHECK_EVERY:
+        now = self._clock()
+        if now >= next_report:
+          self._report(
+              phase, unit, done, now - start, total, position, errors)
+          next_report = now + self.interval
+    self._report(phase, unit, done, self._clock() - start, total, position,
+                 errors, finished=True)
+
+  def stage(self, phase, finished=False):
+    """
+    Records in the heartbeat file that `phase` started (or `finished`), for
+    the steps of the run with no rows or words to track (like rendering or
+    writing the tables), so that a run stalling in them is noticed too.
+    """
+    if self.heartbeat is not None:
+      self._write_heartbeat(self._status(
+          phase, u'steps', 0, 0.0, None, None, None, finished))
+
+  def _status(self, phase, unit, done, elapsed, total, position, errors,
+              finished):
+    status = {
+      'pid': os.getpid(),
+      'phase': phase,
+      'unit': unit,
+      'items': done,
+      'elapsed_seconds': round(elapsed, 3),
+      'items_per_second': round(done / elapsed, 1) if elapsed > 0 else None,
+      'error_rate': round(len(errors) / done, 4) if errors and done else 0.0,
+      'percent': None,
+      'eta_seconds': None,
+      'done': finished,
+      'updated': time.time(),
+    }
+    if position is not None:
+      status['bytes'] = position()
+    if total:
+      fraction = (position() if position is not None else done) / total
+      status['percent'] = 100.0 if finished else round(
+          min(fraction, 1.0) * 100, 1)
+      if 0 < fraction < 1 and not finished:
+        status['eta_seconds'] = round(elapsed * (1 - fraction) / fraction)
+    return status
+
+  def _line(self, status):
+    unit = status['unit']
+    parts = [u'%d %s' % (status['items'], unit)]
+    if status['items_per_second'] is not None:
+      parts.append(u'%d %s/s' % (status['items_per_second'], unit))
+    if status['error_rate']:
+      parts.append(u'%.1f%% errors' % (status['error_rate'] * 100))
+    if status['done']:
+      return u'%s: done in %s (%s)' % (
+          status['phase'], format_duration(status['elapsed_seconds']),
+          u', '.join(parts))
+    if status['eta_seconds'] is not None:
+      parts.append(u'ETA %s' % format_duration(status['eta_seconds']))
+    percent = u''
+    if status['percent'] is not None:
+      percent = u' %.1f%%' % status['percent']
+    return u'%s:%s (%s)' % (status['phase'], percent, u', '.join(parts))
+
+  def _report(self, phase, unit, done, elapsed, total, position, errors,
+              finished=False):
+    status = self._status(
+        phase, unit, done, elapsed, total, position, errors, finished)
+    if self.stream is not None:
+      line = self._line(status)
+      if self._in_place:
+        self.stream.write(u'\r\x1b[K' + line + (u'\n' if finished else u''))
+      else:
+        self.stream.write(line + u'\n')
+      self.stream.flush()
+    if self.heartbeat is not None:
+      self._write_heartbeat(status)
+
+  def _write_heartbeat(self, status):
+    temporary = self.heartbeat + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+      json.dump(status, f)
+    os.replace(temporary, self.heartbeat)
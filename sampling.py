@@ -0,0 +1,149 @@
+"""
+Estimates the tables of a corpus from a random sample of its rows.
+
+`reservoir_sample` picks rows uniformly at random in a single pass over the
+CSV, with Li's Algorithm L, which skips ahead a random number of rows
+between replacements instead of drawing a random number for every row. The
+analyses run on the sample, their counts are scaled up by the inverse of the
+sampling fraction `f`, and `annotate_tables` then adds the estimated standard
+error to every cell, depending on the kind of table:
+
+- COUNT: a count `X`, estimated from the `x = X f` counted in the sample.
+  Its error is taken as Poisson, with the finite population correction:
+  `sqrt(x (1 - f)) / f`.
+- RATIO: a ratio like observed/expected, `r`, of the count `X` in the same
+  cell of a COUNT table. Its relative error is that of the count:
+  `r sqrt((1 - f) / x)`. The last row and column hold fractions of the
+  total of the COUNT table instead.
+- FRACTION: a fraction `p` of the total `M` of its row in a COUNT table,
+  `m = M f` in the sample: `sqrt(p (1 - p) (1 - f) / m)`.
+
+Cells counting nothing in the sample are left as they are. These are
+approximations: the syllables of one word aren't independent, for one.
+"""
+
+import itertools
+import math
+import random
+
+COUNT = 'count'
+RATIO = 'ratio'
+FRACTION = 'fraction'
+
+_PLUS_MINUS = u'%s $\\pm$ %s'
+
+
+def _uniform(rng):
+  """
+  A random number in the open interval (0, 1).
+  """
+  while True:
+    u = rng.random()
+    if u > 0:
+      return u
+
+
+def reservoir_sample(items, size, rng=None):
+  """
+  Picks `size` of `items` uniformly at random, reading them once.
+
+  :param random.Random rng: The random numbers to use.
+
+  :returns: The list of picked items, in no particular order, and the number
+    of items read.
+  """
+  rng = rng or random.Random()
+  items = iter(items)
+  reservoir = list(itertools.islice(items, size))
+  if len(reservoir) < size:
+    return reservoir, len(reservoir)
+  total = size
+  w = math.exp(math.log(_uniform(rng)) / size)
+  next_pick = size + int(math.log(_uniform(rng)) / math.log(1 - w))
+  for total, item in enumerate(items, size + 1):
+    if total - 1 == next_pick:
+      reservoir[rng.randrange(size)] = item
+      w *= math.exp(math.log(_uniform(rng)) / size)
+      next_pick += 1 + int(math.log(_uniform(rng)) / math.log(1 - w))
+  return reservoir, total
+
+
+def _body(rows):
+  """
+  The (row, column) positions of the numeric cells of a table.
+  """
+  for i in range(1, len(rows)):
+    for j in range(1, len(rows[i])):
+      yield i, j
+
+
+def _count_errors(rows, fraction):
+  annotated = [list(r) for r in rows]
+  for i, j in _body(rows):
+    count = int(rows[i][j])
+    if count:
+      error = math.sqrt(count * (1 - fraction) / fraction)
+      annotated[i][j] = _PLUS_MINUS % (rows[i][j], u'%d' % round(error))
+  return annotated
+
+
+def _ratio_errors(rows, counts, fraction):
+  annotated = [list(r) for r in rows]
+  total = int(counts[-1][-1]) * fraction
+  last_row, last_column = len(rows) - 1, len(rows[0]) - 1
+  for i, j in _body(rows):
+    if i == last_row and j == last_column:
+      continue
+    value = float(rows[i][j])
+    count = int(counts[i][j]) * fraction
+    if not count:
+      continue
+    if i == last_row or j == last_column:
+      error = math.sqrt(value * (1 - value) * (1 - fraction) / total)
+    else:
+      error = value * math.sqrt((1 - fraction) / count)
+    annotated[i][j] = _PLUS_MINUS % (rows[i][j], u'%.3f' % error)
+  return annotated
+
+
+def _fraction_errors(rows, counts, fraction):
+  annotated = [list(r) for r in rows]
+  last_column = len(rows[0]) - 1
+  for i, j in _body(rows):
+    value = float(rows[i][j])
+    row_total = int(counts[i][-1]) * fraction
+    if j == last_column or not value or not row_total:
+      continue
+    error = math.sqrt(value * (1 - value) * (1 - fraction) / row_total)
+    annotated[i][j] = _PLUS_MINUS % (rows[i][j], u'%.3f' % error)
+  return annotated
+
+
+def annotate_tables(rendered, fraction, estimates):
+  """
+  Adds the estimated standard error to every cell of the tables estimated
+  from a sample.
+
+  :param rendered: The tables, as returned by `render_analyses`, with their
+    counts already scaled up to the whole corpus.
+  :param float fraction: The fraction of the corpus that was sampled.
+  :param dict estimates: The (kind, COUNT table) of every table to annotate
+    by name, the COUNT table being None for COUNT tables. Other tables are
+    left as they are.
+
+  :returns: The annotated tables, like `rendered`.
+  """
+  if fraction >= 1:
+    return rendered
+  by_name = {name: rows for name, rows, _ in rendered}
+  annotated = []
+  for name, rows, has_summary_row in rendered:
+    kind, counts = estimates.get(name, (None, None))
+    if kind == COUNT:
+      rows = _count_errors(rows, fraction)
+    elif kind == RATIO:
+      rows = _ratio_errors(rows, by_name[counts], fraction)
+    elif kind == FRACTION:
+      rows = _fraction_errors(rows, by_name[counts], fraction)
+    annotated.append((name, rows, has_summary_row))
+  return annotated
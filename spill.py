@@ -0,0 +1,164 @@
+"""
+Counters that keep to a memory budget.
+
+A `SpillingCounter` counts keys in a dictionary until it holds more keys than
+its budget allows, then writes them out sorted, as a run in a temporary file,
+and starts over with an empty dictionary. Reading the counts back merges the
+runs and what is still in memory in a single pass, adding up the counts of
+keys found in several of them, so the counts are exactly those a plain
+dictionary would have held.
+
+Keys are written as tuples of strings made by the `encode` function the
+counter is given, which must tell apart the keys the dictionary would, and are
+read back with `decode`.
+"""
+
+import heapq
+import itertools
+import json
+import operator
+import os
+import shutil
+import tempfile
+import weakref
+
+# Once there are this many runs they are merged into one, so no more files
+# than this are ever open at once.
+MAX_FAN_IN = 64
+
+_key = operator.itemgetter(0)
+
+
+def _write_run(path, records):
+  with open(path, 'w', encoding='utf-8') as f:
+    for key, count in records:
+      f.write(json.dumps(list(key) + [count], ensure_ascii=False))
+      f.write(u'\n')
+
+
+def _read_run(path):
+  with open(path, encoding='utf-8') as f:
+    for line in f:
+      record = json.loads(line)
+      yield tuple(record[:-1]), record[-1]
+
+
+def merge_counts(runs):
+  """
+  Merges iterables of (key, count) pairs, each sorted by key, into one sorted
+  iterable, adding up the counts of equal keys.
+  """
+  for key, records in itertools.groupby(heapq.merge(*runs, key=_key), _key):
+    yield key, sum(count for _, count in records)
+
+
+class SpillingCounter(object):
+  """
+  Counts keys like a `defaultdict(int)`, keeping at most `budget` bytes of
+  them in memory, estimating every key to take `entry_size` bytes. Runs are
+  written to a temporary directory in `directory` (by default the system's),
+  which is removed by `close` or once the counter is garbage collected.
+
+  `counter[key]` and `key in counter` only see the keys counted since the
+  last spill, which is all `counter[key] += count` needs; `items`, `keys` and
+  `len` see all of them.
+  """
+
+  def __init__(self, budget, encode, decode, entry_size=1024, directory=None):
+    self._encode = encode
+    self._decode = decode
+    self._max_keys = max(1, budget // entry_size)
+    self._directory = directory
+    self._counts = {}
+    self._runs = []
+    self._tempdir = None
+    self._cleanup = None
+    self._next_run = 0
+
+  def __getitem__(self, key):
+    return self._counts.get(key, 0)
+
+  def __setitem__(self, key, count):
+    self._counts[key] = count
+    if len(self._counts) > self._max_keys:
+      self.spill()
+
+  def __contains__(self, key):
+    return key in self._counts
+
+  def update(self, keys):
+    """
+    Counts every key in `keys` once.
+    """
+    for key in keys:
+      self[key] += 1
+
+  @property
+  def spills(self):
+    """
+    The number of runs on disk.
+    """
+    return len(self._runs)
+
+  def _new_run(self):
+    if self._tempdir is None:
+      self._tempdir = tempfile.mkdtemp(prefix='spill-', dir=self._directory)
+      self._cleanup = weakref.finalize(
+          self, shutil.rmtree, self._tempdir, ignore_errors=True)
+    path = os.path.join(self._tempdir, 'run-%d' % self._next_run)
+    self._next_run += 1
+    return path
+
+  def spill(self):
+    """
+    Writes the keys in memory out as a run.
+    """
+    if not self._counts:
+      return
+    path = self._new_run()
+    _write_run(path, sorted(
+        (self._encode(key), count) for key, count in self._counts.items()))
+    self._counts = {}
+    self._runs.append(path)
+    if len(self._runs) >= MAX_FAN_IN:
+      path = self._new_run()
+      _write_run(path, merge_counts(_read_run(run) for run in self._runs))
+      for run in self._runs:
+        os.remove(run)
+      self._runs = [path]
+
+  def _iter_encoded(self):
+    in_memory = sorted(
+        (self._encode(key), count) for key, count in self._counts.items())
+    return merge_counts(
+        [_read_run(run) for run in self._runs] + [in_memory])
+
+  def items(self):
+    """
+    Iterates over (key, count) pairs, sorted by encoded key once the counter
+    has spilled.
+    """
+    if not self._runs:
+      return self._counts.items()
+    return ((self._decode(key), count)
+            for key, count in self._iter_encoded())
+
+  def keys(self):
+    return (key for key, _ in self.items())
+
+  __iter__ = keys
+
+  def __len__(self):
+    if not self._runs:
+      return len(self._counts)
+    return sum(1 for _ in self._iter_encoded())
+
+  def close(self):
+    """
+    Removes the runs on disk.
+    """
+    if self._cleanup is not None:
+      self._cleanup()
+    self._tempdir = self._cleanup = None
+    self._counts = {}
+    self._runs = []
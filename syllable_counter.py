@@ -1,10 +1,12 @@
 
+from word_parsing import collation_key
+
 class SyllableCounter(object):
 
   def __init__(self, syllable_counts, vowells, consonants):
     self._syllable_counts = syllable_counts
-    self._vowells = sorted(list(vowells))
-    self._consonants = sorted(list(consonants))
+    self._vowells = sorted(vowells, key=collation_key)
+    self._consonants = sorted(consonants, key=collation_key)
     self._vowell_count_cache = {}
     self._consonant_count_cache = {}
     self._total_count = None
@@ -0,0 +1,149 @@
+"""
+Writes tables, given as lists of rows of cell strings (the first row being the
+header), in the formats the analysis can output:
+
+- tex: a LaTeX `tabular`, as has always been written.
+- longtable: a LaTeX `longtable`, which breaks across pages and repeats its
+  header on each one (needs `\\usepackage{longtable}`).
+- csv and tsv: one line per row.
+- json: an object with the header, the body rows and the summary row, the
+  numbers in the body and summary as JSON numbers.
+
+Tables are written one row at a time into a temporary file next to the
+target, which only replaces the target if their contents differ, so tables
+that didn't change keep their modification times.
+"""
+
+import csv
+import filecmp
+import itertools
+import json
+import math
+import os
+
+FORMATS = ('tex', 'longtable', 'csv', 'tsv', 'json')
+
+_EXTENSIONS = {
+  'tex': '.tex',
+  'longtable': '.tex',
+  'csv': '.csv',
+  'tsv': '.tsv',
+  'json': '.json',
+}
+
+
+class UnknownFormat(ValueError):
+  pass
+
+
+def check_formats(formats):
+  """
+  :raises UnknownFormat: If `formats` has an unknown format, or two formats
+    writing the same files.
+  """
+  unknown = [f for f in formats if f not in _EXTENSIONS]
+  if unknown:
+    raise UnknownFormat('Unknown formats: %s' % ', '.join(unknown))
+  if 'tex' in formats and 'longtable' in formats:
+    raise UnknownFormat('tex and longtable both write .tex files')
+
+
+def table_filename(name, format):
+  """
+  The file name of the table `name` (like `syllable_counts.tex`) in `format`.
+  """
+  return os.path.splitext(name)[0] + _EXTENSIONS[format]
+
+
+def _body_rows(rows):
+  return itertools.islice(rows, 1, len(rows) - 1)
+
+
+def iter_tabular_lines(rows, has_summary_row=True, longtable=False):
+  """
+  Generator producing the lines of the LaTeX table of `rows`. The last row is
+  set apart when `has_summary_row`.
+  """
+  environment = u'longtable' if longtable else u'tabular'
+  first_row = rows[0]
+  yield u'\\begin{%s}{%s}' % (environment, u'|'.join(
+    (u'l|',) + tuple(u'l' for _ in range(len(first_row)-2)) + (u'|l',)))
+  yield u'%s \\\\' % u' & '.join(first_row)
+  yield u'\\hline'
+  yield u'\\hline'
+  if longtable:
+    yield u'\\endhead'
+  for r in _body_rows(rows):
+    yield u'%s \\\\' % u' & '.join(r)
+  if has_summary_row:
+    yield u'\\hline'
+    yield u'\\hline'
+  yield u'%s \\\\' % u' & '.join(rows[-1])
+  yield u'\\end{%s}' % environment
+
+
+def write_delimited(f, rows, delimiter):
+  writer = csv.writer(f, delimiter=delimiter, lineterminator='\n')
+  for r in rows:
+    writer.writerow(r)
+
+
+def _json_cell(cell):
+  for parse in (int, float):
+    try:
+      value = parse(cell)
+    except ValueError:
+      continue
+    # JSON has no NaN or infinities, those are kept as text.
+    if math.isfinite(value):
+      return value
+    break
+  return cell
+
+
+def _write_json(f, rows, has_summary_row):
+  def dump(row):
+    # The first cell labels the row.
+    return json.dumps(
+        list(row[:1]) + [_json_cell(c) for c in row[1:]],
+        ensure_ascii=False, allow_nan=False)
+  f.write(u'{"header": %s,\n "rows": [' % json.dumps(
+      rows[0], ensure_ascii=False, allow_nan=False))
+  body = _body_rows(rows)
+  if not has_summary_row:
+    body = itertools.chain(body, [rows[-1]])
+  for i, r in enumerate(body):
+    f.write(u'%s\n  %s' % (u',' if i else u'', dump(r)))
+  summary = dump(rows[-1]) if has_summary_row else u'null'
+  f.write(u'],\n "summary": %s}\n' % summary)
+
+
+def _write(f, rows, has_summary_row, format):
+  if format in ('tex', 'longtable'):
+    lines = iter_tabular_lines(
+        rows, has_summary_row, longtable=format == 'longtable')
+    f.write(next(lines))
+    for line in lines:
+      f.write(u'\n')
+      f.write(line)
+  elif format == 'json':
+    _write_json(f, rows, has_summary_row)
+  else:
+    write_delimited(f, rows, u',' if format == 'csv' else u'\t')
+
+
+def write_table(path, rows, has_summary_row=True, format='tex'):
+  """
+  Writes the table of `rows` to `path` in `format`, leaving the file untouched
+  if it already holds exactly that table.
+
+  :returns: True if the file was written.
+  """
+  temporary = path + '.tmp'
+  with open(temporary, 'w', encoding='utf-8', newline='') as f:
+    _write(f, rows, has_summary_row, format)
+  if os.path.isfile(path) and filecmp.cmp(temporary, path, shallow=False):
+    os.remove(temporary)
+    return False
+  os.replace(temporary, path)
+  return True
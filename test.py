@@ -1,22 +1,105 @@
 # -*- coding: utf-8 -*-
 
+import bz2
+import gc
+import gzip
+import io
+import json
+import lzma
+import os
+import random
+import shutil
+import tempfile
+import time
 import unittest
+import weakref
 
-from itertools import izip
-from csv_loader import csv_rows
+from bench import generate_corpus
+from collections import defaultdict
+from corpus_diff import count_entries, delta_table, delta_tables
+from csv_loader import csv_rows, is_plain_file
+from export_check import check_export
+from heavy_hitters import HeavyHitters
 from letters import is_vowell
-from analyse import tones_to_melody
+from analyse import (
+    analyze,
+    check_main,
+    count_top,
+    diff_exports,
+    Disyllables,
+    iter_row_words,
+    load_word_counts,
+    main,
+    make_tabular,
+    morphemes_main,
+    Melodies,
+    MelodyContours,
+    iter_csv_words,
+    Ngrams,
+    query_main,
+    tones_to_melody,
+    top_tables,
+    update_word_counts,
+    write_sample_tables,
+    write_tables,
+)
+from corpus_db import CorpusStore
+from analyses import (
+    all_tables,
+    analysis_classes,
+    cell_key,
+    render_analyses,
+    render_parallel,
+    run_analyses,
+    UnknownTable,
+)
+from drilldown import query, UnknownCell
+from memory_report import format_bytes, MemoryReport
+from morpheme_index import MorphemeIndex
+from parse_errors import ParseErrorLog, TooManyParseErrors
+from ngrams import Alphabet, iter_ngrams, MAX_DENSE, NgramCounts
+from progress import format_duration, Progress
+from sampling import annotate_tables, COUNT, FRACTION, reservoir_sample
+from spill import MAX_FAN_IN, SpillingCounter
+from table_writer import (
+    check_formats,
+    table_filename,
+    UnknownFormat,
+    write_table,
+)
+from tones import (
+    BadToneAnnotation,
+    COMPLEX,
+    contour,
+    FALLING,
+    FALLING_RISING,
+    LEVEL,
+    melody,
+    melody_text,
+    parse_melody,
+    RISING,
+    RISING_FALLING,
+    split_annotation,
+    tone_code,
+    tone_levels,
+    tone_text,
+)
+from watch import CorpusState, refresh, watch
 from word_parsing import (
     BadIPATone,
+    collation_key,
     InvalidLetter,
     make_letter,
     make_letters,
     make_morpheme,
     make_morphemes,
     make_syllable,
+    make_syllable_from_letters,
     make_syllables,
     make_word,
     MorphemeMismatch,
+    SYLLABLE_RULES,
+    syllabify,
     SyllablesMustHaveVowells,
     ToneTextSyllableMismatch,
     Word,
@@ -43,15 +126,35 @@ class TestWordParsing(unittest.TestCase):
     a[make_letter('l')] += 1
     self.assertEqual(a[make_letter('l')], 2)
 
+  def test_syllable_from_letters(self):
+    self.assertIs(make_syllable_from_letters(make_letters(u'li'), u'3'),
+                  make_syllable(u'li', 3))
+
+  def test_shared_parts_are_freed(self):
+    """
+    Morphemes and syllables are shared while words use them, and freed once
+    none does.
+    """
+    word = make_word(u'gbɔgbɔ-li^{4.1.4}', u'unshared-NMLZ', u'N')
+    self.assertIs(
+        make_word(u'gbɔgbɔ-li^{4.1.4}', u'unshared-NMLZ', u'V').morphemes[0],
+        word.morphemes[0])
+    morpheme = weakref.ref(word.morphemes[0])
+    syllable = weakref.ref(word.syllables[0])
+    del word
+    gc.collect()
+    self.assertIsNone(morpheme())
+    self.assertIsNone(syllable())
+
   def test_letters_split(self):
     for input_text, expected in [
       (u'kɔ', [u'k', u'ɔ']),
-      (u' k\~ɔ', [u'k', u'\~ɔ']),
-      (u'kɔ^~', [u'k', u'\~ɔ']),
-      (u'kɔ^{~}', [u'k', u'\~ɔ']),
-      (u'kɔ~', [u'k', u'\~ɔ']),
+      (u' k\\~ɔ', [u'k', u'\\~ɔ']),
+      (u'kɔ^~', [u'k', u'\\~ɔ']),
+      (u'kɔ^{~}', [u'k', u'\\~ɔ']),
+      (u'kɔ~', [u'k', u'\\~ɔ']),
       (u'k^{w} ɔ', [u'k^{w}', u'ɔ']),
-      (u'k^{w}(\~ɔ)', [u'k^{w}', u'\~ɔ']),
+      (u'k^{w}(\\~ɔ)', [u'k^{w}', u'\\~ɔ']),
       (u'k^{w}ɔ:', [u'k^{w}', u'ɔ:']),
       (u'kpa', [u'kp', u'a']),
       (u'kba', [u'k', u'b', u'a']),
@@ -61,9 +164,9 @@ class TestWordParsing(unittest.TestCase):
       self.assertEqual(make_letters(input_text),
                        list(make_letter(x) for x in expected))
     for input_text, expected in [
-      (u'k\~ɔ', [u'k', u'ɔ']),
+      (u'k\\~ɔ', [u'k', u'ɔ']),
       (u' k^{w}ɔ', [u'k', u'ɔ']),
-      (u'\tk^{w}\~ɔ', [u'k', u'ɔ']),
+      (u'\tk^{w}\\~ɔ', [u'k', u'ɔ']),
       (u'k^{w}ɔ:', [u'k^{w}', u'ɔ']),
     ]:
       self.assertNotEqual(make_letters(input_text),
@@ -71,7 +174,7 @@ class TestWordParsing(unittest.TestCase):
 
   def test_invalid_letters(self):
     self.assertRaises(InvalidLetter, lambda: make_letter('a^{w}'))
-    self.assertRaises(InvalidLetter, lambda: make_letter('\~k'))
+    self.assertRaises(InvalidLetter, lambda: make_letter('\\~k'))
  
   def test_make_syllables(self):
     self.assertEqual(make_syllables(u'ɟekapip', '1.23.4'),
@@ -91,6 +194,18 @@ class TestWordParsing(unittest.TestCase):
     a[make_syllable(u'ɟe', u'1')] += 1
     self.assertEqual(a[make_syllable(u'ɟe', u'1')], 2)
 
+  def test_values_are_shared(self):
+    """
+    Identical syllables and morphemes from different words are one instance.
+    """
+    a = make_word(u'ɟe-je^{42.3}', u'egg-SG', u'N')
+    b = make_word(u'ba-je^{1.3}', u'log-SG', u'N')
+    self.assertIs(a.syllables[1], b.syllables[1])
+    self.assertIs(a.morphemes[1], b.morphemes[1])
+    self.assertIs(make_syllable(u'ɟe', u'1'), make_syllable(u'ɟe', u'1'))
+    self.assertIs(make_letter(u'ɟ'), a.syllables[0].letters()[0])
+    self.assertFalse(hasattr(a, '__dict__'))
+
   def test_syllable_must_have_vowell(self):
     self.assertRaises(
         SyllablesMustHaveVowells,
@@ -108,6 +223,25 @@ class TestWordParsing(unittest.TestCase):
         lambda: make_syllables(u'cata', '1')
     )
 
+  def test_syllable_rules(self):
+    def split(text, rules):
+      return [u''.join(l.text() for l in letters)
+              for letters in syllabify(make_letters(text),
+                                       SYLLABLE_RULES[rules])]
+    self.assertEqual(split(u'kaptaəl', 'default'), [u'ka', u'pta', u'əl'])
+    self.assertEqual(
+        split(u'kaptaəl', 'single-onset'), [u'kap', u'ta', u'əl'])
+    self.assertEqual(split(u'kaptaəl', 'diphthongs'), [u'ka', u'ptaəl'])
+    self.assertEqual(split(u'kpa', 'single-onset'), [u'kpa'])
+    self.assertRaises(
+        SyllablesMustHaveVowells,
+        lambda: syllabify(make_letters(u'kp'), SYLLABLE_RULES['diphthongs']))
+    self.assertEqual(
+        make_syllables(u'siə', '3', SYLLABLE_RULES['diphthongs']),
+        [make_syllable(u'siə', u'3')])
+    self.assertRaises(
+        ToneTextSyllableMismatch, lambda: make_syllables(u'siə', '3'))
+
   def test_make_morphemes(self):
     self.assertEqual(
         make_morphemes('ku-lala-bi-pod', 'PART-bat-mouse-PART'),
@@ -185,6 +319,20 @@ class TestWordParsing(unittest.TestCase):
     ]:
       self.assertEqual(list(parsed.iter_complete_morphemes()), manually)
 
+  def test_word_complete_morpheme_spans(self):
+    """
+    Complete morphemes are also available as morpheme and syllable indexes.
+    """
+    for parsed, spans in [
+        (make_word('koka-n-o^{12.3.4}', 'A-B-C', 'N'), ((0, 0, 2),)),
+        (make_word('bo-ka^{1.2}', 'A-B', 'N'), ((0, 0, 1), (1, 1, 2))),
+        (make_word('b-o-kana-p-o^{1.2.2.3}', 'PART-PART-C-D-E', 'N'),
+         ((2, 1, 3),)),
+        (make_word('b-o-p-o^{1.2}', 'PART-A-B-C', 'N'), ()),
+        (make_word('bok-alo^{1.2.3}', 'A-B', 'N'), ()),
+    ]:
+      self.assertEqual(parsed.complete_morpheme_spans(), spans)
+
   def test_word_parsing(self):
     """
     Verify that words are correctly parsed into morphemes.
@@ -268,6 +416,72 @@ class TestLetters(unittest.TestCase):
     self.assertRaises(IndexError, lambda: is_vowell('9'))
     self.assertRaises(IndexError, lambda: is_vowell(''))
 
+  def test_collation_keys(self):
+    """
+    Collation keys sort letters and letter sequences like comparing them.
+    """
+    letters = make_letters(u'kpbaiəɛ\\~al^{w}a:gb')
+    self.assertEqual(
+        [l.text() for l in sorted(letters, key=lambda l: l.collation_key)],
+        [u'gb', u'kp', u'b', u'l^{w}', u'i', u'ɛ', u'a', u'a:', u'\\~a',
+         u'ə'])
+    sequences = [make_letters(t) for t in [u'ba', u'b', u'ab', u'kpa', u'a']]
+    self.assertEqual(
+        [u''.join(l.text() for l in s)
+         for s in sorted(sequences, key=collation_key)],
+        [u'kpa', u'b', u'ba', u'a', u'ab'])
+
+
+class TestTones(unittest.TestCase):
+  """
+  Tests for the tones module.
+  """
+
+  def test_split_annotation(self):
+    self.assertEqual(
+        split_annotation(u'k^{w}ɔ-li^{12.3-4}'),
+        (u'k^{w}ɔ-li', [u'12', u'3', u'4']))
+    for ipa in [u'li', u'li^{3}x', u'li^{a}', u'li^{}', u'li^{3}\n']:
+      self.assertRaises(BadToneAnnotation, lambda: split_annotation(ipa))
+    self.assertRaises(BadIPATone, lambda: make_word(u'li^{3}x', u'eat', u'V'))
+
+  def test_codes_are_interned(self):
+    self.assertEqual(tone_code(u'12'), tone_code(u'12'))
+    self.assertNotEqual(tone_code(u'12'), tone_code(u'21'))
+    self.assertEqual(tone_text(tone_code(u'12')), u'12')
+    self.assertEqual(tone_levels(tone_code(u'12')), (1, 2))
+    self.assertEqual(make_syllable(u'li', u'12').tone, u'12')
+
+  def test_melody(self):
+    codes = [tone_code(t) for t in [u'2', u'2', u'31', u'1']]
+    self.assertEqual(melody(codes), (2, 3, 1))
+    self.assertEqual(melody_text(melody(codes)), u'231')
+    self.assertEqual(parse_melody(u'231'), (2, 3, 1))
+    self.assertEqual(melody([]), ())
+
+  def test_contour(self):
+    self.assertEqual(contour((3,)), LEVEL)
+    self.assertEqual(contour((1, 2, 4)), RISING)
+    self.assertEqual(contour((4, 1)), FALLING)
+    self.assertEqual(contour((2, 3, 1)), RISING_FALLING)
+    self.assertEqual(contour((3, 1, 2)), FALLING_RISING)
+    self.assertEqual(contour((1, 3, 2, 4)), COMPLEX)
+
+  def test_long_melodies(self):
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, csv_rows('./test_data.csv'))
+    melodies = Melodies()
+    try:
+      Melodies.max_length = None
+      run_analyses(word_counts, [melodies])
+    finally:
+      Melodies.max_length = 2
+    self.assertIn(((4, 2, 3), u'N'), melodies.counts_of_category_melody)
+    contours = MelodyContours()
+    run_analyses(word_counts, [contours])
+    self.assertEqual(
+        contours.counts_of_category_contour[(FALLING_RISING, u'N')], 1)
+
 
 class TestCSVLoader(unittest.TestCase):
   """
@@ -296,10 +510,1109 @@ class TestCSVLoader(unittest.TestCase):
   ]
 
   def test_loads_test_data(self):
-    for observed, expected in izip(csv_rows('./test_data.csv'),
+    for observed, expected in zip(csv_rows('./test_data.csv'),
                                    self.TEST_FILE_DATA):
       self.assertEqual(observed, expected)
 
+  def test_loads_compressed_data(self):
+    with open('./test_data.csv', 'rb') as f:
+      data = f.read()
+    tempdir = tempfile.mkdtemp()
+    try:
+      for name, compress in [('test_data.csv.gz', gzip.compress),
+                             ('test_data.csv.bz2', bz2.compress),
+                             ('test_data.csv.xz', lzma.compress)]:
+        filename = os.path.join(tempdir, name)
+        with open(filename, 'wb') as f:
+          f.write(compress(data))
+        self.assertFalse(is_plain_file(filename))
+        self.assertEqual(list(csv_rows(filename)), self.TEST_FILE_DATA)
+      self.assertTrue(is_plain_file('./test_data.csv'))
+    finally:
+      shutil.rmtree(tempdir)
+
+  def test_truncated_data_fails(self):
+    with open('./test_data.csv', 'rb') as f:
+      data = gzip.compress(f.read())
+    tempdir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tempdir, 'test_data.csv.gz')
+      with open(filename, 'wb') as f:
+        f.write(data[:len(data) // 2])
+      self.assertRaises(EOFError, lambda: list(csv_rows(filename)))
+    finally:
+      shutil.rmtree(tempdir)
+
+class TestParseErrorLog(unittest.TestCase):
+  """
+  Tests for the collection of rows that fail to parse.
+  """
+
+  ROWS = [
+    {"IPA": u"li^{3}", "Gloss": u"eat", "Category": u"V", "Text": u"",
+     "count": u"2"},
+    {"IPA": u"li", "Gloss": u"eat", "Category": u"V", "Text": u"",
+     "count": u"1"},
+    {"IPA": u"li-bo^{3.1}", "Gloss": u"eat", "Category": u"V", "Text": u"",
+     "count": u"1"},
+    {"IPA": u"bo^{1}", "Gloss": u"log", "Category": u"N", "Text": u"",
+     "count": u"many"},
+    {"IPA": u"bo^{1.2}", "Gloss": u"log", "Category": u"N", "Text": u"",
+     "count": u"1"},
+  ]
+
+  def test_errors_are_collected(self):
+    """
+    Rows that fail to parse, for whatever reason, are recorded and skipped.
+    """
+    errors = ParseErrorLog()
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, self.ROWS, errors=errors)
+    self.assertEqual(word_counts, {make_word(u'li^{3}', u'eat', u'V'): 2})
+    self.assertEqual(
+        list(line for line, _, _, _, _ in errors), [3, 4, 5, 6])
+    self.assertEqual(errors.counts_by_type(), [
+      ('BadIPATone', 1, 3),
+      ('MorphemeMismatch', 1, 4),
+      ('ToneTextSyllableMismatch', 1, 6),
+      ('ValueError', 1, 5),
+    ])
+
+  def test_max_errors(self):
+    """
+    Parsing stops once the error budget is exceeded.
+    """
+    self.assertRaises(
+        TooManyParseErrors,
+        lambda: update_word_counts(
+          defaultdict(lambda: 0), self.ROWS,
+          errors=ParseErrorLog(max_errors=3)))
+    update_word_counts(
+        defaultdict(lambda: 0), self.ROWS, errors=ParseErrorLog(max_errors=4))
+
+  def test_max_errors_exit(self):
+    """
+    Giving up still reports the errors so far, and exits with a message.
+    """
+    tempdir = tempfile.mkdtemp()
+    try:
+      report = os.path.join(tempdir, 'errors.csv')
+      with self.assertRaises(SystemExit) as raised:
+        main(['./test_data.csv', os.path.join(tempdir, 'out'),
+              '--max-errors', '0', '--error-report', report])
+      self.assertEqual(
+          raised.exception.code,
+          'More than 0 parse errors, giving up on line 6')
+      with open(report, encoding='utf-8') as f:
+        self.assertEqual(f.read().splitlines()[1].split(',')[:2],
+                         ['6', 'ToneTextSyllableMismatch'])
+    finally:
+      shutil.rmtree(tempdir)
+
+  def test_strict(self):
+    """
+    In strict mode the first error is raised.
+    """
+    self.assertRaises(
+        BadIPATone,
+        lambda: update_word_counts(
+          defaultdict(lambda: 0), self.ROWS,
+          errors=ParseErrorLog(strict=True)))
+
+
+class TestTableWriter(unittest.TestCase):
+  """
+  Tests for writing tables in every format.
+  """
+
+  ROWS = [
+    ['Melody', '1', '12', 'Total'],
+    ['N', '3', '1', '4'],
+    ['V', '2', '0', '2'],
+    ['Total', '5', '1', '6'],
+  ]
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def write(self, format, has_summary_row=True):
+    path = os.path.join(
+        self.tempdir, table_filename('melody_by_category.tex', format))
+    written = write_table(path, self.ROWS, has_summary_row, format)
+    with open(path, encoding='utf-8', newline='') as f:
+      return written, f.read()
+
+  def test_tex(self):
+    written, data = self.write('tex')
+    self.assertTrue(written)
+    self.assertEqual(data, make_tabular(self.ROWS))
+    self.assertEqual(data.splitlines()[-3:], [
+        u'\\hline', u'Total & 5 & 1 & 6 \\\\', u'\\end{tabular}'])
+    # Unchanged tables are left alone.
+    self.assertEqual(self.write('tex'), (False, data))
+
+  def test_longtable(self):
+    lines = self.write('longtable')[1].splitlines()
+    self.assertEqual(lines[0], u'\\begin{longtable}{l||l|l||l}')
+    self.assertEqual(lines[4], u'\\endhead')
+    self.assertEqual(lines[-1], u'\\end{longtable}')
+
+  def test_delimited(self):
+    self.assertEqual(
+        self.write('csv')[1].splitlines(),
+        [u','.join(r) for r in self.ROWS])
+    self.assertEqual(
+        self.write('tsv')[1].splitlines(),
+        [u'\t'.join(r) for r in self.ROWS])
+
+  def test_json(self):
+    table = json.loads(self.write('json')[1])
+    self.assertEqual(table, {
+      'header': ['Melody', '1', '12', 'Total'],
+      'rows': [['N', 3, 1, 4], ['V', 2, 0, 2]],
+      'summary': ['Total', 5, 1, 6],
+    })
+    table = json.loads(self.write('json', has_summary_row=False)[1])
+    self.assertEqual(table['rows'][-1], ['Total', 5, 1, 6])
+    self.assertEqual(table['summary'], None)
+
+  def test_json_non_finite(self):
+    """
+    Cells that aren't finite numbers are written as text, keeping the JSON
+    valid.
+    """
+    path = os.path.join(self.tempdir, 'ratios.json')
+    write_table(path, [['O/E', 'a', 'b'], ['k', 'nan', '1.5'],
+                       ['t', 'inf', '-Infinity']], False, 'json')
+    with open(path, encoding='utf-8') as f:
+      table = json.loads(f.read(), parse_constant=self.fail)
+    self.assertEqual(
+        table['rows'], [['k', 'nan', 1.5], ['t', 'inf', '-Infinity']])
+
+  def test_formats(self):
+    check_formats(['longtable', 'json'])
+    self.assertRaises(UnknownFormat, lambda: check_formats(['xls']))
+    self.assertRaises(
+        UnknownFormat, lambda: check_formats(['tex', 'longtable']))
+
+
+class TestSpillingCounter(unittest.TestCase):
+  """
+  Tests for counting in a memory budget.
+  """
+
+  def make_counter(self, max_keys):
+    return SpillingCounter(
+        max_keys, lambda key: (key,), lambda key: key[0], entry_size=1)
+
+  def test_counts_match_dictionary(self):
+    expected = defaultdict(lambda: 0)
+    counter = self.make_counter(3)
+    for i in range(200):
+      key = u'k%d' % (i * 7 % 13)
+      expected[key] += i
+      counter[key] += i
+    self.assertGreater(counter.spills, 1)
+    self.assertEqual(len(counter), len(expected))
+    self.assertEqual(dict(counter.items()), dict(expected))
+    self.assertEqual(sorted(counter), sorted(expected))
+
+  def test_runs_are_merged(self):
+    counter = self.make_counter(1)
+    counter.update(u'k%d' % (i % 5) for i in range(MAX_FAN_IN * 5))
+    self.assertLess(counter.spills, MAX_FAN_IN)
+    self.assertEqual(dict(counter.items()),
+                     {u'k%d' % i: MAX_FAN_IN for i in range(5)})
+
+  def test_close_removes_runs(self):
+    counter = self.make_counter(1)
+    counter.update([u'a', u'b', u'c'])
+    tempdir = counter._tempdir
+    self.assertTrue(os.path.isdir(tempdir))
+    counter.close()
+    self.assertFalse(os.path.exists(tempdir))
+
+  def test_tables_match_unbudgeted(self):
+    word_counts = load_word_counts('./test_data.csv')
+    analyses = [cls() for cls in analysis_classes(all_tables())]
+    run_analyses(word_counts, analyses)
+    expected = render_analyses(analyses)
+    Disyllables.memory_budget = 256
+    try:
+      word_counts = load_word_counts('./test_data.csv', memory_budget=2048)
+      analyses = [cls() for cls in analysis_classes(all_tables())]
+      run_analyses(word_counts, analyses)
+      self.assertGreater(word_counts.spills, 0)
+      self.assertEqual(render_analyses(analyses), expected)
+      word_counts.close()
+    finally:
+      Disyllables.memory_budget = None
+
+
+class TestHeavyHitters(unittest.TestCase):
+  """
+  Tests for finding the most frequent keys in bounded memory.
+  """
+
+  def stream(self):
+    # A few frequent keys among many rare ones.
+    rng = random.Random(4)
+    return [(rng.randrange(5) if rng.random() < 0.2 else rng.randrange(5000),
+             rng.randint(1, 3)) for _ in range(30000)]
+
+  def test_exact_while_within_capacity(self):
+    counts = defaultdict(lambda: 0)
+    top = HeavyHitters(3, capacity=6000)
+    for key, count in self.stream():
+      counts[key] += count
+      top.add(key, count)
+    self.assertTrue(top.exact)
+    expected = sorted(counts.items(), key=lambda item: -item[1])[:3]
+    self.assertEqual(top.top(), [(k, c, 0) for k, c in expected])
+    self.assertEqual(top.guaranteed(), 3)
+    self.assertEqual(top.total, sum(counts.values()))
+
+  def test_error_bounds(self):
+    counts = defaultdict(lambda: 0)
+    top = HeavyHitters(5, capacity=50)
+    for key, count in self.stream():
+      counts[key] += count
+      top.add(key, count)
+    self.assertFalse(top.exact)
+    for key, count, error in top.top():
+      self.assertLessEqual(count - error, counts[key])
+      self.assertLessEqual(counts[key], count)
+    self.assertEqual(sorted(key for key, _, _ in top.top()), list(range(5)))
+    self.assertEqual(top.guaranteed(), 5)
+
+  def test_exact_mode(self):
+    top = HeavyHitters(2, exact=True)
+    for key, count in self.stream():
+      top.add(key, count)
+    self.assertTrue(top.exact)
+    self.assertRaises(ValueError, lambda: HeavyHitters(5, capacity=4))
+
+  def test_ranked_tables(self):
+    counters = count_top(iter_csv_words(['./test_data.csv']), 2)
+    tables = dict((name, rows) for name, rows, _ in top_tables(counters))
+    self.assertEqual(tables['top_words.tex'], [
+      [u'Rank', u'Word', u'Tones', u'Gloss', u'Category', u'Tokens',
+       u'Error'],
+      [u'1', u'\\textipa{li}', u'3', u'eat', u'V', u'29', u'0'],
+      [u'2', u'\\textipa{si}', u'3', u'trees', u'N', u'6', u'0'],
+    ])
+    self.assertEqual(tables['top_syllables.tex'][1],
+                     [u'1', u'\\textipa{li}', u'31', u'0'])
+    self.assertEqual(tables['top_morphemes.tex'][2][1:3],
+                     [u'\\textipa{si}', u'trees'])
+    self.assertEqual(tables['top_clusters.tex'][1][1:3],
+                     [u'\\textipa{l}', u'32'])
+
+
+class TestNgrams(unittest.TestCase):
+  """
+  Tests for the n-gram counts and the transition tables.
+  """
+
+  def test_counts_widen(self):
+    counts = NgramCounts(3)
+    expected = defaultdict(lambda: 0)
+    # Enough codes for the counts to move from a dense array to a dictionary.
+    size = int(round(MAX_DENSE ** (1.0 / 3))) + 2
+    for i in range(size * 3):
+      ngram = (i % size, i * 7 % size, 1)
+      counts.add(ngram)
+      expected[ngram] += 1
+    self.assertEqual(dict(counts.items()), dict(expected))
+    self.assertIsNone(counts._dense)
+
+  def test_iter_ngrams(self):
+    self.assertEqual(list(iter_ngrams([1, 2, 3], 2)), [(1, 2), (2, 3)])
+    self.assertEqual(list(iter_ngrams([1, 2, 3, 4], 3, [0, 0, 0, 1])),
+                     [((1, 2, 3), False), ((2, 3, 4), True)])
+    self.assertEqual(list(iter_ngrams([1], 2)), [])
+
+  def test_alphabet(self):
+    alphabet = Alphabet()
+    self.assertEqual(alphabet.codes(u'abca'), [0, 1, 2, 0])
+    self.assertEqual(alphabet.symbols, [u'a', u'b', u'c'])
+
+  def test_transitions(self):
+    analysis = Ngrams()
+    analysis.add(make_word(u'kapa^{1.2}', u'x', u'N'), 1, {})
+    letter_codes = analysis.letters.codes(
+        [make_letter(u'k'), make_letter(u'a'), make_letter(u'p')])
+    k, a, p = letter_codes
+    self.assertEqual(
+        dict(analysis.counts['letter', False].items()),
+        {(k, a): 1, (p, a): 1})
+    self.assertEqual(dict(analysis.counts['letter', True].items()),
+                     {(a, p): 1})
+    self.assertEqual(len(list(analysis.counts['tone', True].items())), 1)
+
+
+class TestProgress(unittest.TestCase):
+  """
+  Tests for the progress reports and the heartbeat file.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.now = 0.0
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def clock(self):
+    self.now += 0.25
+    return self.now
+
+  def test_reports_are_throttled(self):
+    stream = io.StringIO()
+    progress = Progress(stream, interval=1, clock=self.clock)
+    items = list(progress.track(range(1000), u'Counting', total=1000))
+    self.assertEqual(items, list(range(1000)))
+    lines = stream.getvalue().splitlines()
+    # The clock is read every 64 items, so a second passes every 4 reads.
+    self.assertEqual(len(lines), 15 // 4 + 1)
+    self.assertEqual(lines[0], u'Counting: 25.6% (256 rows, 256 rows/s, '
+                               u'ETA 0:00:03)')
+    self.assertEqual(lines[-1], u'Counting: done in 0:00:04 (1000 rows, '
+                                u'250 rows/s)')
+
+  def test_percent_and_eta(self):
+    stream = io.StringIO()
+    progress = Progress(stream, interval=0, clock=self.clock)
+    errors = ParseErrorLog()
+    position = [0]
+    for i in progress.track(range(128), u'Reading', total=256,
+                            position=lambda: position[0], errors=errors):
+      position[0] = 2 * (i + 1)
+      if i < 16:
+        try:
+          raise ValueError('bad row')
+        except ValueError as e:
+          errors.record(i, e, u'', u'')
+    first = stream.getvalue().splitlines()[0]
+    self.assertEqual(first, u'Reading: 50.0% (64 rows, 256 rows/s, '
+                            u'25.0% errors, ETA 0:00:00)')
+
+  def test_heartbeat(self):
+    heartbeat = os.path.join(self.tempdir, 'heartbeat.json')
+    progress = Progress(None, interval=0, heartbeat=heartbeat,
+                        clock=self.clock)
+    for _ in progress.track(range(10), u'Analysing', unit=u'words'):
+      pass
+    with open(heartbeat) as f:
+      status = json.load(f)
+    self.assertEqual(status['phase'], u'Analysing')
+    self.assertEqual(status['items'], 10)
+    self.assertEqual(status['unit'], u'words')
+    self.assertTrue(status['done'])
+    self.assertEqual(status['pid'], os.getpid())
+    self.assertFalse(os.path.exists(heartbeat + '.tmp'))
+
+  def test_heartbeat_while_writing(self):
+    """
+    The heartbeat is also updated as the tables are rendered and written,
+    and records the run as done once they are.
+    """
+    statuses = []
+
+    class Recording(Progress):
+      def _write_heartbeat(self, status):
+        statuses.append(status)
+
+    progress = Recording(None, heartbeat='unused', clock=self.clock)
+    word_counts = load_word_counts('./test_data.csv')
+    write_tables(word_counts, os.path.join(self.tempdir, 'out'),
+                 progress=progress)
+    phases = [s['phase'] for s in statuses]
+    self.assertIn(u'Rendering the tables', phases)
+    self.assertIn(
+        os.path.join(self.tempdir, 'out', 'melody_by_category.tex'),
+        [p[len(u'Writing '):] for p in phases])
+    self.assertTrue(statuses[-1]['done'])
+    self.assertFalse(any(s['done'] for s in statuses[1:-1]))
+
+  def test_csv_progress(self):
+    stream = io.StringIO()
+    rows = list(csv_rows('./test_data.csv', Progress(stream)))
+    self.assertEqual(
+        stream.getvalue().splitlines()[-1][:40],
+        u'Reading ./test_data.csv: done in 0:00:00')
+    self.assertEqual(len(rows), 9)
+
+  def test_format_duration(self):
+    self.assertEqual(format_duration(3725.4), u'1:02:05')
+
+
+class TestMemoryReport(unittest.TestCase):
+  """
+  Tests for accounting for the memory taken by a run.
+  """
+
+  def test_format_bytes(self):
+    self.assertEqual(format_bytes(512), u'512 B')
+    self.assertEqual(format_bytes(1536), u'1.5 KiB')
+    self.assertEqual(format_bytes(3 << 30), u'3.0 GiB')
+
+  def test_stages_and_census(self):
+    tempdir = tempfile.mkdtemp()
+    report = MemoryReport()
+    report.start()
+    try:
+      analyze('./test_data.csv', tempdir, memory_report=report)
+    finally:
+      report.stop()
+      shutil.rmtree(tempdir)
+    self.assertEqual([s['name'] for s in report.stages],
+                     ['Reading the CSV', 'Computing the tables'])
+    reading = report.stages[0]
+    self.assertGreater(reading['added_bytes'], 0)
+    self.assertGreaterEqual(reading['peak_bytes'], reading['bytes'])
+    self.assertTrue(any(
+        site.rsplit(u':', 1)[0].endswith(u'word_parsing.py')
+        for site, _, _ in reading['sites']))
+    self.assertEqual(report.word_types, 8)
+    self.assertGreaterEqual(report.objects['Word'][0], 8)
+    lines = report.format()
+    self.assertIn(u'8 word types', u'\n'.join(lines))
+    self.assertTrue(any(l.startswith(u'  Letter: ') for l in lines))
+
+
+class TestSampling(unittest.TestCase):
+  """
+  Tests for estimating the tables from a sample of the rows.
+  """
+
+  def test_reservoir_sample(self):
+    sample, total = reservoir_sample(range(10000), 100, random.Random(1))
+    self.assertEqual(total, 10000)
+    self.assertEqual(len(set(sample)), 100)
+    # The picks are spread over the whole input.
+    self.assertGreater(max(sample), 5000)
+    self.assertLess(min(sample), 5000)
+    self.assertEqual(
+        reservoir_sample(range(10000), 100, random.Random(1))[0], sample)
+
+  def test_small_input_is_kept_whole(self):
+    self.assertEqual(reservoir_sample(range(3), 5), ([0, 1, 2], 3))
+
+  def test_annotations(self):
+    counts = [['Melody', '1', 'Total'], ['N', '40', '40'], ['V', '0', '10'],
+              ['Total', '40', '50']]
+    fractions = [['Melody Fraction', '1', 'Total'], ['N', '1.000', '1.0'],
+                 ['V', '0.000', '1.0']]
+    annotated = dict((name, rows) for name, rows, _ in annotate_tables(
+        [('counts', counts, True), ('fractions', fractions, False)], 0.1,
+        {'counts': (COUNT, None), 'fractions': (FRACTION, 'counts')}))
+    # 4 of the 40 were sampled: sqrt(4 * 0.9) / 0.1 = 19.
+    self.assertEqual(annotated['counts'][1][1], '40 $\\pm$ 19')
+    self.assertEqual(annotated['counts'][2][1], '0')
+    self.assertEqual(annotated['fractions'][1][1:],
+                     ['1.000 $\\pm$ 0.000', '1.0'])
+
+  def test_whole_sample_matches_tables(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      write_tables(load_word_counts('./test_data.csv'),
+                   os.path.join(tempdir, 'all'))
+      sampled = write_sample_tables(
+          './test_data.csv', os.path.join(tempdir, 'sample'), 100)
+      self.assertEqual(sampled, (9, 9))
+      for name in os.listdir(os.path.join(tempdir, 'all')):
+        with open(os.path.join(tempdir, 'all', name)) as expected:
+          with open(os.path.join(tempdir, 'sample', name)) as sampled:
+            self.assertEqual(sampled.read(), expected.read())
+    finally:
+      shutil.rmtree(tempdir)
+
+
+class TestExportCheck(unittest.TestCase):
+  """
+  Tests for validating exports without analysing them.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_same_errors_as_parsing(self):
+    filename = os.path.join(self.tempdir, 'corpus.csv')
+    generate_corpus(filename, 5000, seed=3, error_rate=0.1)
+    expected = ParseErrorLog()
+    load_word_counts(filename, errors=expected)
+    for jobs in [1, 2]:
+      errors = ParseErrorLog()
+      self.assertEqual(check_export(filename, errors, jobs=jobs), 5000)
+      self.assertEqual(list(errors), list(expected))
+    self.assertGreater(len(expected), 300)
+
+  def test_exit_status(self):
+    report = os.path.join(self.tempdir, 'errors.jsonl')
+    with self.assertRaises(SystemExit) as raised:
+      check_main(['./test_data.csv', '--jobs', '1', '--report', report])
+    self.assertEqual(raised.exception.code, 1)
+    with open(report, encoding='utf-8') as f:
+      self.assertEqual(json.loads(f.read())['line'], 6)
+
+    valid = os.path.join(self.tempdir, 'valid.csv')
+    with open('./test_data.csv', encoding='utf-8') as f:
+      lines = f.readlines()
+    with open(valid, 'w', encoding='utf-8') as f:
+      f.writelines(lines[:5] + lines[6:])
+    check_main([valid, '--jobs', '1'])
+
+
+class TestCorpusDiff(unittest.TestCase):
+  """
+  Tests for comparing two exports of a corpus.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_count_entries(self):
+    rows = [
+      {'IPA': u'li^{3}', 'Gloss': u'eat', 'Text': u'', 'Category': u'V',
+       'count': u'2'},
+      {'IPA': u'li^{3}', 'Gloss': u'', 'Text': u'eat', 'Category': u'V',
+       'count': u'3'},
+      {'IPA': u'*li^{3}', 'Gloss': u'eat', 'Text': u'', 'Category': u'V',
+       'count': u'1'},
+      {'IPA': u'si^{3}', 'Gloss': u'trees', 'Text': u'', 'Category': u'N',
+       'count': u'many'},
+    ]
+    errors = ParseErrorLog()
+    self.assertEqual(count_entries(rows, errors=errors),
+                     {(u'li^{3}', u'eat', u'V'): [2, 5, 2]})
+    self.assertEqual([e[0] for e in errors], [5])
+
+  def test_delta_table(self):
+    old = [['Counts', 'a', 'i', 'Total'], ['k', '5', '1', '6'],
+           ['t', '2', '2', '4'], ['Total', '7', '3', '10']]
+    new = [['Counts', 'a', 'u', 'Total'], ['k', '5', '4', '9'],
+           ['p', '3', '1', '4'], ['Total', '8', '5', '13']]
+    self.assertEqual(delta_table(old, new), [
+      ['Counts change', 'a', 'u', 'i', 'Total'],
+      ['k', '0', '--', '--', '+3'],
+      ['p', '--', '--', '--', '--'],
+      ['t', '--', '--', '--', '--'],
+      ['Total', '+1', '--', '--', '+3'],
+    ])
+    self.assertEqual(
+        delta_table([['O/E', 'a'], ['k', '1.250']],
+                    [['O/E', 'a'], ['k', '0.999']])[1], ['k', '-0.251'])
+
+  def render(self, filename):
+    word_counts = load_word_counts(filename)
+    analyses = [cls() for cls in analysis_classes(all_tables())]
+    run_analyses(word_counts, analyses)
+    return render_analyses(analyses)
+
+  def test_matches_full_runs(self):
+    """
+    Updating the tables of the older export for the changed rows gives the
+    same tables as analysing the newer export.
+    """
+    old = os.path.join(self.tempdir, 'old.csv')
+    extra = os.path.join(self.tempdir, 'extra.csv')
+    new = os.path.join(self.tempdir, 'new.csv')
+    generate_corpus(old, 2000, seed=1)
+    generate_corpus(extra, 200, seed=2)
+    with open(old, encoding='utf-8') as f:
+      lines = f.readlines()
+    with open(extra, encoding='utf-8') as f:
+      added = f.readlines()[1:]
+    # Every tenth row is removed, and every tenth of the rest gets a new
+    # count, which changes no tables.
+    kept = [l for i, l in enumerate(lines[1:]) if i % 10]
+    kept = [l.rsplit(u',', 1)[0] + u',"99"\n' if i % 10 == 0 else l
+            for i, l in enumerate(kept)]
+    with open(new, 'w', encoding='utf-8') as f:
+      f.writelines(lines[:1] + added + kept + lines[2:4])
+
+    rendered, summary = diff_exports(old, new, tables=all_tables())
+    self.assertEqual(
+        rendered, delta_tables(self.render(old), self.render(new)))
+    self.assertEqual(summary['entries_removed'], 200)
+    self.assertGreater(summary['entries_changed'], 150)
+    self.assertGreater(summary['words_added'], 100)
+    self.assertGreater(summary['words_removed'], 100)
+    self.assertTrue(any(
+        cell.startswith(u'-') for _, rows, _ in rendered
+        for row in rows[1:] for cell in row[1:]))
+
+    rendered, summary = diff_exports(old, old, tables=all_tables())
+    self.assertFalse(any(summary.values()))
+    self.assertEqual(rendered, delta_tables(*[self.render(old)] * 2))
+
+
+class TestAnalyses(unittest.TestCase):
+  """
+  Tests for selecting and running analyses.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_select_by_table(self):
+    self.assertEqual(analysis_classes(['melody_by_category.tex']), [Melodies])
+    self.assertRaises(
+        UnknownTable, lambda: analysis_classes(['melody_by_cat.tex']))
+
+  def test_opt_in_analyses(self):
+    """
+    The contour and transition tables are only computed when asked for.
+    """
+    self.assertNotIn(Ngrams, analysis_classes())
+    self.assertNotIn(MelodyContours, analysis_classes())
+    self.assertEqual(
+        analysis_classes(['tone_transitions.tex']), [Ngrams])
+    analyze('./test_data.csv', self.tempdir)
+    self.assertEqual(sorted(os.listdir(self.tempdir)), [
+      'disyllable_consonant_first_to_second.tex',
+      'disyllable_vowel_first_to_second.tex',
+      'melody_by_category.tex',
+      'melody_percent_by_category.tex',
+      'second_syllable_consonants_vowels.tex',
+      'syllable_counts.tex',
+      'syllable_ratios.tex',
+    ])
+
+  def test_only_selected_tables_are_written(self):
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, csv_rows('./test_data.csv'))
+    written = write_tables(
+        word_counts, self.tempdir, ['melody_percent_by_category.tex'])
+    self.assertEqual(
+        written,
+        [os.path.join(self.tempdir, 'melody_percent_by_category.tex')])
+    self.assertEqual(
+        os.listdir(self.tempdir), ['melody_percent_by_category.tex'])
+
+
+  def test_group_by_category(self):
+    analyze('./test_data.csv', self.tempdir, group_by='Category')
+    by_category = os.path.join(self.tempdir, 'by_Category')
+    self.assertEqual(sorted(os.listdir(by_category)), ['N', 'V'])
+
+    # Every group gets the tables of its words alone.
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, csv_rows('./test_data.csv'))
+    verbs_dir = os.path.join(self.tempdir, 'verbs')
+    write_tables(
+        {w: c for w, c in word_counts.items() if w.category == u'V'},
+        verbs_dir)
+    for name in os.listdir(verbs_dir):
+      with open(os.path.join(verbs_dir, name), encoding='utf-8') as f:
+        expected = f.read()
+      with open(os.path.join(by_category, 'V', name), encoding='utf-8') as f:
+        self.assertEqual(f.read(), expected)
+
+  def test_parallel_tables_match(self):
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, csv_rows('./test_data.csv'))
+    analyses = [cls() for cls in analysis_classes(all_tables())]
+    run_analyses(word_counts, analyses)
+    serial = render_analyses(analyses)
+    parallel = render_parallel(
+        word_counts, [cls() for cls in analysis_classes(all_tables())], jobs=2)
+    self.assertEqual([t[0] for t in parallel], [t[0] for t in serial])
+    self.assertEqual(parallel, serial)
+
+
+class TestCorpusDatabase(unittest.TestCase):
+  """
+  Tests for the SQLite corpus store and the SQL backend.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def read_tables(self, outdir):
+    tables = {}
+    for name in os.listdir(outdir):
+      if name.endswith('.tex'):
+        with open(os.path.join(outdir, name), encoding='utf-8') as f:
+          tables[name] = f.read()
+    return tables
+
+  def test_sql_backend_matches_memory_backend(self):
+    memory_dir = os.path.join(self.tempdir, 'memory')
+    sql_dir = os.path.join(self.tempdir, 'sql')
+    database = os.path.join(self.tempdir, 'corpus.sqlite')
+    analyze('./test_data.csv', memory_dir, tables=all_tables())
+    analyze('./test_data.csv', sql_dir, tables=all_tables(), backend='sqlite',
+            database=database)
+    memory_tables = self.read_tables(memory_dir)
+    self.assertEqual(len(memory_tables), 18)
+    self.assertEqual(self.read_tables(sql_dir), memory_tables)
+
+  def test_repeated_words_are_counted_once(self):
+    store = CorpusStore(os.path.join(self.tempdir, 'corpus.sqlite'))
+    word = make_word(u'cɛ-li^{2.2}', u'write-NMLZ', u'N')
+    store.add_word(word, 2, 7)
+    store.add_word(make_word(u'cɛ-li^{2.2}', u'write-NMLZ', u'N'), 3, 9)
+    store.add_word(make_word(u'li^{3}', u'eat', u'V'), 1, 2)
+    self.assertEqual(store.word_types(), 2)
+    connection = store.connection
+    self.assertEqual(
+        connection.execute(
+            'SELECT ipa, gloss, category, tones, count, line FROM words '
+            'ORDER BY id').fetchall(),
+        [(u'cɛ-li^{2.2}', u'write-NMLZ', u'N', u'2.2', 5, 7),
+         (u'li^{3}', u'eat', u'V', u'3', 1, 2)])
+    # "li" is stored once, with its tone, and once as each morpheme.
+    self.assertEqual(
+        connection.execute(
+            'SELECT letters, tone FROM syllables ORDER BY id').fetchall(),
+        [(u'c ɛ', u'2'), (u'l i', u'2'), (u'l i', u'3')])
+    self.assertEqual(
+        connection.execute(
+            'SELECT m.letters, m.gloss, wm.first_syllable, wm.end_syllable '
+            'FROM word_morphemes wm JOIN morphemes m ON m.id = wm.morpheme_id '
+            'ORDER BY wm.word_id, wm.position').fetchall(),
+        [(u'c ɛ', u'write', 0, 1), (u'l i', u'NMLZ', 1, 2),
+         (u'l i', u'eat', 0, 1)])
+    store.close()
+
+
+class TestDrilldown(unittest.TestCase):
+  """
+  Tests for the index from table cells back to words.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    analyze('./test_data.csv', self.tempdir, drilldown=True)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def lookup(self, table, row, column):
+    return query(self.tempdir, *cell_key(table, row, column))
+
+  def test_syllable_cell(self):
+    self.assertEqual(
+        sorted(self.lookup('syllable_ratios.tex', u'l', u'i')), [
+          (u'cɛ-li^{2.2}', u'write-NMLZ', u'N', 1, [7]),
+          (u'li^{3}', u'eat', u'V', 29, [2]),
+          (u'li^{4}', u'songs', u'N', 1, [4]),
+        ])
+
+  def test_melody_cell(self):
+    self.assertEqual(
+        self.lookup('melody_by_category.tex', u'V', u'3'),
+        [(u'li^{3}', u'eat', u'V', 29, [2])])
+    self.assertRaises(
+        UnknownCell,
+        lambda: self.lookup('melody_by_category.tex', u'V', u'4'))
+
+  def test_no_index(self):
+    """
+    Without an index, the query fails with a hint, leaving the directory as
+    it is.
+    """
+    outdir = os.path.join(self.tempdir, 'plain')
+    analyze('./test_data.csv', outdir)
+    before = sorted(os.listdir(outdir))
+    with self.assertRaises(SystemExit) as raised:
+      query_main([outdir, 'melody_by_category.tex', u'V', u'3'])
+    self.assertIn('--drilldown', raised.exception.code)
+    self.assertEqual(sorted(os.listdir(outdir)), before)
+
+
+class TestMorphemeIndex(unittest.TestCase):
+  """
+  Tests for the morpheme and gloss search index.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    word_counts = defaultdict(lambda: 0)
+    update_word_counts(word_counts, csv_rows('./test_data.csv'))
+    filename = os.path.join(self.tempdir, 'index.json')
+    MorphemeIndex.build(word_counts).save(filename)
+    self.index = MorphemeIndex.load(filename)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def texts(self, morphemes):
+    return sorted((u''.join(m.text), m.gloss) for m in morphemes)
+
+  def test_find_suffix_with_gloss(self):
+    found = self.index.find(suffix=make_letters(u'je'), gloss=u'SG')
+    self.assertEqual(self.texts(found), [(u'je', u'SG')])
+    self.assertTrue(found[0].is_suffix)
+    self.assertEqual(found[0].tokens, 3)
+    self.assertEqual(
+        [w.ipa for w in self.index.words(found[0])], [u'ɟe-je^{42.3}'])
+
+  def test_find_by_letters(self):
+    self.assertEqual(
+        self.texts(self.index.find(prefix=make_letters(u'l'))),
+        [(u'li', u'NMLZ'), (u'li', u'eat'), (u'li', u'songs')])
+    self.assertEqual(
+        self.texts(self.index.find(contains=make_letters(u'ɔk^{w}'))),
+        [(u'kɔk^{w}ɪ', u'chicken')])
+    self.assertEqual(self.index.find(text=make_letters(u'l')), [])
+
+  def test_find_by_gloss(self):
+    found = self.index.find(gloss=u'write')
+    self.assertEqual(self.texts(found), [(u'cɛ', u'write')])
+    self.assertEqual(found[0].word_types, 2)
+    self.assertEqual(self.index.glosses(make_letters(u'li')),
+                     [u'NMLZ', u'eat', u'songs'])
+
+  def test_no_index(self):
+    with self.assertRaises(SystemExit) as raised:
+      morphemes_main([self.tempdir, '--text', u'li'])
+    self.assertEqual(raised.exception.code, 2)
+
+
+class TestWatch(unittest.TestCase):
+  """
+  Tests for the state retained between runs in watch mode.
+  """
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tempdir, 'words.csv')
+    with open('./test_data.csv') as f:
+      self.lines = f.readlines()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def write(self, lines, mode='w'):
+    with open(self.filename, mode) as f:
+      f.writelines(lines)
+
+  def test_append_only_parses_new_rows(self):
+    """
+    Appended rows are added to the retained word counts.
+    """
+    self.write(self.lines[:3])
+    state = CorpusState(self.filename)
+    self.assertFalse(state.is_append())
+    self.assertEqual(len(state.reload(update_word_counts)), 2)
+
+    self.write(self.lines[3:], mode='a')
+    self.assertTrue(state.is_append())
+    # A half written line is left alone until it is complete.
+    self.write(['"bo^{1}","A","N","",'], mode='a')
+    self.assertEqual(len(state.read_appended(update_word_counts)), 6)
+    self.assertEqual(len(state.word_counts), 8)
+    self.assertFalse(state.read_appended(update_word_counts))
+
+  def test_appends_update_the_analyses(self):
+    """
+    Appended rows only add their new word types to the analyses kept from
+    the last run, which then render the tables of the whole file.
+    """
+    def make_analyses():
+      return [cls() for cls in analysis_classes(all_tables())]
+
+    self.write(self.lines[:4])
+    state = CorpusState(self.filename)
+    mode, new_words, analyses = refresh(
+        state, None, update_word_counts, make_analyses)
+    self.assertEqual(mode, 'rewritten')
+    kept = analyses
+    self.write(self.lines[4:], mode='a')
+    mode, new_words, analyses = refresh(
+        state, analyses, update_word_counts, make_analyses)
+    self.assertEqual(mode, 'appended')
+    self.assertIs(analyses, kept)
+    self.assertEqual(len(new_words), 5)
+    expected = make_analyses()
+    run_analyses(load_word_counts(self.filename), expected)
+    self.assertEqual(render_analyses(analyses), render_analyses(expected))
+
+  def test_file_replaced_while_read(self):
+    """
+    The watcher outlives the file going away while it is read, and starts
+    over once it changes again.
+    """
+    class Stop(Exception):
+      pass
+
+    self.write(self.lines)
+    calls = []
+
+    def update(word_counts, raw_rows, first_line=2, added=None):
+      calls.append(first_line)
+      if len(calls) == 1:
+        os.remove(self.filename)
+        self.write(self.lines[:4])
+        raise FileNotFoundError(self.filename)
+      return update_word_counts(
+          word_counts, raw_rows, first_line=first_line, added=added)
+
+    def write_analyses(analyses, outdir):
+      raise Stop()
+
+    out = io.StringIO()
+    self.assertRaises(
+        Stop, lambda: watch(
+          self.filename, self.tempdir, update, list, write_analyses,
+          poll_interval=0.01, debounce=0.01, use_inotify=False, out=out))
+    self.assertEqual(len(calls), 2)
+    self.assertIn('waiting for it to change', out.getvalue())
+
+  def test_rows_with_line_breaks(self):
+    """
+    Appended rows are numbered like a full run numbers them, also after rows
+    with a line break in a quoted field.
+    """
+    self.write(self.lines[:1] + [u'"li^{3}","eat","V","two\nlines","2"\n'])
+    state = CorpusState(self.filename)
+    errors = ParseErrorLog()
+
+    def update(word_counts, raw_rows, first_line=2, added=None):
+      return update_word_counts(
+          word_counts, raw_rows, first_line=first_line, errors=errors,
+          added=added)
+
+    state.reload(update)
+    self.write(self.lines[1:], mode='a')
+    self.assertTrue(state.is_append())
+    state.read_appended(update)
+    expected = ParseErrorLog()
+    load_word_counts(self.filename, errors=expected)
+    self.assertEqual(len(expected), 1)
+    self.assertEqual(list(errors), list(expected))
+
+  def test_rewrite_is_detected(self):
+    """
+    Files that no longer start with the processed bytes are not appends.
+    """
+    self.write(self.lines)
+    state = CorpusState(self.filename)
+    state.reload(update_word_counts)
+    self.write(self.lines[:1] + self.lines[2:])
+    self.assertFalse(state.is_append())
+    state.reload(update_word_counts)
+    self.assertEqual(len(state.word_counts), 7)
+
+  def test_same_length_edit_is_detected(self):
+    """
+    An edit in the middle of the processed bytes that keeps the size of the
+    file is a rewrite, however far it is from the start and the end.
+    """
+    lines = self.lines[:1] + self.lines[1:5] * 500
+    self.write(lines)
+    state = CorpusState(self.filename)
+    state.reload(update_word_counts)
+    self.assertEqual(lines[1001], u'"li^{3}","eat","V","","29"\n')
+    lines[1001] = u'"li^{2}","eat","V","","29"\n'
+    self.write(lines)
+    self.assertFalse(state.is_append())
+    state.reload(update_word_counts)
+    self.assertIn(make_word(u'li^{2}', u'eat', u'V'), state.word_counts)
+
+
+def _tone_annotation(n):
+  return u'^{%s}' % u'.'.join([u'1'] * n)
+
+
+def _parse_row(ipa, gloss):
+  row = {'IPA': ipa, 'Gloss': gloss, 'Text': u'', 'Category': u'N',
+         'count': u'1'}
+  return list(iter_row_words([row], errors=ParseErrorLog()))
+
+
+class TestScaling(unittest.TestCase):
+  """
+  Guards against parsing time growing faster than the length of a row, so a
+  single pathological cell can't stall a whole run.
+
+  Every row is parsed at two sizes, GROWTH times apart, and must take less
+  than MAX_GROWTH times longer at the larger one (a linear parser takes about
+  GROWTH times longer, a quadratic one GROWTH squared), and less than
+  MAX_ROW_SECONDS. Timings are the best of a few runs, to keep out noise.
+  """
+
+  GROWTH = 8
+  MAX_GROWTH = 20
+  MAX_ROW_SECONDS = 2.0
+  # Below this, timings are mostly noise, and can't be much too slow anyway.
+  MIN_SECONDS = 0.005
+
+  # Rows of n syllables (or morphemes, or tones), as (ipa, gloss).
+  ROWS = {
+    'long word': lambda n: (u'ka' * n + _tone_annotation(n), u'x'),
+    'marked letters': lambda n: (
+        u'gba:\\~a' * n + _tone_annotation(2 * n), u'x'),
+    'suffix stack': lambda n: (
+        u'-'.join([u'ka'] * n) + _tone_annotation(n),
+        u'-'.join([u'root'] + [u'SG'] * (n - 1))),
+    'particles': lambda n: (
+        u'-'.join([u'ka'] * n) + _tone_annotation(n),
+        u'-'.join([u'PART'] * (n - 1) + [u'x'])),
+    'parentheses': lambda n: (u'(ka)' * n + _tone_annotation(n), u'x'),
+    'alternatives': lambda n: (
+        u'/'.join([u'ka^{1}'] * n), u'/'.join([u'x'] * n)),
+    'long melody': lambda n: (u'ka^{%s}' % (u'12' * n), u'x'),
+    'too many tones': lambda n: (u'ka' + _tone_annotation(n), u'x'),
+    'too few tones': lambda n: (u'ka' * n + _tone_annotation(1), u'x'),
+    'no vowells': lambda n: (u'k' * n + _tone_annotation(1), u'x'),
+    'no tones': lambda n: (u'ka' * n + u'^' * n, u'x'),
+    'too few glosses': lambda n: (
+        u'-'.join([u'ka'] * n) + _tone_annotation(n), u'x'),
+  }
+
+  def best_time(self, function, repeat=3):
+    best = None
+    for _ in range(repeat):
+      start = time.perf_counter()
+      function()
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+    return best
+
+  def assertLinear(self, make_input, function, n):
+    small = self.best_time(lambda: function(*make_input(n)))
+    large = self.best_time(lambda: function(*make_input(n * self.GROWTH)))
+    self.assertLess(large, max(small * self.MAX_GROWTH, self.MIN_SECONDS))
+    self.assertLess(large, self.MAX_ROW_SECONDS)
+
+  def test_rows(self):
+    """
+    Long, deeply suffixed, heavily marked and broken rows parse in linear
+    time.
+    """
+    for name, make_row in sorted(self.ROWS.items()):
+      with self.subTest(row=name):
+        self.assertLinear(make_row, _parse_row, 1000)
+
+  def test_long_letter_sequences(self):
+    """
+    Splitting text into letters is linear, up to morphemes of hundreds of
+    thousands of characters.
+    """
+    for text in [u'gba:', u'k^{w}a:']:
+      with self.subTest(text=text):
+        self.assertLinear(lambda n: (text * n,), make_letters, 6250)
+
+
 if __name__ == '__main__':
     unittest.main()
 
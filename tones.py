@@ -0,0 +1,138 @@
+"""
+Tones and melodies.
+
+The tone of a syllable is a string of tone levels, the digits 0 to 9 (like
+`12` for a rise from 1 to 2). Every distinct syllable tone is interned as a
+small integer code, so syllables hold an int and melodies are computed from
+tuples of codes, with the results cached.
+
+The melody of a word is the sequence of levels of all its syllables, with
+repeated levels collapsed: syllables with tones 2, 2 and 31 have the melody
+(2, 3, 1). Levels are numbered like Chao tone letters, higher numbers being
+higher pitches, which is what the contour classes go by.
+"""
+
+import re
+
+# A tone annotation at the end of an IPA transcription, like `^{12.3}`.
+# Syllables are separated by '.' (or '-', between morphemes).
+_ANNOTATION = re.compile(r'\^\{([0-9.-]+)\}')
+
+_CODES = {}
+_TEXTS = []
+_LEVELS = []
+
+# The melodies of the last tone code sequences seen, emptied once it holds
+# _MAX_MELODIES of them so that it doesn't grow with the corpus.
+_MELODIES = {}
+_MAX_MELODIES = 4096
+
+LEVEL = u'level'
+RISING = u'rising'
+FALLING = u'falling'
+RISING_FALLING = u'rising-falling'
+FALLING_RISING = u'falling-rising'
+COMPLEX = u'complex'
+
+CONTOURS = (LEVEL, RISING, FALLING, RISING_FALLING, FALLING_RISING, COMPLEX)
+
+
+class BadToneAnnotation(ValueError):
+  pass
+
+
+def split_annotation(ipa):
+  """
+  Splits the tone annotation off the end of an IPA transcription.
+
+  Only the text after the last `^` is looked at, so this takes time
+  proportional to the annotation rather than to the transcription.
+
+  :raises BadToneAnnotation: If `ipa` doesn't end in a tone annotation.
+
+  :returns: The text before the annotation, and the tone of every syllable as
+    a list of strings.
+  """
+  start = ipa.rfind(u'^')
+  match = _ANNOTATION.fullmatch(ipa, start) if start >= 0 else None
+  if match is None:
+    raise BadToneAnnotation(
+        "Could not extract tone from ipa(%s)" % repr(ipa))
+  return ipa[:start], match.group(1).replace(u'-', u'.').split(u'.')
+
+
+def tone_code(text):
+  """
+  The code of the syllable tone `text`, assigning a new code the first time a
+  tone is seen.
+  """
+  code = _CODES.get(text)
+  if code is None:
+    code = _CODES[text] = len(_TEXTS)
+    _TEXTS.append(text)
+    _LEVELS.append(tuple(int(level) for level in text))
+  return code
+
+
+def tone_text(code):
+  return _TEXTS[code]
+
+
+def tone_levels(code):
+  """
+  The levels of the tone `code`, as a tuple of ints.
+  """
+  return _LEVELS[code]
+
+
+def melody(codes):
+  """
+  The melody of a sequence of syllable tone codes: their levels with repeated
+  levels collapsed, as a tuple of ints.
+  """
+  codes = tuple(codes)
+  result = _MELODIES.get(codes)
+  if result is None:
+    if len(_MELODIES) >= _MAX_MELODIES:
+      _MELODIES.clear()
+    levels = []
+    for code in codes:
+      for level in _LEVELS[code]:
+        if not levels or levels[-1] != level:
+          levels.append(level)
+    result = _MELODIES[codes] = tuple(levels)
+  return result
+
+
+def melody_text(levels):
+  """
+  The label of a melody, like `12`.
+  """
+  return u''.join(str(level) for level in levels)
+
+
+def parse_melody(text):
+  """
+  The melody labelled `text` by `melody_text`.
+  """
+  return tuple(int(level) for level in text)
+
+
+def contour(levels):
+  """
+  The contour class of a melody: level (one level), rising, falling,
+  rising-falling, falling-rising, or complex for melodies changing direction
+  more than once.
+  """
+  if len(levels) < 2:
+    return LEVEL
+  directions = []
+  for previous, level in zip(levels, levels[1:]):
+    direction = RISING if level > previous else FALLING
+    if not directions or directions[-1] != direction:
+      directions.append(direction)
+  if len(directions) == 1:
+    return directions[0]
+  if len(directions) == 2:
+    return u'%s-%s' % tuple(directions)
+  return COMPLEX
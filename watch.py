@@ -0,0 +1,289 @@
+"""
+Re-runs the analysis whenever the input CSV changes.
+
+Exports from the website are usually re-written every few minutes while a
+transcription session is going on. The watcher keeps the parsed word counts in
+memory between runs, with the analyses run over them; if the new export only
+appended rows to the file, just those rows are parsed, and only the word
+types they add go through the analyses. Tables are only re-rendered if the
+set of word types changed, and only the tables whose contents changed are
+written.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import os
+import select
+import struct
+import sys
+import time
+from collections import defaultdict
+
+from analyses import run_analyses, update_analyses
+from csv_loader import iter_csv_rows, read_fieldnames
+
+# Number of bytes read at a time when hashing the already processed part of
+# the file.
+_DIGEST_CHUNK_BYTES = 1024 * 1024
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _PollWaiter(object):
+  """
+  Waits for a change by sleeping; the caller re-checks the file afterwards.
+  """
+
+  def wait(self, timeout):
+    time.sleep(timeout)
+
+  def close(self):
+    pass
+
+
+class _InotifyWaiter(object):
+  """
+  Waits for a change using inotify on the directory containing the watched
+  file, so that replacing the file via a rename is also noticed.
+  """
+
+  def __init__(self, filename):
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self._fd = self._libc.inotify_init()
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init failed')
+    directory = os.path.dirname(os.path.abspath(filename))
+    mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    if self._libc.inotify_add_watch(self._fd, directory, mask) < 0:
+      os.close(self._fd)
+      raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+  def wait(self, timeout):
+    readable, _, _ = select.select([self._fd], [], [], timeout)
+    if readable:
+      # The events themselves are not interesting, the file is stat'd
+      # afterwards anyway. Just drain them.
+      os.read(self._fd, 64 * _IN_EVENT_HEADER.size)
+
+  def close(self):
+    os.close(self._fd)
+
+
+def make_waiter(filename, use_inotify=True):
+  """
+  Returns an inotify based waiter where available, otherwise a polling one.
+  """
+  if use_inotify and sys.platform.startswith('linux'):
+    try:
+      return _InotifyWaiter(filename)
+    except (OSError, AttributeError):
+      pass
+  return _PollWaiter()
+
+
+def _stat_signature(filename):
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return (st.st_size, st.st_mtime, st.st_ino)
+
+
+def _digest(f, length):
+  """
+  The digest of the first `length` bytes of `f`.
+  """
+  digest = hashlib.md5()
+  f.seek(0)
+  while length > 0:
+    chunk = f.read(min(length, _DIGEST_CHUNK_BYTES))
+    if not chunk:
+      break
+    digest.update(chunk)
+    length -= len(chunk)
+  return digest.digest()
+
+
+class CorpusState(object):
+  """
+  The in-memory state retained between runs: the word counts, and enough
+  information about the bytes they came from to recognize an append.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.word_counts = defaultdict(lambda: 0)
+    self._fieldnames = None
+    self._offset = 0
+    self._rows = 0
+    # The digest of the bytes processed so far, updated as they are read.
+    self._digest = hashlib.md5()
+
+  def is_append(self):
+    """
+    True if the file still starts with the bytes that were already processed.
+    All of them are hashed again, so that an edit anywhere (even one keeping
+    the size of the file) is seen as a rewrite.
+    """
+    if self._fieldnames is None:
+      return False
+    with open(self.filename, 'rb') as f:
+      f.seek(0, os.SEEK_END)
+      if f.tell() < self._offset:
+        return False
+      return _digest(f, self._offset) == self._digest.digest()
+
+  def reload(self, update_word_counts):
+    """
+    Forgets everything and parses the whole file again.
+
+    :returns: The list of the new word types.
+    """
+    self.word_counts = defaultdict(lambda: 0)
+    self._fieldnames = read_fieldnames(self.filename)
+    self._offset = 0
+    self._rows = 0
+    self._digest = hashlib.md5()
+    with open(self.filename, 'rb') as f:
+      # Skip the header line, it is passed to the parser explicitly.
+      header = f.readline()
+      self._offset = len(header)
+      self._digest.update(header)
+    return self.read_appended(update_word_counts)
+
+  def read_appended(self, update_word_counts):
+    """
+    Parses the complete lines added after the last processed offset.
+
+    :returns: The list of the new word types.
+    """
+    with open(self.filename, 'rb') as f:
+      f.seek(self._offset)
+      data = f.read()
+      # A trailing partial line is still being written, leave it for later.
+      data = data[:data.rfind(b'\n') + 1]
+      lines = io.StringIO(data.decode('utf-8'), newline='').readlines()
+      # Rows are numbered like csv_rows numbers them, so quoted line breaks
+      # don't count.
+      rows = [0]
+      new_words = []
+      update_word_counts(
+          self.word_counts,
+          _counted(iter_csv_rows(lines, fieldnames=self._fieldnames), rows),
+          first_line=self._rows + 2, added=new_words)
+      self._rows += rows[0]
+      self._offset += len(data)
+      self._digest.update(data)
+    return new_words
+
+
+def _counted(rows, counter):
+  """
+  Yields `rows`, adding up how many there were in `counter[0]`.
+  """
+  for row in rows:
+    counter[0] += 1
+    yield row
+
+
+def wait_until_settled(filename, waiter, debounce):
+  """
+  Blocks until `filename` has not changed for `debounce` seconds, so that a
+  burst of exports results in a single run.
+  """
+  signature = _stat_signature(filename)
+  while True:
+    waiter.wait(debounce)
+    current = _stat_signature(filename)
+    if current == signature:
+      return
+    signature = current
+
+
+def refresh(state, analyses, update_word_counts, make_analyses,
+            progress=None):
+  """
+  Brings `state` and the `analyses` run over its word counts up to date with
+  the file: if rows were appended, parses them and adds the new word types to
+  `analyses`, otherwise parses the whole file and runs new analyses over it.
+
+  :param list analyses: The analyses, or None if none were run yet.
+
+  :returns: The mode of the run ('appended' or 'rewritten'), the list of the
+    new word types and the analyses.
+  """
+  if analyses is not None and state.is_append():
+    new_words = state.read_appended(update_word_counts)
+    # The analyses count word types, so only the new ones change them.
+    update_analyses(new_words, [], analyses)
+    return 'appended', new_words, analyses
+  new_words = state.reload(update_word_counts)
+  analyses = make_analyses()
+  run_analyses(state.word_counts, analyses, progress=progress)
+  return 'rewritten', new_words, analyses
+
+
+def watch(filename, outdir, update_word_counts, make_analyses, write_analyses,
+          poll_interval=2.0, debounce=1.0, use_inotify=True, progress=None,
+          out=sys.stdout):
+  """
+  Runs the analysis on `filename`, then keeps re-running it whenever the file
+  changes. Never returns.
+
+  :param update_word_counts: Adds parsed rows to a word count dictionary,
+    appending the new word types to the list `added` (see
+    `analyse.update_word_counts`).
+  :param make_analyses: Returns a list of new analyses to run.
+  :param write_analyses: Writes the tables of a list of analyses into a
+    directory and returns the paths that changed.
+  :param float poll_interval: The maximum number of seconds between checks of
+    the file.
+  :param float debounce: The number of seconds the file must stay unchanged
+    before it is re-processed.
+  :param progress.Progress progress: If not None, where the progress of
+    running the analyses over every word is reported.
+  """
+  state = CorpusState(filename)
+  analyses = None
+  waiter = make_waiter(filename, use_inotify=use_inotify)
+  signature = None
+  try:
+    while True:
+      current = _stat_signature(filename)
+      if current is not None and current != signature:
+        wait_until_settled(filename, waiter, debounce)
+        signature = _stat_signature(filename)
+        start = time.time()
+        try:
+          mode, new_words, analyses = refresh(
+              state, analyses, update_word_counts, make_analyses, progress)
+        except OSError as e:
+          # The file went away (or was replaced) while it was read, like when
+          # an export deletes and re-creates it. Start over once it changes
+          # again.
+          print("%s: could not read %s (%s), waiting for it to change" % (
+              time.strftime('%H:%M:%S'), filename, e), file=out)
+          out.flush()
+          state = CorpusState(filename)
+          analyses = None
+          waiter.wait(poll_interval)
+          continue
+        written = []
+        if new_words or mode == 'rewritten':
+          written = write_analyses(analyses, outdir)
+        print(
+            "%s: %s, %d words (%d new), regenerated %d tables in %.2fs" % (
+              time.strftime('%H:%M:%S'), mode, len(state.word_counts),
+              len(new_words), len(written), time.time() - start), file=out)
+        for path in written:
+          print("  %s" % path, file=out)
+        out.flush()
+      waiter.wait(poll_interval)
+  finally:
+    waiter.close()
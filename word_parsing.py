@@ -1,21 +1,41 @@
 
-from itertools import izip_longest, islice
-import re
+from collections import namedtuple
+from itertools import zip_longest
+import weakref
 
-from letters import is_vowell, to_tipa, to_order_tuple
+from tones import BadToneAnnotation, split_annotation, tone_code, tone_text
+from letters import collation_rank, is_vowell, to_tipa
 
 class WordParseError(Exception):
   pass
 
 class Word(object):
+  """
+  An immutable parsed word. Words are used as dictionary keys a lot, so the
+  hash is computed once, up front.
+  """
+
+  __slots__ = (
+      '_morphemes',
+      '_syllables',
+      '_category',
+      '_complete_morpheme_spans',
+      '_hash',
+  )
 
   def __init__(self, morphemes, syllables, category):
     self._morphemes = tuple(morphemes)
     self._syllables = tuple(syllables)
     self._category = category
+    self._complete_morpheme_spans = _complete_morpheme_spans(
+        self._morphemes, self._syllables)
+    self._hash = hash((self._morphemes, self._syllables, self._category))
 
   def __eq__(self, other):
+    if self is other:
+      return True
     return (
+        self._hash == other._hash and
         self._morphemes == other._morphemes and
         self._syllables == other._syllables and
         self._category == other._category
@@ -26,15 +46,40 @@ class Word(object):
 
   def __repr__(self):
     return '<Word(%s, %s, %s)>' % (
-        repr(self._morphemes), repr(syllables), repr(self._category))
+        repr(self._morphemes), repr(self._syllables), repr(self._category))
 
   def __hash__(self):
-    return hash((self._morphemes, self._syllables, self._category))
+    return self._hash
 
   @property
   def category(self):
     return self._category
-  
+
+  @property
+  def morphemes(self):
+    return self._morphemes
+
+  @property
+  def syllables(self):
+    return self._syllables
+
+  @property
+  def gloss(self):
+    """
+    The gloss of the word, with morphemes separated by '-' as in the CSV.
+    """
+    return u'-'.join(
+        u'PART' if m.is_particle else m.gloss for m in self._morphemes)
+
+  def text(self):
+    """
+    The IPA of the word, with morphemes separated by '-' and the tones of
+    the syllables at the end, as in the CSV.
+    """
+    return u'%s^{%s}' % (
+        u'-'.join(m.text() for m in self._morphemes),
+        u'.'.join(s.tone for s in self._syllables))
+
   def iter_morphemes(self):
     for m in self._morphemes:
       yield m
@@ -47,55 +92,90 @@ class Word(object):
     """
     Iterates through "complete" morphemes. That is, morphemes who only contain
     whole syllables.
+
+    :yields: (Morpheme, tuple of Syllables) pairs.
+    """
+    for m, first, end in self._complete_morpheme_spans:
+      yield self._morphemes[m], self._syllables[first:end]
+
+  def complete_morpheme_spans(self):
     """
-    consumed_morpheme_letters = 0
-    consumed_syllable_letters = 0
-    syllable_iter = self.iter_syllables()
-    morpheme_iter = self.iter_morphemes()
-    pending_morphemes = None
-    pending_syllables = []
-
-    while True:
-      if consumed_morpheme_letters == consumed_syllable_letters:
-        # If we have both syllables and morphemes pending, we should yield
-        # them.
-        if pending_syllables and pending_morpheme:
-          yield pending_morpheme, tuple(pending_syllables)
-
-        # Either way we should reset the pending variables.
-        pending_morpheme = next(morpheme_iter)
-        consumed_morpheme_letters += pending_morpheme.letter_count()
-
-        s = next(syllable_iter)
-        consumed_syllable_letters += s.letter_count()
-        pending_syllables = [s]
-
-      elif consumed_syllable_letters < consumed_morpheme_letters:
-        # There are more syllables in this morpheme.
-        s = next(syllable_iter)
-        consumed_syllable_letters += s.letter_count()
-        pending_syllables.append(s)
-
-      elif consumed_morpheme_letters < consumed_syllable_letters:
-        # Well, both the current pending morpheme and the next morpheme must be
-        # invalid. Consume them, but indicate they are invalid by setting the
-        # pending morpheme to None.
-        m = next(morpheme_iter)
-        consumed_morpheme_letters += m.letter_count()
-        pending_morpheme = None
+    Returns the "complete" morphemes as index spans, avoiding building tuples
+    of syllables.
 
+    :returns: A tuple of (morpheme index, first syllable index, end syllable
+      index) triples, the end being exclusive.
+    """
+    return self._complete_morpheme_spans
+
+
+def _letter_offsets(parts):
+  """
+  Returns the letter offsets of the boundaries between `parts`, including the
+  start (0) and the end.
+  """
+  offsets = [0]
+  for p in parts:
+    offsets.append(offsets[-1] + p.letter_count())
+  return offsets
+
+
+def _complete_morpheme_spans(morphemes, syllables):
+  """
+  Finds the morphemes that start and end on syllable boundaries with a single
+  merge of the sorted morpheme and syllable boundary offsets.
+
+  :returns: A tuple of (morpheme index, first syllable index, end syllable
+    index) triples.
+  """
+  morpheme_offsets = _letter_offsets(morphemes)
+  syllable_offsets = _letter_offsets(syllables)
+  syllable_boundaries = len(syllable_offsets)
+  spans = []
+  j = 0
+  for i in range(len(morphemes)):
+    start = morpheme_offsets[i]
+    end = morpheme_offsets[i + 1]
+    while j < syllable_boundaries and syllable_offsets[j] < start:
+      j += 1
+    if j == syllable_boundaries:
+      break
+    if syllable_offsets[j] != start or start == end:
+      continue
+    k = j
+    while k < syllable_boundaries and syllable_offsets[k] < end:
+      k += 1
+    if k < syllable_boundaries and syllable_offsets[k] == end:
+      spans.append((i, j, k))
+    j = k
+  return tuple(spans)
 
 
 class Morpheme(object):
+  """
+  An immutable morpheme. Use `make_morpheme` to get a shared instance.
+  """
+
+  __slots__ = ('_letters', '_gloss', '_is_particle', '_is_suffix', '_hash',
+               '__weakref__')
 
   def __init__(self, letters, gloss, is_particle=False, is_suffix=False):
     self._letters = tuple(letters)
     self._gloss = gloss
     self._is_particle = is_particle
     self._is_suffix = is_suffix
+    self._hash = hash((
+      self._letters,
+      self._gloss,
+      self._is_particle,
+      self._is_suffix,
+    ))
 
   def __eq__(self, other):
+    if self is other:
+      return True
     return (
+        self._hash == other._hash and
         self._letters == other._letters and 
         self._gloss == other._gloss and 
         self._is_particle == other._is_particle and 
@@ -103,12 +183,7 @@ class Morpheme(object):
     )
 
   def __hash__(self):
-    return hash((
-      self._letters,
-      self._gloss,
-      self._is_particle,
-      self._is_suffix,
-    ))
+    return self._hash
 
   def __ne__(self, other):
     return not self == other
@@ -134,25 +209,43 @@ class Morpheme(object):
   def gloss(self):
     return self._gloss
 
+  @property
+  def is_particle(self):
+    return self._is_particle
+
+  @property
+  def is_suffix(self):
+    return self._is_suffix
+
 
 class SyllablesMustHaveVowells(WordParseError):
   pass
 
 
 class Syllable(object):
+  """
+  An immutable syllable. Use `make_syllable` or `make_syllables` to get shared
+  instances.
+  """
+
+  __slots__ = ('_letters', '_tone_code', '_hash', '__weakref__')
 
   def __init__(self, letters, tone):
-    self._letters = letters
-    self._tone = tone
+    self._letters = tuple(letters)
+    self._tone_code = tone_code(tone)
     if not self.has_vowell():
       raise SyllablesMustHaveVowells(
           'Sylable %s with tone %s does not have a vowell' % (
-            self._letters, self._tone))
+            self._letters, tone))
+    self._hash = hash((self._letters, self._tone_code))
 
   def __eq__(self, other):
+    if self is other:
+      return True
     return (
+        self._hash == other._hash and
         self._letters == other._letters and 
-        self._tone == other._tone
+        self._tone_code == other._tone_code
     )
 
   def __ne__(self, other):
@@ -162,19 +255,24 @@ class Syllable(object):
     """
     Returns a tuple of the letters in this syllable.
     """
-    return tuple(self._letters)
+    return self._letters
 
   @property
   def tone(self):
-    return self._tone
+    return tone_text(self._tone_code)
+
+  @property
+  def tone_code(self):
+    """
+    The interned code of the tone, see `tones.tone_code`.
+    """
+    return self._tone_code
 
   def __hash__(self):
-    return hash((
-      self.letters(), self._tone
-    ))
+    return self._hash
 
   def __repr__(self):
-    return u'<Syllable(%s, %s)>' % (repr(self._letters), repr(self._tone))
+    return u'<Syllable(%s, %s)>' % (repr(self._letters), repr(self.tone))
   
   def has_vowell(self):
     return any(l.is_vowell() for l in self._letters)
@@ -202,7 +300,10 @@ class Letter(object):
   This is tracked as a single unicode character, and some bits that mark nasal,
   labialized, and long-vowell diacritics.
   """
-  
+
+  __slots__ = ('_text', '_is_nasal', '_is_labialized', '_is_long', '_hash',
+               '_collation_key')
+
   def __init__(self, text, is_nasal, is_labialized, is_long):
     if is_nasal and is_labialized:
       raise InvalidLetter('Cannot be both nasal and have a raised w')
@@ -220,6 +321,11 @@ class Letter(object):
       raise InvalidLetter('Letters with a w must be consonants (%s)' %
                           repr(self))
 
+    self._hash = hash((
+      self._text, self._is_labialized, self._is_nasal, self._is_long
+    ))
+    self._collation_key = None
+
   @property
   def is_nasal(self):
     return self._is_nasal
@@ -247,16 +353,25 @@ class Letter(object):
         self._is_long == other._is_long
     )
 
-  def _to_tuple(self):
-    return (
-      to_order_tuple(self._text),
-      self._is_nasal,
-      self._is_labialized,
-      self._is_long
-    )
+  @property
+  def collation_key(self):
+    """
+    An integer that sorts letters by the collation rank of their text (see
+    `letters.collation_rank`), then the nasal, labialized and long bits.
+    """
+    if self._collation_key is None:
+      try:
+        rank = collation_rank(self._text)
+      except IndexError as e:
+        raise InvalidLetter(
+            "Unknown letter when determining its order: '%s'" % e.args[0])
+      self._collation_key = (
+          rank << 3 | self._is_nasal << 2 | self._is_labialized << 1 |
+          self._is_long)
+    return self._collation_key
 
   def __lt__(self, other):
-    return self._to_tuple() < other._to_tuple()
+    return self.collation_key < other.collation_key
 
   def __le__(self, other):
     return self == other or self < other
@@ -271,9 +386,7 @@ class Letter(object):
     return not self == other
 
   def __hash__(self):
-    return hash((
-      self._text, self._is_labialized, self._is_nasal, self._is_long
-    ))
+    return self._hash
 
   def _nasal_prefix(self):
     if self._is_nasal:
@@ -295,15 +408,43 @@ class Letter(object):
   def __repr__(self):
     return u'<Letter %s>' % repr(self.text())
 
-_NASAL = '\~'
+_NASAL = '\\~'
 _LONG = ':'
 _LABIALIZED = '^{w}'
 _NASAL_SUFFIX_1 = '^~'
 _NASAL_SUFFIX_2 = '^{~}'
 _NASAL_SUFFIX_3 = '~'
 _DIGRAPHS = ['kp', 'gb']
+# The marks that can follow a letter, in the order they are looked for.
+_LETTER_SUFFIXES = (
+    _NASAL_SUFFIX_1,
+    _NASAL_SUFFIX_2,
+    _NASAL_SUFFIX_3,
+    _LABIALIZED,
+    _LONG,
+)
+
+# Letters are shared for good: there are only as many of them as characters
+# (with their diacritics) in the corpus.
+_LETTERS = {}
+
+
+def collation_key(letters):
+  """
+  The sort key of a sequence of letters (a cluster, a syllable, ...), which
+  sorts sequences like comparing their letters one by one would.
+  """
+  return tuple(l.collation_key for l in letters)
+
 
 def make_letter(text):
+  letter = _LETTERS.get(text)
+  if letter is None:
+    letter = _LETTERS[text] = _make_letter(text)
+  return letter
+
+
+def _make_letter(text):
   is_labialized = False
   is_nasal = False
   is_long = False
@@ -334,107 +475,207 @@ def _clean_text(text):
   return processed_text
 
 def make_letters(text):
+  """
+  Splits `text` into letters, scanning it once without copying what is left
+  of it at every letter.
+  """
   result = []
-  processed_text = _clean_text(text)
-  while processed_text:
-    split = 1
-    if processed_text.startswith(_NASAL):
-      split = len(_NASAL)+1
-    elif any(processed_text.startswith(x) for x in _DIGRAPHS):
-      split = 2
-
-    letter = processed_text[:split]
-    rest = processed_text[split:]
-
-    for suffix in [
-        _NASAL_SUFFIX_1,
-        _NASAL_SUFFIX_2,
-        _NASAL_SUFFIX_3,
-        _LABIALIZED,
-        _LONG
-    ]:
-      if rest.startswith(suffix):
-        letter += rest[:len(suffix)]
-        rest = rest[len(suffix):]
-
-    result.append(make_letter(letter))
-    processed_text = rest
+  text = _clean_text(text)
+  length = len(text)
+  start = 0
+  while start < length:
+    end = start + 1
+    if text.startswith(_NASAL, start):
+      end = start + len(_NASAL) + 1
+    elif any(text.startswith(x, start) for x in _DIGRAPHS):
+      end = start + 2
+
+    for suffix in _LETTER_SUFFIXES:
+      if text.startswith(suffix, end):
+        end += len(suffix)
+
+    result.append(make_letter(text[start:end]))
+    start = end
   return result
 
 
+# Structurally identical syllables and morphemes are shared between all the
+# words they appear in ("hash-consing"), which saves memory and makes most
+# equality checks an identity check. They are only held weakly here, so those
+# no word (or count) uses any more are freed, and streaming through a corpus
+# keeps only the ones still in use.
+_SYLLABLES = weakref.WeakValueDictionary()
+_MORPHEMES = weakref.WeakValueDictionary()
+
+
+def make_syllable_from_letters(letters, tone):
+  """
+  The shared syllable of the sequence of `Letter`s `letters` and the tone
+  text `tone`, like `make_syllable` for letters already split.
+  """
+  key = (tuple(letters), tone)
+  syllable = _SYLLABLES.get(key)
+  if syllable is None:
+    syllable = _SYLLABLES[key] = Syllable(*key)
+  return syllable
+
+
 def make_syllable(text, tone):
-  return Syllable(make_letters(text), unicode(tone))
+  return make_syllable_from_letters(make_letters(text), str(tone))
+
 
+class SyllableRules(namedtuple('SyllableRules', ['max_onset',
+                                                   'merge_vowells'])):
+  """
+  How `syllabify` splits letters into syllables.
 
-def _syllable_letter_grouper(letters):
+  :param max_onset: The most consonants between two vowells that start the
+    second syllable (the others close the first one), or None for all of them.
+  :param bool merge_vowells: Whether adjacent vowells share a syllable.
   """
-  Takes a list of letters, and generates sub-lists of letters that are
-  valid syllables.
 
-  The algorithm is:
 
-  1) If there is only 1 vowell left in the remaining letters, return all
-     remaining letters.
-  2) Otherwise return all remaining letters until the first vowell.
+SYLLABLE_RULES = {
+  # Every syllable is its consonants up to a vowell, and the last one also
+  # takes the consonants after its vowell.
+  'default': SyllableRules(max_onset=None, merge_vowells=False),
+  # Only the last consonant between two vowells starts the second syllable:
+  # "kapta" is kap.ta rather than ka.pta.
+  'single-onset': SyllableRules(max_onset=1, merge_vowells=False),
+  # Adjacent vowells are a single nucleus: "siə" is one syllable.
+  'diphthongs': SyllableRules(max_onset=None, merge_vowells=True),
+}
+
+_default_rules = SYLLABLE_RULES['default']
 
-  :param letters: A list of Letter instances.
 
-  :yields: Lists of letters, 1 per syllable.
+def set_syllable_rules(name):
   """
-  vowell_count = sum(1 for l in letters if l.is_vowell())
-  letter_iterator = iter(letters)
-  while vowell_count > 1:
-    next_chunk = []
-    while True:
-      c = next(letter_iterator)
-      next_chunk.append(c)
-      if c.is_vowell():
-        break
-    vowell_count -= 1
-    yield next_chunk
-  yield list(x for x in letter_iterator)
+  Selects the rules (from `SYLLABLE_RULES`) `make_syllables` uses by default.
+  """
+  global _default_rules
+  _default_rules = SYLLABLE_RULES[name]
 
 
-class ToneTextSyllableMismatch(WordParseError):
-  pass
+# The states of the syllabifier: before the first vowell, right after a
+# vowell, and after the consonants following a vowell.
+_ONSET, _NUCLEUS, _CODA = range(3)
 
+# What to do with a letter: keep it for later, start a syllable with the kept
+# consonants and the letter, split the kept consonants between the current
+# syllable and a new one starting with the letter, or add the letter to the
+# current syllable.
+_KEEP, _START, _SPLIT, _JOIN = range(4)
 
-def _raise(ex):
-  raise ex
 
+def _transitions(rules):
+  """
+  The table of (next state, action) for every state and vowell flag.
+  """
+  return {
+    (_ONSET, False): (_ONSET, _KEEP),
+    (_ONSET, True): (_NUCLEUS, _START),
+    (_NUCLEUS, False): (_CODA, _KEEP),
+    (_NUCLEUS, True): (_NUCLEUS, _JOIN if rules.merge_vowells else _SPLIT),
+    (_CODA, False): (_CODA, _KEEP),
+    (_CODA, True): (_NUCLEUS, _SPLIT),
+  }
 
-def _count_syllables(text):
-  x = list(_syllable_letter_grouper(make_letters(text)))
-  if len(x) != 1:
-    return len(x)
-  if any(l.is_vowell() for l in x[0]):
-    return 1
-  return 0
+_TRANSITIONS = {rules: _transitions(rules) for rules in SYLLABLE_RULES.values()}
 
 
-def make_syllables(text, tones):
-  letters = make_letters(text)
+def syllabify(letters, rules=None):
+  """
+  Splits letters into the letters of syllables in a single pass over their
+  vowell flags.
 
-  return list(
-    Syllable(letters, unicode(tone))
-    if letters is not None and tone is not None
-    else _raise(ToneTextSyllableMismatch(
-      'Unequal number of syllables in text(%s) and tone(%s).' % (repr(text),
-                                                                 repr(tones))
-    ))
-    for letters, tone in izip_longest(
-      _syllable_letter_grouper(letters),
-      tones.split('.')
-    )
-  )
+  :param letters: An iterable of Letter instances.
+  :param SyllableRules rules: The rules to split by, or None for the ones
+    selected with `set_syllable_rules`.
+
+  :raises SyllablesMustHaveVowells: If there are no vowells.
+
+  :returns: A list of lists of letters, 1 per syllable.
+  """
+  if rules is None:
+    rules = _default_rules
+  transitions = _TRANSITIONS.get(rules)
+  if transitions is None:
+    transitions = _TRANSITIONS[rules] = _transitions(rules)
+  max_onset = rules.max_onset
+  syllables = []
+  current = None
+  kept = []
+  state = _ONSET
+  for letter in letters:
+    state, action = transitions[(state, letter.is_vowell())]
+    if action == _KEEP:
+      kept.append(letter)
+      continue
+    if action == _SPLIT:
+      coda = 0 if max_onset is None else max(0, len(kept) - max_onset)
+      current.extend(kept[:coda])
+      syllables.append(current)
+      kept = kept[coda:]
+    if action == _JOIN:
+      current.append(letter)
+    else:
+      kept.append(letter)
+      current = kept
+      kept = []
+  if state == _ONSET:
+    raise SyllablesMustHaveVowells(
+        'Letters %s do not have a vowell' % (kept,))
+  current.extend(kept)
+  syllables.append(current)
+  return syllables
+
+
+def iter_clusters(letter_iter):
+  """
+  Turns an iterator of letters into an iterator of "clusters" where a cluster
+  is defined as a list of consecutive consonants or a single vowell.
+  """
+  consonants = []
+  for letter in letter_iter:
+    if letter.is_vowell():
+      if consonants:
+        yield tuple(consonants)
+        consonants = []
+      yield tuple([letter])
+    else:
+      consonants.append(letter)
+  if consonants:
+    yield tuple(consonants)
+
+
+class ToneTextSyllableMismatch(WordParseError):
+  pass
+
+
+def make_syllables(text, tones, rules=None):
+  """
+  The syllables of `text`, split by `syllabify` with `rules`, with one tone
+  of the '.' separated `tones` each (or of the list `tones`).
+  """
+  letter_groups = syllabify(make_letters(text), rules)
+  if isinstance(tones, str):
+    tones = tones.split('.')
+  if len(letter_groups) != len(tones):
+    raise ToneTextSyllableMismatch(
+      'Unequal number of syllables in text(%s) and tone(%s).' % (
+        repr(text), repr('.'.join(tones))))
+  return [
+    make_syllable_from_letters(letters, str(tone))
+    for letters, tone in zip(letter_groups, tones)
+  ]
 
 def make_morpheme(text, gloss, is_particle=False, is_suffix=False):
-  return Morpheme(
-      make_letters(text),
-      gloss,
-      is_particle=is_particle,
-      is_suffix=is_suffix
-  )
+  key = (tuple(make_letters(text)), gloss, is_particle, is_suffix)
+  morpheme = _MORPHEMES.get(key)
+  if morpheme is None:
+    morpheme = _MORPHEMES[key] = Morpheme(*key)
+  return morpheme
 
 class MorphemeMismatch(WordParseError):
   pass
@@ -442,7 +683,7 @@ class MorphemeMismatch(WordParseError):
 def make_morphemes(texts, glosses):
   results = []
   have_root = False
-  for text, gloss in izip_longest(
+  for text, gloss in zip_longest(
       texts.split('-'), glosses.split('-')):
     if text is None or gloss is None:
       raise MorphemeMismatch(
@@ -465,14 +706,25 @@ def make_morphemes(texts, glosses):
 class BadIPATone(WordParseError):
   pass
 
+def _split_ipa(ipa):
+  try:
+    return split_annotation(ipa)
+  except BadToneAnnotation as e:
+    raise BadIPATone(*e.args)
+
 def make_word(ipa, gloss, category):
-  if not re.match(r'.*\^\{[0-9.-]+\}$', ipa):
-    raise BadIPATone("Could not extract tone from ipa(%s)" % repr(ipa))
-  breakpoint = ipa.rfind('^')
-  text = ipa[:breakpoint]
-  tone = ipa[breakpoint+2:-1].replace('-', '.')
+  text, tones = _split_ipa(ipa)
   return Word(
       make_morphemes(text, gloss),
-      make_syllables(text.replace('-', ''), tone),
+      make_syllables(text.replace('-', ''), tones),
       category
   )
+
+def check_word(ipa, gloss):
+  """
+  Raises the error `make_word` would raise for `ipa` and `gloss`, if any,
+  without building the word.
+  """
+  text, tones = _split_ipa(ipa)
+  make_morphemes(text, gloss)
+  make_syllables(text.replace('-', ''), tones)